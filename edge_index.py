@@ -0,0 +1,93 @@
+'''
+Grid index over network edges in lon/lat, used to assign edges to regions.
+
+All node coordinates of a NetSnapshot are projected to lon/lat in one
+vectorized pyproj call and every edge is bucketed by the grid cell of its
+midpoint. A region query only tests the edges of the cells its box overlaps,
+and the edge lists of a given region set are memoized.
+'''
+import numpy as np
+
+_indexes = {}
+
+
+def get_index(net):
+    """EdgeIndex of a NetSnapshot, built on first use and cached for the life of the snapshot."""
+    key = id(net)
+    if key not in _indexes or _indexes[key][0] is not net:
+        _indexes[key] = (net, EdgeIndex(net))
+    return _indexes[key][1]
+
+
+class EdgeIndex:
+    def __init__(self, net, cells_per_side=None):
+        node_lon, node_lat = net.convertXY2LonLat(net.node_xy[:, 0], net.node_xy[:, 1])
+        self.ids = net.edge_id_list()
+        frm = np.asarray(net.edge_from, dtype=np.int64)
+        to = np.asarray(net.edge_to, dtype=np.int64)
+        self.lon_s, self.lat_s = node_lon[frm], node_lat[frm]
+        self.lon_t, self.lat_t = node_lon[to], node_lat[to]
+        self._build_grid(cells_per_side)
+        self._memo = {}
+
+    def _build_grid(self, cells_per_side):
+        n = len(self.ids)
+        if cells_per_side is None:
+            cells_per_side = max(1, int(np.sqrt(n / 8)))
+        self.nx = self.ny = cells_per_side
+        mid_lon = (self.lon_s + self.lon_t) / 2
+        mid_lat = (self.lat_s + self.lat_t) / 2
+        if n:
+            self.lon0, self.lat0 = mid_lon.min(), mid_lat.min()
+            span_lon = max(mid_lon.max() - self.lon0, 1e-12)
+            span_lat = max(mid_lat.max() - self.lat0, 1e-12)
+        else:
+            self.lon0 = self.lat0 = 0.0
+            span_lon = span_lat = 1.0
+        self.dlon = span_lon / self.nx
+        self.dlat = span_lat / self.ny
+        cx = self._cell_x(mid_lon)
+        cy = self._cell_y(mid_lat)
+        cell = cx * self.ny + cy
+        self.order = np.argsort(cell, kind='stable')
+        self.starts = np.searchsorted(cell[self.order], np.arange(self.nx * self.ny + 1))
+
+    def _cell_x(self, lon):
+        return np.clip(((lon - self.lon0) / self.dlon).astype(np.int64), 0, self.nx - 1)
+
+    def _cell_y(self, lat):
+        return np.clip(((lat - self.lat0) / self.dlat).astype(np.int64), 0, self.ny - 1)
+
+    def query(self, latlon):
+        """
+        Indices (in network order) of the edges whose both end nodes lie in the
+        box (minlon, minlat, maxlon, maxlat).
+        """
+        minx, miny, maxx, maxy = latlon
+        if minx > maxx or miny > maxy or not self.ids:
+            return np.zeros(0, dtype=np.int64)
+        cx0, cx1 = self._cell_x(np.array([minx, maxx]))
+        cy0, cy1 = self._cell_y(np.array([miny, maxy]))
+        parts = [self.order[self.starts[cx * self.ny + cy0]:self.starts[cx * self.ny + cy1 + 1]]
+                 for cx in range(cx0, cx1 + 1)]
+        cand = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        inside = ((minx <= self.lon_s[cand]) & (self.lon_s[cand] <= maxx) &
+                  (miny <= self.lat_s[cand]) & (self.lat_s[cand] <= maxy) &
+                  (minx <= self.lon_t[cand]) & (self.lon_t[cand] <= maxx) &
+                  (miny <= self.lat_t[cand]) & (self.lat_t[cand] <= maxy))
+        return np.sort(cand[inside])
+
+    def edge_lists(self, res_areas, com_areas):
+        """Memoized per region set: residential and commercial edge ID lists."""
+        key = (tuple(tuple(v["latlon"]) for v in res_areas.values()),
+               tuple(tuple(v["latlon"]) for v in com_areas.values()))
+        if key not in self._memo:
+            boxes = {}
+            for box in key[0] + key[1]:
+                if box not in boxes:
+                    boxes[box] = [self.ids[i] for i in self.query(box).tolist()]
+            self._memo[key] = boxes
+        boxes = self._memo[key]
+        res_edge = {k: list(boxes[tuple(v["latlon"])]) for k, v in res_areas.items()}
+        com_edge = {k: list(boxes[tuple(v["latlon"])]) for k, v in com_areas.items()}
+        return res_edge, com_edge
@@ -0,0 +1,399 @@
+'''
+In-process shortest-path routing over a network snapshot, as an alternative
+to duarouter and traci.simulation.findRoute.
+
+The network is turned into an edge graph in CSR form (one vertex per
+non-internal edge, one arc per edge-to-edge connection) restricted to the
+edges a vClass may use, with the travel time length / min(speed, maxSpeed) as
+the cost of entering an edge. Queries run bidirectional A* with landmarks
+(ALT): a few landmark edges are chosen by farthest selection, their shortest
+distances to and from every edge are computed once and stored in the snapshot
+directory, and the triangle inequality over them gives the search potentials.
+Both directions use the average potential, so the search stops as soon as the
+two smallest queue keys sum to the best path found.
+
+    router = fast_router.Router(net_snapshot.load('new.net.xml'))
+    router.find_route('E1', 'E2', vclass='passenger')   # (edge IDs, seconds)
+
+Batch routing of a trip file and a comparison against duarouter:
+
+    python fast_router.py route --trips sim_dip.odtrips.xml --routes sim_dip.odtrips.rou.xml
+    python fast_router.py bench --trips sim_dip.odtrips.xml
+'''
+import argparse
+import heapq
+import math
+import os
+import shutil
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import net_snapshot
+import route_cache
+
+DEFAULT_LANDMARKS = 8
+ACTIVE_LANDMARKS = 4
+# Stands in for "unreachable" in landmark tables; keeps the potential arithmetic finite.
+UNREACHABLE = 1e15
+# Potentials this large prove an edge cannot lie on any s-t path.
+PRUNE = UNREACHABLE / 4
+MIN_SPEED = 0.1
+
+
+class RoutingGraph:
+    """
+    Edge graph of one vClass (and optional vType speed cap) in CSR form. With
+    metric='length' edges cost their length in m instead of their travel time.
+    """
+    def __init__(self, net, vclass='passenger', max_speed=None, metric='time'):
+        self.net = net
+        self.vclass = vclass
+        self.max_speed = max_speed
+        self.metric = metric
+        n = len(net.edge_ids)
+        allowed = net.allows(vclass)
+        speed = np.asarray(net.edge_speed, dtype=float)
+        if max_speed:
+            speed = np.minimum(speed, max_speed)
+        length = np.asarray(net.edge_length, dtype=float)
+        cost = length if metric == 'length' else length / np.maximum(speed, MIN_SPEED)
+        cost = np.where(allowed, cost, np.inf)
+        off = np.asarray(net.succ_offsets, dtype=np.int64)
+        succ = np.asarray(net.succ, dtype=np.int64)
+        src = np.repeat(np.arange(n, dtype=np.int64), np.diff(off))
+        keep = allowed[src] & allowed[succ]
+        src, dst = src[keep], succ[keep]
+        order = np.argsort(dst, kind='stable')
+        self.n = n
+        self.allowed = allowed
+        self.cost = cost
+        self.fwd_off = np.searchsorted(src, np.arange(n + 1)).tolist()
+        self.fwd = dst.tolist()
+        self.rev_off = np.searchsorted(dst[order], np.arange(n + 1)).tolist()
+        self.rev = src[order].tolist()
+        self._cost = cost.tolist()
+
+    @property
+    def key(self):
+        key = f"{self.vclass}_{self.max_speed or 'net'}"
+        return key if self.metric == 'time' else f"{key}_{self.metric}"
+
+    def distances(self, source, reverse=False):
+        """
+        Dijkstra from `source` over the whole graph: cost from the end of
+        `source` to the end of every edge, or with reverse=True from every edge
+        to the end of `source`. Unreachable edges get UNREACHABLE.
+        """
+        cost = self._cost
+        off, adj = (self.rev_off, self.rev) if reverse else (self.fwd_off, self.fwd)
+        dist = [UNREACHABLE] * self.n
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            step = d + cost[u] if reverse else d
+            for i in range(off[u], off[u + 1]):
+                v = adj[i]
+                nd = step if reverse else step + cost[v]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return np.array(dist)
+
+    def path_cost(self, edges):
+        """Travel time of a route given as edge rows, counting every edge on it."""
+        return float(self.cost[np.asarray(edges, dtype=np.int64)].sum())
+
+
+class Landmarks:
+    """Shortest distances from (`from_lm`) and to (`to_lm`) a few landmark edges, shape (k, n)."""
+    def __init__(self, graph, count=DEFAULT_LANDMARKS):
+        path = os.path.join(graph.net.path, f'landmarks_{graph.key}_{count}.npz')
+        if not os.path.exists(path):
+            ids, from_lm, to_lm = self.select(graph, count)
+            tmp = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp, ids=ids, from_lm=from_lm, to_lm=to_lm)
+            os.replace(tmp, path)
+        data = np.load(path)
+        self.ids = data['ids']
+        self.from_lm = data['from_lm']
+        self.to_lm = data['to_lm']
+        self._rows = None
+
+    @staticmethod
+    def select(graph, count):
+        """Farthest selection inside the largest strongly connected component of the class."""
+        candidates = np.nonzero(graph.net.routable(graph.vclass) & graph.allowed)[0]
+        ids, from_lm, to_lm = [], [], []
+        if not len(candidates):
+            return np.zeros(0, dtype=np.int64), np.zeros((0, graph.n)), np.zeros((0, graph.n))
+        # The edge farthest from an arbitrary start is the first landmark.
+        spread = graph.distances(int(candidates[0]))
+        for _ in range(min(count, len(candidates))):
+            lm = int(candidates[np.argmax(spread[candidates])])
+            ids.append(lm)
+            from_lm.append(graph.distances(lm))
+            to_lm.append(graph.distances(lm, reverse=True))
+            dist = from_lm[-1] + to_lm[-1]
+            spread = dist if len(ids) == 1 else np.minimum(spread, dist)
+            spread[ids] = -1
+        return np.array(ids, dtype=np.int64), np.vstack(from_lm), np.vstack(to_lm)
+
+    def potential(self, s, t, k=ACTIVE_LANDMARKS):
+        """
+        Potential function for an s-t query: the average of the forward and
+        reverse bounds from the k landmarks giving the tightest lower bound on
+        the s-t distance. Evaluated only for the edges the search reaches and
+        memoized for the query, so a short query stays cheap on a large network.
+        """
+        if not len(self.ids):
+            return lambda v: 0.0
+        if self._rows is None:
+            # Per-edge landmark distances as plain lists, built once per landmark set.
+            self._rows = (self.from_lm.T.tolist(), self.to_lm.T.tolist())
+        from_rows, to_rows = self._rows
+        bound = np.maximum(self.from_lm[:, t] - self.from_lm[:, s], self.to_lm[:, s] - self.to_lm[:, t])
+        act = np.argsort(-bound)[:k].tolist()
+        ends = [(a, from_rows[t][a], to_rows[t][a], from_rows[s][a], to_rows[s][a]) for a in act]
+        memo = {}
+
+        def potential(v):
+            p = memo.get(v)
+            if p is None:
+                fv, tv = from_rows[v], to_rows[v]
+                to_t = from_s = -math.inf
+                for a, ft, tt, fs, ts in ends:
+                    f, r = fv[a], tv[a]
+                    x = ft - f if ft - f > r - tt else r - tt
+                    if x > to_t:
+                        to_t = x
+                    x = f - fs if f - fs > ts - r else ts - r
+                    if x > from_s:
+                        from_s = x
+                p = memo[v] = ((to_t if to_t > 0.0 else 0.0) - (from_s if from_s > 0.0 else 0.0)) / 2
+            return p
+        return potential
+
+
+class Router:
+    """Shortest-path queries over a NetSnapshot, one graph and landmark set per (vClass, max speed)."""
+    def __init__(self, net, landmarks=DEFAULT_LANDMARKS):
+        self.net = net
+        self.landmark_count = landmarks
+        self._graphs = {}
+        self.settled = 0
+
+    def graph(self, vclass='passenger', max_speed=None):
+        key = (vclass, max_speed)
+        if key not in self._graphs:
+            g = RoutingGraph(self.net, vclass, max_speed)
+            self._graphs[key] = (g, Landmarks(g, self.landmark_count))
+        return self._graphs[key]
+
+    def find_route(self, from_edge, to_edge, vclass='passenger', max_speed=None):
+        """(edge IDs, travel time in s) of the fastest route, or None when there is none."""
+        ids = self.net.edge_id_list()
+        found = self.route_rows(self.net.edge_code(from_edge), self.net.edge_code(to_edge), vclass, max_speed)
+        if found is None:
+            return None
+        rows, travel_time = found
+        return [ids[r] for r in rows], travel_time
+
+    def route_rows(self, s, t, vclass='passenger', max_speed=None):
+        """Same as find_route on edge rows."""
+        g, lm = self.graph(vclass, max_speed)
+        cost = g._cost
+        if not (g.allowed[s] and g.allowed[t]):
+            return None
+        if s == t:
+            return [s], cost[s]
+        potential = lm.potential(s, t)
+        fo, fa, ro, ra = g.fwd_off, g.fwd, g.rev_off, g.rev
+        df, dr = {s: 0.0}, {t: 0.0}
+        pred, succ = {s: -1}, {t: -1}
+        heap_f, heap_r = [(potential(s), s)], [(-potential(t), t)]
+        done_f, done_r = set(), set()
+        mu, meet = math.inf, -1
+        while heap_f and heap_r:
+            if heap_f[0][0] + heap_r[0][0] >= mu:
+                break
+            if heap_f[0][0] <= heap_r[0][0]:
+                _, u = heapq.heappop(heap_f)
+                if u in done_f:
+                    continue
+                done_f.add(u)
+                du = df[u]
+                for i in range(fo[u], fo[u + 1]):
+                    v = fa[i]
+                    nd = du + cost[v]
+                    if nd < df.get(v, math.inf) and potential(v) < PRUNE:
+                        df[v] = nd
+                        pred[v] = u
+                        heapq.heappush(heap_f, (nd + potential(v), v))
+                        if v in dr and nd + dr[v] < mu:
+                            mu, meet = nd + dr[v], v
+            else:
+                _, u = heapq.heappop(heap_r)
+                if u in done_r:
+                    continue
+                done_r.add(u)
+                nd = dr[u] + cost[u]
+                for i in range(ro[u], ro[u + 1]):
+                    v = ra[i]
+                    if nd < dr.get(v, math.inf) and potential(v) > -PRUNE:
+                        dr[v] = nd
+                        succ[v] = u
+                        heapq.heappush(heap_r, (nd - potential(v), v))
+                        if v in df and df[v] + nd < mu:
+                            mu, meet = df[v] + nd, v
+        self.settled += len(done_f) + len(done_r)
+        if meet < 0:
+            return None
+        rows = []
+        v = meet
+        while v >= 0:
+            rows.append(v)
+            v = pred[v]
+        rows.reverse()
+        v = succ[meet]
+        while v >= 0:
+            rows.append(v)
+            v = succ[v]
+        return rows, cost[s] + mu
+
+
+def vtype_classes(vtypes):
+    """vType id -> (vClass, maxSpeed or None) from vType XML texts; unknown types route as passenger."""
+    classes = {}
+    for text in vtypes:
+        elem = ET.fromstring(text)
+        speed = elem.get('maxSpeed')
+        classes[elem.get('id')] = (elem.get('vClass', 'passenger'), float(speed) if speed else None)
+    return classes
+
+
+_worker = {}
+
+
+def _init_worker(net_path, net_hash, classes):
+    _worker['router'] = Router(net_snapshot.NetSnapshot(net_path, net_hash))
+    _worker['classes'] = classes
+
+
+def _route_keys(keys):
+    router, classes = _worker['router'], _worker['classes']
+    net = router.net
+    ids = net.edge_id_list()
+    out = {}
+    for key in keys:
+        vtype, src, dst, _ = key
+        vclass, max_speed = classes.get(vtype, ('passenger', None))
+        try:
+            found = router.route_rows(net.edge_code(src), net.edge_code(dst), vclass, max_speed)
+        except KeyError:
+            found = None
+        out[key] = ' '.join(ids[r] for r in found[0]) if found else ''
+    return out
+
+
+def route_pairs(keys, vtypes, net_file, bucket_seconds=None, workers=1):
+    """Drop-in for route_cache.route_pairs answering every key in-process; unroutable keys map to ''."""
+    net = net_snapshot.load(net_file)
+    classes = vtype_classes(vtypes)
+    keys = sorted(keys)
+    # Landmarks are built once here, so worker processes only load them.
+    router = Router(net)
+    for vclass, max_speed in {classes.get(k[0], ('passenger', None)) for k in keys}:
+        router.graph(vclass, max_speed)
+    if workers == 1 or len(keys) < 2:
+        _worker['router'], _worker['classes'] = router, classes
+        return _route_keys(keys)
+    workers = workers or os.cpu_count() or 1
+    chunk = math.ceil(len(keys) / (workers * 4))
+    routes = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(net.path, net.hash, classes)) as pool:
+        for part in pool.map(_route_keys, [keys[i:i + chunk] for i in range(0, len(keys), chunk)]):
+            routes.update(part)
+    return routes
+
+
+def route_trips(trips_file='sim_dip.odtrips.xml', routes_file='sim_dip.odtrips.rou.xml',
+                net_file='new.net.xml', workers=1):
+    """Route a trip file in-process, each unique (vType, from, to) pair once."""
+    t0 = time.time()
+    vtypes, keys, n = route_cache.scan_trips(trips_file)
+    routes = route_pairs(keys, vtypes, net_file, workers=workers)
+    print(f"[INFO] {n} trips over {len(keys)} unique OD pairs routed in {time.time() - t0:.1f} s")
+    written, _ = route_cache.expand_routes(trips_file, routes_file, routes)
+    print(f"[INFO] Wrote {written} routes to {routes_file} in {time.time() - t0:.1f} s")
+    return written
+
+
+def benchmark(trips_file='sim_dip.odtrips.xml', net_file='new.net.xml', limit=None, workers=1):
+    """
+    Route the unique OD pairs of a trip file with both engines and report the
+    run times, how many routes are identical, and how the travel times of the
+    differing ones compare under this module's cost model.
+    """
+    vtypes, keys, _ = route_cache.scan_trips(trips_file)
+    keys = sorted(keys)[:limit]
+    t0 = time.time()
+    fast = route_pairs(keys, vtypes, net_file, workers=workers)
+    t_fast = time.time() - t0
+    print(f"[INFO] fast_router: {len(keys)} OD pairs in {t_fast:.2f} s")
+    if shutil.which('duarouter') is None:
+        print("[WARN] duarouter not found on PATH; skipping the comparison")
+        return
+    t0 = time.time()
+    dua = route_cache.route_pairs(keys, vtypes, net_file, workers=workers)
+    t_dua = time.time() - t0
+    print(f"[INFO] duarouter:   {len(keys)} OD pairs in {t_dua:.2f} s "
+          f"(fast_router speedup {t_dua / max(t_fast, 1e-9):.1f}x)")
+
+    net = net_snapshot.load(net_file)
+    classes = vtype_classes(vtypes)
+    router = Router(net)
+    same = only_fast = only_dua = 0
+    ratios = []
+    for key in keys:
+        a, b = fast[key], dua[key]
+        if a == b:
+            same += 1
+        elif not b:
+            only_fast += 1
+        elif not a:
+            only_dua += 1
+        else:
+            g, _ = router.graph(*classes.get(key[0], ('passenger', None)))
+            cost_a = g.path_cost([net.edge_code(e) for e in a.split()])
+            cost_b = g.path_cost([net.edge_code(e) for e in b.split()])
+            ratios.append(cost_b / cost_a)
+    print(f"[INFO] identical routes: {same}/{len(keys)}; routed by one engine only: "
+          f"fast {only_fast}, duarouter {only_dua}")
+    if ratios:
+        ratios = np.array(ratios)
+        print(f"[INFO] differing routes: {len(ratios)}, duarouter/fast travel time "
+              f"median {np.median(ratios):.3f}, max {ratios.max():.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process ALT routing over a MaSVeT network snapshot")
+    parser.add_argument("command", choices=["route", "bench"])
+    parser.add_argument("--trips", default="sim_dip.odtrips.xml")
+    parser.add_argument("--routes", default="sim_dip.odtrips.rou.xml")
+    parser.add_argument("--net", default="new.net.xml")
+    parser.add_argument("--workers", type=int, default=1, help="routing processes (0 = one per core)")
+    parser.add_argument("--limit", type=int, default=None, help="bench: number of OD pairs to compare")
+    args = parser.parse_args()
+    if args.command == "route":
+        route_trips(args.trips, args.routes, args.net, args.workers)
+    else:
+        benchmark(args.trips, args.net, args.limit, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+'''
+Compiled, memory-mapped snapshot of a SUMO network.
+
+The first load of a .net.xml parses it once and stores its edges, lanes,
+junctions, connections and <location> metadata as plain NumPy arrays in
+.masvet_cache/<sha256 of the file>/ next to the network. Later loads of the
+same content map those arrays from disk and skip XML parsing entirely:
+
+    snap = net_snapshot.load('new.net.xml')
+    snap.edge_ids          # non-internal edge IDs in file order
+    snap.node_xy           # junction coordinates, shape (N, 2)
+    snap.lane_shape(i)     # (k, 2) array of lane i's shape
+
+Internal edges (function="internal") and their lanes are left out, matching
+sumolib.net.readNet's default.
+'''
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+import numpy as np
+
+FORMAT_VERSION = 1
+CACHE_DIR_NAME = '.masvet_cache'
+
+# SUMO vehicle classes, one bit each in the allow masks.
+VCLASSES = (
+    'private', 'emergency', 'authority', 'army', 'vip', 'pedestrian', 'passenger',
+    'hov', 'taxi', 'bus', 'coach', 'delivery', 'truck', 'trailer', 'motorcycle',
+    'moped', 'bicycle', 'evehicle', 'tram', 'rail_urban', 'rail', 'rail_electric',
+    'rail_fast', 'ship', 'container', 'cable_car', 'subway', 'aircraft', 'wheelchair',
+    'scooter', 'drone', 'custom1', 'custom2',
+)
+VCLASS_BIT = {name: 1 << i for i, name in enumerate(VCLASSES)}
+ALL_VCLASSES = (1 << len(VCLASSES)) - 1
+
+ARRAYS = (
+    'edge_ids', 'edge_from', 'edge_to', 'edge_length', 'edge_speed', 'edge_lanes',
+    'edge_allow', 'edge_shape_lane',
+    'lane_ids', 'lane_edge', 'lane_index', 'lane_length', 'lane_speed', 'lane_allow',
+    'lane_shape_offsets', 'lane_shape_xy',
+    'node_ids', 'node_xy',
+    'succ_offsets', 'succ',
+)
+
+_hash_memo = {}
+
+
+def vclass_mask(allow, disallow):
+    """Bit mask of the vClasses a lane admits, following SUMO's allow/disallow rules."""
+    if allow:
+        if allow == 'all':
+            return ALL_VCLASSES
+        return sum(VCLASS_BIT.get(v, 0) for v in set(allow.split()))
+    if disallow:
+        if disallow == 'all':
+            return 0
+        return ALL_VCLASSES & ~sum(VCLASS_BIT.get(v, 0) for v in set(disallow.split()))
+    return ALL_VCLASSES
+
+
+def largest_scc(offsets, succ, active):
+    """
+    Boolean mask of the largest strongly connected component of the edge graph
+    given in CSR form (offsets, succ), restricted to the `active` edges.
+    Iterative Tarjan, so deep networks do not hit the recursion limit.
+    """
+    n = len(active)
+    off = np.asarray(offsets).tolist()
+    nxt = np.asarray(succ).tolist()
+    act = np.asarray(active).tolist()
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack = []
+    best = []
+    counter = 0
+    for root in range(n):
+        if not act[root] or index[root] != -1:
+            continue
+        index[root] = low[root] = counter; counter += 1
+        stack.append(root); on_stack[root] = True
+        work = [(root, off[root])]
+        while work:
+            v, i = work[-1]
+            end = off[v + 1]
+            while i < end:
+                w = nxt[i]; i += 1
+                if not act[w]:
+                    continue
+                if index[w] == -1:
+                    work[-1] = (v, i)
+                    index[w] = low[w] = counter; counter += 1
+                    stack.append(w); on_stack[w] = True
+                    work.append((w, off[w]))
+                    break
+                if on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                work.pop()
+                if low[v] == index[v]:
+                    comp = []
+                    while True:
+                        w = stack.pop(); on_stack[w] = False; comp.append(w)
+                        if w == v:
+                            break
+                    if len(comp) > len(best):
+                        best = comp
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+    mask = np.zeros(n, dtype=bool)
+    mask[best] = True
+    return mask
+
+
+def file_hash(path):
+    """sha256 of the file content, remembered per (path, size, mtime) within the process."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _hash_memo:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 22), b''):
+                h.update(chunk)
+        _hash_memo[key] = h.hexdigest()
+    return _hash_memo[key]
+
+
+def _open_xml(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _parse(net_file):
+    location = {}
+    edges = []          # (id, from, to, first lane row)
+    lanes = []          # (id, edge row, index, length, speed, allow mask)
+    shapes = []
+    nodes = {}
+    connections = set()
+    edge_row = None
+    with _open_xml(net_file) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            tag = elem.tag
+            if event == 'start':
+                if tag == 'edge':
+                    if elem.get('function') == 'internal':
+                        edge_row = None
+                    else:
+                        edge_row = len(edges)
+                        edges.append((elem.get('id'), elem.get('from'), elem.get('to'), len(lanes)))
+                continue
+            if tag == 'lane':
+                if edge_row is not None:
+                    lanes.append((elem.get('id'), edge_row, int(elem.get('index', 0)),
+                                  float(elem.get('length', 0)), float(elem.get('speed', 0)),
+                                  vclass_mask(elem.get('allow'), elem.get('disallow'))))
+                    shapes.append([tuple(map(float, p.split(',')[:2]))
+                                   for p in elem.get('shape', '').split()])
+            elif tag == 'edge':
+                edge_row = None
+                root.clear()
+            elif tag == 'junction':
+                nodes[elem.get('id')] = (float(elem.get('x')), float(elem.get('y')))
+                root.clear()
+            elif tag == 'connection':
+                frm = elem.get('from')
+                if not frm.startswith(':'):
+                    connections.add((frm, elem.get('to')))
+                root.clear()
+            elif tag == 'location':
+                location = dict(elem.attrib)
+                root.clear()
+    return location, edges, lanes, shapes, nodes, connections
+
+
+def build(net_file, out_dir):
+    """Parse `net_file` and write its snapshot arrays and meta.json into `out_dir`."""
+    location, edges, lanes, shapes, nodes, connections = _parse(net_file)
+
+    node_ids = list(nodes)
+    node_pos = {n: i for i, n in enumerate(node_ids)}
+    edge_ids = [e[0] for e in edges]
+    edge_pos = {e: i for i, e in enumerate(edge_ids)}
+    n_edges = len(edges)
+
+    lane_edge = np.array([l[1] for l in lanes], dtype=np.int32)
+    lane_allow = np.array([l[5] for l in lanes], dtype=np.uint64)
+    edge_lanes = np.bincount(lane_edge, minlength=n_edges).astype(np.int16)
+    first_lane = np.array([e[3] for e in edges], dtype=np.int64)
+    edge_allow = np.zeros(n_edges, dtype=np.uint64)
+    np.bitwise_or.at(edge_allow, lane_edge, lane_allow)
+    lane_length = np.array([l[3] for l in lanes], dtype=float)
+    lane_speed = np.array([l[4] for l in lanes], dtype=float)
+
+    succ_pairs = sorted((edge_pos[a], edge_pos[b]) for a, b in connections
+                        if a in edge_pos and b in edge_pos)
+    succ_from = np.array([p[0] for p in succ_pairs], dtype=np.int64)
+    succ_offsets = np.searchsorted(succ_from, np.arange(n_edges + 1)).astype(np.int64)
+
+    shape_len = np.array([len(s) for s in shapes], dtype=np.int64)
+    shape_offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+    np.cumsum(shape_len, out=shape_offsets[1:])
+
+    arrays = {
+        'edge_ids': np.array(edge_ids, dtype=str),
+        'edge_from': np.array([node_pos[e[1]] for e in edges], dtype=np.int32),
+        'edge_to': np.array([node_pos[e[2]] for e in edges], dtype=np.int32),
+        'edge_length': lane_length[first_lane] if n_edges else np.zeros(0),
+        'edge_speed': lane_speed[first_lane] if n_edges else np.zeros(0),
+        'edge_lanes': edge_lanes,
+        'edge_allow': edge_allow,
+        'edge_shape_lane': (first_lane + edge_lanes // 2).astype(np.int64),
+        'lane_ids': np.array([l[0] for l in lanes], dtype=str),
+        'lane_edge': lane_edge,
+        'lane_index': np.array([l[2] for l in lanes], dtype=np.int16),
+        'lane_length': lane_length,
+        'lane_speed': lane_speed,
+        'lane_allow': lane_allow,
+        'lane_shape_offsets': shape_offsets,
+        'lane_shape_xy': np.array([p for s in shapes for p in s], dtype=float).reshape(-1, 2),
+        'node_ids': np.array(node_ids, dtype=str),
+        'node_xy': np.array([nodes[n] for n in node_ids], dtype=float).reshape(-1, 2),
+        'succ_offsets': succ_offsets,
+        'succ': np.array([p[1] for p in succ_pairs], dtype=np.int32),
+    }
+    for name, arr in arrays.items():
+        np.save(os.path.join(out_dir, name + '.npy'), arr)
+    meta = {
+        'version': FORMAT_VERSION,
+        'net_file': os.path.abspath(net_file),
+        'location': location,
+        'vclasses': list(VCLASSES),
+        'edges': n_edges,
+        'lanes': len(lanes),
+        'nodes': len(node_ids),
+    }
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+class NetSnapshot:
+    def __init__(self, path, net_hash):
+        self.path = path
+        self.hash = net_hash
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        for name in ARRAYS:
+            setattr(self, '_' + name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        self._edge_id_list = None
+        self._edge_code = None
+        self._proj = None
+
+    def __reduce__(self):
+        # Worker processes re-map the arrays instead of receiving copies.
+        return (NetSnapshot, (self.path, self.hash))
+
+    def __getattr__(self, name):
+        # Arrays are exposed without the leading underscore.
+        if name in ARRAYS:
+            return self.__dict__['_' + name]
+        raise AttributeError(name)
+
+    @property
+    def location(self):
+        return self.meta['location']
+
+    @property
+    def net_offset(self):
+        return tuple(map(float, self.location['netOffset'].split(',')))
+
+    def getLocationOffset(self):
+        return self.net_offset
+
+    def getBoundary(self):
+        return list(map(float, self.location['convBoundary'].split(',')))
+
+    def edge_id_list(self):
+        if self._edge_id_list is None:
+            self._edge_id_list = self._edge_ids.tolist()
+        return self._edge_id_list
+
+    def edge_code(self, edge_id):
+        if self._edge_code is None:
+            self._edge_code = {e: i for i, e in enumerate(self.edge_id_list())}
+        return self._edge_code[edge_id]
+
+    def lane_shape(self, i):
+        return self._lane_shape_xy[self._lane_shape_offsets[i]:self._lane_shape_offsets[i + 1]]
+
+    def allows(self, vclass):
+        """Boolean mask of the edges with at least one lane open to `vclass`."""
+        return (self._edge_allow & np.uint64(VCLASS_BIT[vclass])) != 0
+
+    def routable(self, vclass):
+        """
+        Edges open to `vclass` that lie in the largest strongly connected
+        component of the edge graph restricted to that class, i.e. edges from
+        and to which the class can always be routed. Permissions are taken
+        per edge (any lane open), connections per edge pair. Computed once
+        and stored in the snapshot directory.
+        """
+        path = os.path.join(self.path, f'routable_{vclass}.npy')
+        if not os.path.exists(path):
+            mask = largest_scc(self._succ_offsets, self._succ, self.allows(vclass))
+            tmp = f"{path}.{os.getpid()}.tmp.npy"
+            np.save(tmp, mask)
+            os.replace(tmp, path)
+        return np.load(path)
+
+    def getGeoProj(self):
+        if self._proj is None:
+            import pyproj
+            self._proj = pyproj.Proj(self.location['projParameter'])
+        return self._proj
+
+    def convertXY2LonLat(self, x, y):
+        """Same as sumolib's Net.convertXY2LonLat; also accepts arrays."""
+        off_x, off_y = self.net_offset
+        lon, lat = self.getGeoProj()(np.asarray(x) - off_x, np.asarray(y) - off_y, inverse=True)
+        if np.ndim(lon) == 0:
+            return float(lon), float(lat)
+        return np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+
+
+def cache_dir_for(net_file):
+    return os.path.join(os.path.dirname(os.path.abspath(net_file)), CACHE_DIR_NAME)
+
+
+def load(net_file, cache_dir=None):
+    """
+    Snapshot of `net_file`, built on first use and keyed by its content hash,
+    so an edited network is never served from a stale cache.
+    """
+    net_hash = file_hash(net_file)
+    cache_dir = cache_dir or cache_dir_for(net_file)
+    path = os.path.join(cache_dir, net_hash)
+    meta = os.path.join(path, 'meta.json')
+    if os.path.exists(meta):
+        with open(meta) as f:
+            if json.load(f).get('version') == FORMAT_VERSION:
+                return NetSnapshot(path, net_hash)
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=net_hash + '.', dir=cache_dir)
+    try:
+        build(net_file, tmp)
+        os.replace(tmp, path)
+    except OSError:
+        # Another process finished the same snapshot first.
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(meta):
+            raise
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return NetSnapshot(path, net_hash)
@@ -0,0 +1,133 @@
+'''
+Tiled, level-of-detail image pyramid of a network for the region drawing canvas.
+
+Level z covers the (squared) network boundary with 2^z x 2^z tiles of TILE
+pixels, north up. Each tile is rendered on first request from the edges that
+overlap it, with sub-pixel edges dropped and shapes snapped to whole pixels for
+that level, then saved as PNG under the network snapshot directory. Because the
+snapshot directory is keyed by the network's content hash, cached tiles are
+reused across launches and never outlive the network they were drawn from.
+'''
+import os
+import numpy as np
+from PIL import Image, ImageDraw
+
+TILE = 256
+# Edges whose bounding box is smaller than this many pixels are skipped on a level.
+MIN_EDGE_PIXELS = 1.0
+
+
+class TilePyramid:
+    def __init__(self, net, max_level=8, tile_dir=None):
+        self.net = net
+        self.max_level = max_level
+        self.dir = tile_dir or os.path.join(net.path, 'tiles')
+        xmin, ymin, xmax, ymax = net.getBoundary()
+        self.size = max(xmax - xmin, ymax - ymin) or 1.0
+        self.x0 = xmin
+        self.top = ymax
+        self._levels = {}
+        self._edge_bbox = None
+
+    def resolution(self, z):
+        """World units per pixel on level z."""
+        return self.size / (TILE * 2 ** z)
+
+    def tiles_per_side(self, z):
+        return 2 ** z
+
+    def pixel_to_world(self, z, px, py):
+        res = self.resolution(z)
+        return self.x0 + px * res, self.top - py * res
+
+    def world_to_pixel(self, z, x, y):
+        res = self.resolution(z)
+        return (x - self.x0) / res, (self.top - y) / res
+
+    def _bboxes(self):
+        if self._edge_bbox is None:
+            net = self.net
+            lanes = np.asarray(net.edge_shape_lane)
+            off = np.asarray(net.lane_shape_offsets)
+            xy = np.asarray(net.lane_shape_xy)
+            keep = np.nonzero(off[lanes + 1] > off[lanes])[0]
+            xs, ys = xy[:, 0], xy[:, 1]
+            # reduceat needs increasing indices, so reduce over all lanes and pick the shape lanes.
+            all_starts = off[:-1]
+            valid = off[1:] > all_starts
+            lane_minx = np.full(len(all_starts), np.inf); lane_maxx = np.full(len(all_starts), -np.inf)
+            lane_miny = np.full(len(all_starts), np.inf); lane_maxy = np.full(len(all_starts), -np.inf)
+            if len(xs):
+                idx = all_starts[valid]
+                lane_minx[valid] = np.minimum.reduceat(xs, idx)
+                lane_maxx[valid] = np.maximum.reduceat(xs, idx)
+                lane_miny[valid] = np.minimum.reduceat(ys, idx)
+                lane_maxy[valid] = np.maximum.reduceat(ys, idx)
+            l = lanes[keep]
+            self._edge_bbox = (keep, lane_minx[l], lane_miny[l], lane_maxx[l], lane_maxy[l])
+        return self._edge_bbox
+
+    def _level(self, z):
+        """Edges bucketed by the tiles they overlap on level z, sorted by tile number."""
+        if z not in self._levels:
+            edges, minx, miny, maxx, maxy = self._bboxes()
+            res = self.resolution(z)
+            if z < self.max_level:
+                big = np.maximum(maxx - minx, maxy - miny) >= res * MIN_EDGE_PIXELS
+                edges, minx, miny, maxx, maxy = edges[big], minx[big], miny[big], maxx[big], maxy[big]
+            span = res * TILE
+            n = self.tiles_per_side(z)
+            tx0 = np.clip(((minx - self.x0) / span).astype(np.int64), 0, n - 1)
+            tx1 = np.clip(((maxx - self.x0) / span).astype(np.int64), 0, n - 1)
+            ty0 = np.clip(((self.top - maxy) / span).astype(np.int64), 0, n - 1)
+            ty1 = np.clip(((self.top - miny) / span).astype(np.int64), 0, n - 1)
+            w = tx1 - tx0 + 1
+            counts = w * (ty1 - ty0 + 1)
+            rep = np.repeat(np.arange(len(edges)), counts)
+            first = np.repeat(np.cumsum(counts) - counts, counts)
+            k = np.arange(len(rep)) - first
+            tile = (ty0[rep] + k // w[rep]) * n + tx0[rep] + k % w[rep]
+            order = np.argsort(tile, kind='stable')
+            self._levels[z] = (tile[order], edges[rep[order]])
+        return self._levels[z]
+
+    def tile_path(self, z, tx, ty):
+        return os.path.join(self.dir, str(z), f"{tx}_{ty}.png")
+
+    def get_tile(self, z, tx, ty):
+        """Tile (tx, ty) of level z as a PIL image, rendered and cached on first use."""
+        path = self.tile_path(z, tx, ty)
+        if os.path.exists(path):
+            return Image.open(path)
+        img = self.render_tile(z, tx, ty)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        img.save(tmp, format="PNG")
+        os.replace(tmp, path)
+        return img
+
+    def render_tile(self, z, tx, ty):
+        tiles, edges = self._level(z)
+        key = ty * self.tiles_per_side(z) + tx
+        a, b = np.searchsorted(tiles, [key, key + 1])
+        img = Image.new("L", (TILE, TILE), 255)
+        draw = ImageDraw.Draw(img)
+        res = self.resolution(z)
+        ox, oy = tx * TILE, ty * TILE
+        net = self.net
+        lanes = np.asarray(net.edge_shape_lane)
+        off = net.lane_shape_offsets
+        for e in edges[a:b].tolist():
+            lane = lanes[e]
+            pts = np.asarray(net.lane_shape_xy[off[lane]:off[lane + 1]])
+            px = np.rint((pts[:, 0] - self.x0) / res - ox).astype(np.int64)
+            py = np.rint((self.top - pts[:, 1]) / res - oy).astype(np.int64)
+            # Snap to whole pixels and drop repeated points: the per-level simplification.
+            keep = np.ones(len(px), dtype=bool)
+            keep[1:] = (np.diff(px) != 0) | (np.diff(py) != 0)
+            px, py = px[keep], py[keep]
+            if len(px) == 1:
+                draw.point((int(px[0]), int(py[0])), fill=0)
+            else:
+                draw.line(list(zip(px.tolist(), py.tolist())), fill=0, width=1)
+        return img
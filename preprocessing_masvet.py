@@ -150,6 +150,7 @@ print("Filtering completed: ev_stations.osm.xml created.")
 import xml.etree.ElementTree as ET
 import sumolib
 import logging
+import net_snapshot
 from pyproj import Transformer
 import xml.dom.minidom
 
@@ -161,12 +162,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
-net = sumolib.net.readNet('city.net.xml')
-tree = ET.parse('city.net.xml')
-root = tree.getroot()
-location = root.find('location')
-proj_params = location.attrib['projParameter']
-netOffset = tuple(map(float, location.attrib['netOffset'].split(',')))
+# Builds the network snapshot that later stages load instead of the XML.
+net = net_snapshot.load('city.net.xml')
+proj_params = net.location['projParameter']
+netOffset = net.net_offset
 
 transformer = Transformer.from_crs("epsg:4326", proj_params, always_xy=True)
 
@@ -0,0 +1,204 @@
+'''
+Persistent origin-destination route cache in front of duarouter.
+
+Generated trips draw their edges from a finite set of region edges, so a
+multi-day trip file repeats the same (from, to) pairs many times. route_cached()
+reduces the trips to unique (vType, from, to, time bucket) keys, looks them up
+in an SQLite store next to the network (.masvet_cache/routes.sqlite, rows keyed
+by the network's content hash and a digest of each vType's definition as well),
+routes only the misses with duarouter
+and writes the .rou.xml by expanding the cached routes onto every trip:
+
+    python route_generator.py --cache
+
+Pairs duarouter cannot connect are stored with an empty route, and their trips
+are left out of the output just as duarouter --ignore-errors would.
+'''
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import net_snapshot
+import route_generator
+
+DB_NAME = 'routes.sqlite'
+DEFAULT_VTYPE = 'DEFAULT_VEHTYPE'
+# Trip attributes that describe the route and are replaced by the <route> child.
+ROUTE_ATTRS = ('from', 'to', 'via', 'fromTaz', 'toTaz', 'fromJunction', 'toJunction')
+
+
+def cache_path_for(net_file):
+    return os.path.join(net_snapshot.cache_dir_for(net_file), DB_NAME)
+
+
+def vtype_digests(vtypes):
+    """vType ID -> digest of its definition, for vType definitions given as XML text."""
+    digests = {}
+    for text in vtypes:
+        h = hashlib.blake2b(text.strip().encode(), digest_size=12)
+        digests[ET.fromstring(text).get('id')] = h.hexdigest()
+    return digests
+
+
+class RouteCache:
+    def __init__(self, path, net_hash, vtype_digests=None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS routes ("
+                        "net TEXT, vtype TEXT, src TEXT, dst TEXT, bucket INTEGER, edges TEXT, "
+                        "PRIMARY KEY (net, vtype, src, dst, bucket)) WITHOUT ROWID")
+        self.db.execute("CREATE TEMP TABLE wanted (vtype TEXT, src TEXT, dst TEXT, bucket INTEGER)")
+        self.net = net_hash
+        # Rows of a vType are stored under its ID and definition digest, so editing a
+        # vType (vClass, speed factor, ...) never returns routes computed for the old one.
+        self.vtypes = {vtype: f"{vtype}#{digest}" for vtype, digest in (vtype_digests or {}).items()}
+
+    def _row_key(self, key):
+        return (self.vtypes.get(key[0], key[0]),) + tuple(key[1:])
+
+    def lookup(self, keys):
+        """Cached routes of the given (vtype, src, dst, bucket) keys, as key -> space-separated edges."""
+        wanted = {self._row_key(key): key for key in keys}
+        cur = self.db.cursor()
+        cur.execute("DELETE FROM wanted")
+        cur.executemany("INSERT INTO wanted VALUES (?, ?, ?, ?)", wanted)
+        rows = cur.execute("SELECT w.vtype, w.src, w.dst, w.bucket, r.edges FROM wanted w JOIN routes r "
+                           "ON r.net = ? AND r.vtype = w.vtype AND r.src = w.src AND r.dst = w.dst "
+                           "AND r.bucket = w.bucket", (self.net,))
+        return {wanted[row[:4]]: row[4] for row in rows}
+
+    def store(self, routes):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?, ?, ?)",
+                                [(self.net,) + self._row_key(key) + (edges,) for key, edges in routes.items()])
+
+    def close(self):
+        self.db.close()
+
+
+def trip_key(elem, bucket_seconds=None):
+    """Cache key of a <trip>, or None for elements that do not route by (from, to)."""
+    if elem.tag != 'trip' or elem.get('from') is None or elem.get('to') is None or elem.get('via'):
+        return None
+    bucket = int(route_generator.depart_of(elem) // bucket_seconds) if bucket_seconds else 0
+    return (elem.get('type', DEFAULT_VTYPE), elem.get('from'), elem.get('to'), bucket)
+
+
+def route_edges(vehicle):
+    """Edges of a routed <vehicle> (the chosen route of a routeDistribution is listed last)."""
+    found = vehicle.findall('.//route')
+    return found[-1].get('edges', '') if found else ''
+
+
+def route_pairs(keys, vtypes, net_file, bucket_seconds=None, workers=1):
+    """
+    Route each (vtype, src, dst, bucket) key once with duarouter; unroutable
+    keys map to ''. Raises RuntimeError if duarouter fails, so a failed run is
+    never mistaken for unroutable pairs.
+    """
+    work_dir = tempfile.mkdtemp(prefix='route_cache_', dir='.')
+    try:
+        keys = sorted(keys, key=lambda k: k[3])
+        trips_file = os.path.join(work_dir, 'od.trips.xml')
+        routes_file = os.path.join(work_dir, 'od.rou.xml')
+        with open(trips_file, 'w') as f:
+            f.write('<routes>\n')
+            f.writelines(vtypes)
+            for i, (vtype, src, dst, bucket) in enumerate(keys):
+                depart = bucket * bucket_seconds if bucket_seconds else 0
+                attrs = {'id': str(i), 'depart': f"{depart:.2f}", 'from': src, 'to': dst}
+                if vtype != DEFAULT_VTYPE:
+                    attrs['type'] = vtype
+                f.write(ET.tostring(ET.Element('trip', attrs), encoding='unicode') + '\n')
+            f.write('</routes>\n')
+        if workers == 1:
+            route_generator.route(trips_file, routes_file, os.path.join(work_dir, 'od.duarcfg'), net_file)
+        else:
+            route_generator.route_parallel(trips_file, routes_file, workers or None, net_file=net_file)
+        if not os.path.exists(routes_file):
+            raise RuntimeError(f"duarouter wrote no routes file for {len(keys)} OD pairs")
+        routes = dict.fromkeys(keys, '')
+        for elem in route_generator.iter_top_level(routes_file):
+            if elem.tag != 'vehicle' or not elem.get('id', '').isdigit():
+                continue
+            routes[keys[int(elem.get('id'))]] = route_edges(elem)
+        return routes
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def scan_trips(trips_file, bucket_seconds=None):
+    """vType definitions (as XML text), the set of unique trip keys and the number of keyed trips."""
+    vtypes = []
+    keys = set()
+    n = 0
+    for elem in route_generator.iter_top_level(trips_file):
+        if elem.tag == 'vType':
+            vtypes.append(ET.tostring(elem, encoding='unicode') + '\n')
+            continue
+        key = trip_key(elem, bucket_seconds)
+        if key is not None:
+            keys.add(key)
+            n += 1
+    return vtypes, keys, n
+
+
+def expand_routes(trips_file, routes_file, routes, bucket_seconds=None, key=None):
+    """
+    Write routes_file with one <vehicle> per trip, taking its route from
+    `routes` (key -> edges); `key` maps an element to its key, trip_key by
+    default. Elements without a key are copied through unchanged. Returns
+    (trips written, unroutable trips dropped).
+    """
+    key_of = key or (lambda elem: trip_key(elem, bucket_seconds))
+    written = dropped = 0
+    with open(routes_file, 'w') as f:
+        f.write('<routes>\n')
+        for elem in route_generator.iter_top_level(trips_file):
+            k = key_of(elem)
+            if k is None:
+                f.write(ET.tostring(elem, encoding='unicode') + '\n')
+                continue
+            edges = routes[k]
+            if not edges:
+                dropped += 1
+                continue
+            vehicle = ET.Element('vehicle', {k: v for k, v in elem.attrib.items() if k not in ROUTE_ATTRS})
+            ET.SubElement(vehicle, 'route', {'edges': edges})
+            vehicle.extend(list(elem))
+            f.write(ET.tostring(vehicle, encoding='unicode') + '\n')
+            written += 1
+        f.write('</routes>\n')
+    if dropped:
+        print(f"[WARN] Dropped {dropped} trips without a route")
+    return written, dropped
+
+
+def route_cached(trips_file='sim_dip.odtrips.xml', routes_file='sim_dip.odtrips.rou.xml',
+                 net_file='new.net.xml', bucket_seconds=None, workers=1, cache_file=None):
+    """
+    Write routes_file for every trip of trips_file, routing only the OD pairs
+    not yet in the cache. Returns (trips written, unroutable trips dropped).
+    """
+    t0 = time.time()
+    vtypes, keys, n = scan_trips(trips_file, bucket_seconds)
+    cache = RouteCache(cache_file or cache_path_for(net_file), net_snapshot.file_hash(net_file),
+                       vtype_digests(vtypes))
+    try:
+        routes = cache.lookup(keys)
+        hits = len(routes)
+        misses = keys.difference(routes)
+        if misses:
+            new = route_pairs(misses, vtypes, net_file, bucket_seconds, workers)
+            cache.store(new)
+            routes.update(new)
+    finally:
+        cache.close()
+    print(f"[INFO] {n} trips over {len(keys)} unique OD pairs: {hits} cached, {len(misses)} routed")
+    written, dropped = expand_routes(trips_file, routes_file, routes, bucket_seconds)
+    print(f"[INFO] Wrote {written} routes to {routes_file} in {time.time() - t0:.1f} s")
+    return written, dropped
@@ -1,8 +1,18 @@
 import subprocess
+import argparse
+import gzip
+import heapq
+import math
+import os
+import shutil
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
 lines1 = [
     "<configuration>",
-    "<input>",
-    "<net-file value=\"new.net.xml\"/>"
+    "<input>"
 ]
 
 lines3 = [
@@ -20,18 +30,196 @@ lines5 = [
 ]
 
 
-with open('duarcfg_file.trips2routes.duarcfg', 'w') as wfile:
-    for l in lines1:
-        wfile.write(l + '\n')
-    wfile.write('<route-files value=\"'+'sim_dip.odtrips.xml"/>\n')
-    for l in lines3:
-        wfile.write(l + '\n')
-    wfile.write('<output-file value=\"' + 'sim_dip.odtrips.rou.xml"/>\n')
-    for l in lines5:
-        wfile.write(l + '\n')
-wfile.close()
-command = "duarouter -c duarcfg_file.trips2routes.duarcfg --ignore-errors"
-subprocess.run(command, shell=True)
-        
-        
-            
+def write_duarcfg(cfg_file, trips_file, routes_file, net_file='new.net.xml'):
+    with open(cfg_file, 'w') as wfile:
+        for l in lines1:
+            wfile.write(l + '\n')
+        wfile.write('<net-file value=\"' + net_file + '"/>\n')
+        wfile.write('<route-files value=\"' + trips_file + '"/>\n')
+        for l in lines3:
+            wfile.write(l + '\n')
+        wfile.write('<output-file value=\"' + routes_file + '"/>\n')
+        for l in lines5:
+            wfile.write(l + '\n')
+
+
+def run_duarouter(cfg_file):
+    """Run duarouter on cfg_file; raises RuntimeError when it fails."""
+    command = "duarouter -c " + cfg_file + " --ignore-errors"
+    result = subprocess.run(command, shell=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"duarouter failed with exit code {result.returncode} for {cfg_file}")
+    return result
+
+
+def route(trips_file='sim_dip.odtrips.xml', routes_file='sim_dip.odtrips.rou.xml',
+          cfg_file='duarcfg_file.trips2routes.duarcfg', net_file='new.net.xml'):
+    """Route the whole trip file with a single duarouter process."""
+    # duarouter resolves relative paths against the directory of cfg_file.
+    write_duarcfg(cfg_file, os.path.abspath(trips_file), os.path.abspath(routes_file), os.path.abspath(net_file))
+    run_duarouter(cfg_file)
+
+
+def _open_xml(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def iter_top_level(path):
+    """
+    Yield every top-level element of a routes or trips file, complete with its
+    children, without keeping the parsed tree in memory. An element is only
+    valid until the next one is requested.
+    """
+    with _open_xml(path) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        depth = 0
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth:
+                continue
+            elem.tail = None
+            yield elem
+            root.clear()
+
+
+def depart_of(elem):
+    try:
+        return float(elem.get('depart', 0))
+    except ValueError:
+        return 0.0
+
+
+def iter_elements(path):
+    """Yield (tag, depart, xml text) for every top-level element of a routes or trips file."""
+    for elem in iter_top_level(path):
+        yield elem.tag, depart_of(elem), ET.tostring(elem, encoding='unicode') + '\n'
+
+
+def split_trips(trips_file, shard_dir, shard_size):
+    """
+    Split a depart-sorted trip file into shards of at most shard_size trips,
+    each carrying all vType definitions. Consecutive shards therefore cover
+    consecutive depart windows. Returns the shard file names.
+    """
+    vtypes = []
+    shards = []
+    out = None
+    count = 0
+    for tag, _, text in iter_elements(trips_file):
+        if tag == 'vType':
+            vtypes.append(text)
+            continue
+        if out is None or count == shard_size:
+            if out is not None:
+                out.write('</routes>\n'); out.close()
+            name = os.path.join(shard_dir, f"shard_{len(shards):05d}.trips.xml")
+            shards.append(name)
+            out = open(name, 'w')
+            out.write('<routes>\n')
+            out.writelines(vtypes)
+            count = 0
+        out.write(text)
+        count += 1
+    if out is not None:
+        out.write('</routes>\n'); out.close()
+    return shards
+
+
+def merge_routes(shard_routes, routes_file):
+    """
+    Merge routed shards into one routes file in depart order; vTypes are
+    written once. Raises RuntimeError if a shard has no routes file.
+    """
+    missing = [path for path in shard_routes if not os.path.exists(path)]
+    if missing:
+        raise RuntimeError(f"{len(missing)} routed shards are missing, e.g. {missing[0]}")
+    vtypes = {}
+    streams = []
+    for i, path in enumerate(shard_routes):
+
+        def vehicles(path=path, i=i):
+            for n, (tag, depart, text) in enumerate(iter_elements(path)):
+                if tag == 'vType':
+                    vtypes.setdefault(text, None)
+                    continue
+                yield depart, i, n, text
+        streams.append(vehicles())
+    with open(routes_file, 'w') as f:
+        f.write('<routes>\n')
+        merged = heapq.merge(*streams)
+        # vTypes precede vehicles in every shard, so they are known once the first vehicle is out.
+        first = next(merged, None)
+        f.writelines(vtypes)
+        if first is not None:
+            f.write(first[3])
+        for _, _, _, text in merged:
+            f.write(text)
+        f.write('</routes>\n')
+
+
+def count_trips(trips_file):
+    return sum(1 for tag, _, _ in iter_elements(trips_file) if tag != 'vType')
+
+
+def route_parallel(trips_file='sim_dip.odtrips.xml', routes_file='sim_dip.odtrips.rou.xml',
+                   workers=None, shard_size=None, keep_shards=False, net_file='new.net.xml'):
+    """
+    Split the trip file into depart-ordered shards, route every shard with its
+    own duarouter in a pool of `workers` processes, and merge the results into
+    routes_file in depart order. By default shards hold about a quarter of one
+    worker's share, so a slow shard does not leave the other cores idle.
+    """
+    workers = workers or os.cpu_count() or 1
+    if shard_size is None:
+        shard_size = max(1, math.ceil(count_trips(trips_file) / (workers * 4)))
+    shard_dir = tempfile.mkdtemp(prefix='route_shards_', dir='.')
+    try:
+        t0 = time.time()
+        shards = split_trips(trips_file, shard_dir, shard_size)
+
+        def route_shard(shard):
+            routes = shard.replace('.trips.xml', '.rou.xml')
+            cfg = shard.replace('.trips.xml', '.duarcfg')
+            write_duarcfg(cfg, os.path.abspath(shard), os.path.abspath(routes), os.path.abspath(net_file))
+            run_duarouter(cfg)
+            return routes
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            shard_routes = list(pool.map(route_shard, shards))
+        merge_routes(shard_routes, routes_file)
+        print(f"[INFO] Routed {len(shards)} shards with {workers} workers in {time.time() - t0:.1f} s")
+    finally:
+        if not keep_shards:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Route MaSVeT trips with duarouter")
+    parser.add_argument("--trips", default="sim_dip.odtrips.xml")
+    parser.add_argument("--routes", default="sim_dip.odtrips.rou.xml")
+    parser.add_argument("--net", default="new.net.xml")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parallel duarouter processes (0 = one per core)")
+    parser.add_argument("--shard-size", type=int, default=None, help="trips per shard")
+    parser.add_argument("--keep-shards", action="store_true")
+    parser.add_argument("--cache", action="store_true",
+                        help="route each unique OD pair once and reuse routes across runs")
+    parser.add_argument("--bucket", type=float, default=None,
+                        help="with --cache, seconds per departure time bucket (default: one bucket)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only route trips that are new or changed since the last run")
+    args = parser.parse_args()
+    if args.incremental:
+        import route_incremental
+        route_incremental.route_incremental(args.trips, args.routes, args.net, args.workers)
+    elif args.cache:
+        import route_cache
+        route_cache.route_cached(args.trips, args.routes, args.net, args.bucket, args.workers)
+    elif args.workers == 1:
+        route(args.trips, args.routes, net_file=args.net)
+    else:
+        route_parallel(args.trips, args.routes, args.workers or None, args.shard_size, args.keep_shards, args.net)
@@ -0,0 +1,144 @@
+'''
+Incremental re-routing: only trips that are new or changed since the last run
+are routed.
+
+Every routed trip is identified by a hash of its content (all attributes but
+the ID, plus any child elements), so trips keep their identity when a change
+to one timeslot renumbers the trips after it. The hashes of a run are kept in
+a manifest next to the routes file (sim_dip.odtrips.rou.xml.manifest.json)
+together with the network and vType hashes. The next run reads the routes of
+unchanged trips back from the previous .rou.xml, sends only the remaining
+trips to duarouter, and writes the new .rou.xml in trip order:
+
+    python route_generator.py --incremental
+
+A changed network or vType set invalidates the manifest and everything is
+routed again.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import net_snapshot
+import route_cache
+import route_generator
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path_for(routes_file):
+    return routes_file + '.manifest.json'
+
+
+def content_hash(elem):
+    """Hash of a <trip> without its ID; None for other elements, which are copied through."""
+    if elem.tag != 'trip':
+        return None
+    h = hashlib.blake2b(digest_size=12)
+    h.update(repr(sorted((k, v) for k, v in elem.attrib.items() if k != 'id')).encode())
+    for child in elem:
+        h.update(ET.tostring(child))
+    return h.hexdigest()
+
+
+def _hash(texts):
+    return hashlib.sha256(''.join(texts).encode()).hexdigest()
+
+
+def load_manifest(routes_file, net_hash, vtypes_hash):
+    """The previous run's {vehicle id: content hash} and unroutable hashes, if still valid."""
+    path = manifest_path_for(routes_file)
+    if not (os.path.exists(path) and os.path.exists(routes_file)):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if (manifest.get('version') != MANIFEST_VERSION or manifest.get('net') != net_hash
+            or manifest.get('vtypes') != vtypes_hash):
+        print("[INFO] Network or vTypes changed since the last run; routing all trips")
+        return None
+    return manifest
+
+
+def route_incremental(trips_file='sim_dip.odtrips.xml', routes_file='sim_dip.odtrips.rou.xml',
+                      net_file='new.net.xml', workers=1):
+    """
+    Route trips_file into routes_file, reusing the routes of trips unchanged
+    since the previous run into the same routes file. Returns (reused, routed).
+    """
+    t0 = time.time()
+    vtypes = []
+    ids = {}
+    for elem in route_generator.iter_top_level(trips_file):
+        if elem.tag == 'vType':
+            vtypes.append(ET.tostring(elem, encoding='unicode') + '\n')
+        h = content_hash(elem)
+        if h is not None:
+            ids[elem.get('id')] = h
+    wanted = set(ids.values())
+    net_hash = net_snapshot.file_hash(net_file)
+    vtypes_hash = _hash(vtypes)
+
+    routes = {}
+    manifest = load_manifest(routes_file, net_hash, vtypes_hash)
+    if manifest is not None:
+        old = manifest['trips']
+        for h in manifest['unroutable']:
+            if h in wanted:
+                routes[h] = ''
+        for elem in route_generator.iter_top_level(routes_file):
+            h = old.get(elem.get('id')) if elem.tag == 'vehicle' else None
+            if h in wanted and h not in routes:
+                routes[h] = route_cache.route_edges(elem)
+    reused = len(routes)
+
+    changed = wanted.difference(routes)
+    if changed:
+        work_dir = tempfile.mkdtemp(prefix='route_delta_', dir='.')
+        try:
+            delta_trips = os.path.join(work_dir, 'delta.trips.xml')
+            delta_routes = os.path.join(work_dir, 'delta.rou.xml')
+            pending = set(changed)
+            with open(delta_trips, 'w') as f:
+                f.write('<routes>\n')
+                f.writelines(vtypes)
+                for elem in route_generator.iter_top_level(trips_file):
+                    h = content_hash(elem)
+                    if h in pending:
+                        pending.discard(h)
+                        elem.set('id', h)
+                        f.write(ET.tostring(elem, encoding='unicode') + '\n')
+                f.write('</routes>\n')
+            if workers == 1:
+                route_generator.route(os.path.abspath(delta_trips), os.path.abspath(delta_routes),
+                                      os.path.join(work_dir, 'delta.duarcfg'), os.path.abspath(net_file))
+            else:
+                route_generator.route_parallel(delta_trips, delta_routes, workers or None, net_file=net_file)
+            # route() and route_parallel() raise if duarouter fails; a missing
+            # output must not be recorded as "all changed trips unroutable" either.
+            if not os.path.exists(delta_routes):
+                raise RuntimeError(f"duarouter wrote no routes for the {len(changed)} changed trips")
+            routes.update(dict.fromkeys(changed, ''))
+            for elem in route_generator.iter_top_level(delta_routes):
+                if elem.tag == 'vehicle' and elem.get('id') in changed:
+                    routes[elem.get('id')] = route_cache.route_edges(elem)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"[INFO] {len(ids)} trips, {len(wanted)} distinct: {reused} reused, {len(changed)} routed")
+
+    tmp = f"{routes_file}.{os.getpid()}.tmp"
+    written, _ = route_cache.expand_routes(trips_file, tmp, routes, key=content_hash)
+    os.replace(tmp, routes_file)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'net': net_hash,
+        'vtypes': vtypes_hash,
+        'trips': {i: h for i, h in ids.items() if routes[h]},
+        'unroutable': sorted(h for h in wanted if not routes[h]),
+    }
+    with open(manifest_path_for(routes_file), 'w') as f:
+        json.dump(manifest, f)
+    print(f"[INFO] Wrote {written} routes to {routes_file} in {time.time() - t0:.1f} s")
+    return reused, len(changed)
@@ -0,0 +1,146 @@
+'''
+Runs many charging-controller simulations at once.
+
+Every run is one SUMO instance driven by sumo_traci_run.run() in its own
+worker process, with its own label, TraCI port (picked free by traci.start),
+SUMO seed, controller parameters and output directory. A bounded process
+pool keeps up to --workers runs going (default: one per core). A run file is
+a JSON list of runs:
+
+    [
+      {"label": "ev40_s1", "cfg": "ev40/sumocon.sumocfg", "seed": 1, "threshold": 0.47},
+      {"label": "ev60_s1", "cfg": "ev60/sumocon.sumocfg", "seed": 1, "threshold": 0.3,
+       "station_capacity": 4, "sumo_args": ["--end", "86400"]}
+    ]
+
+Only "label" is required; "cfg" defaults to sumocon.sumocfg and "output_dir"
+to runs/<label>. A grid over seeds and thresholds can be given on the command
+line instead:
+
+    python sim_runner.py runs.json --workers 8
+    python sim_runner.py --cfg sumocon.sumocfg --seeds 1 2 3 4 --thresholds 0.3 0.47 --backend libsumo
+
+SUMO outputs, the controller log (controller.log) and the evicted EV records
+(ev_records.csv) of a run are written to its output directory; a summary of
+wall time and throughput per run is printed at the end.
+'''
+import argparse
+import contextlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DEFAULT_CFG = "sumocon.sumocfg"
+RUN_OPTIONS = ("route_cache_size", "route_bucket", "threshold", "station_capacity", "backend",
+               "checkpoint_dir", "checkpoint_interval", "keep_checkpoints", "resume")
+
+
+def load_runs(path):
+    with open(path) as f:
+        runs = json.load(f)
+    for spec in runs:
+        spec.setdefault("cfg", DEFAULT_CFG)
+    return runs
+
+
+def grid_runs(cfgs, seeds, thresholds):
+    """One run per (cfg, seed, threshold); labels are derived from the three."""
+    runs = []
+    for cfg in cfgs:
+        name = os.path.splitext(os.path.relpath(cfg))[0].replace(os.sep, "_").strip("._")
+        for seed in seeds:
+            for threshold in thresholds:
+                spec = {"cfg": cfg, "seed": seed}
+                label = name
+                if seed is not None:
+                    label += f"_s{seed}"
+                if threshold is not None:
+                    spec["threshold"] = threshold
+                    label += f"_t{threshold:g}"
+                spec["label"] = label
+                runs.append(spec)
+    return runs
+
+
+def run_one(spec):
+    """Run one simulation in this process; its stdout goes to controller.log in its output directory."""
+    # Imported here so the parent process never binds a SUMO backend.
+    import sumo_traci_run
+    label = spec["label"]
+    output_dir = spec.get("output_dir") or os.path.join("runs", label)
+    os.makedirs(output_dir, exist_ok=True)
+    options = {k: spec[k] for k in RUN_OPTIONS if k in spec}
+    t0 = time.time()
+    result = {"label": label, "output_dir": output_dir}
+    # A resumed run continues the log of the run it resumes.
+    log_mode = "a" if spec.get("resume") else "w"
+    with open(os.path.join(output_dir, "controller.log"), log_mode) as log, contextlib.redirect_stdout(log):
+        try:
+            result.update(sumo_traci_run.run(
+                cfg_file=spec.get("cfg", DEFAULT_CFG), output_dir=output_dir, seed=spec.get("seed"),
+                label=label, sumo_args=spec.get("sumo_args", ()),
+                spill_file=os.path.join(output_dir, "ev_records.csv"), **options))
+        except Exception as e:
+            traceback.print_exc()
+            result["error"] = f"{type(e).__name__}: {e}"
+    result["wall"] = time.time() - t0
+    return result
+
+
+def print_summary(results, wall):
+    print(f"{'run':<24} {'wall s':>8} {'steps':>8} {'sim s':>10} {'sim/wall':>9} {'steps/s':>9} {'detours':>8} {'charges':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['label']:<24} {r['wall']:>8.1f}  FAILED: {r['error']} (see {r['output_dir']}/controller.log)")
+            continue
+        w = max(r["wall"], 1e-9)
+        print(f"{r['label']:<24} {r['wall']:>8.1f} {r['steps']:>8} {r['sim_seconds']:>10.0f} "
+              f"{r['sim_seconds'] / w:>9.1f} {r['steps'] / w:>9.1f} {r['detours']:>8} {r['charges']:>8}")
+    done = [r for r in results if "error" not in r]
+    sim_total = sum(r["sim_seconds"] for r in done)
+    print(f"[INFO] {len(done)}/{len(results)} runs finished in {wall:.1f} s wall; "
+          f"{sim_total:.0f} simulated seconds in total ({sim_total / max(wall, 1e-9):.1f} per wall second)")
+
+
+def run_all(runs, workers=None):
+    """Run every spec in a pool of `workers` processes (one per core by default). Returns the results in run order."""
+    labels = [spec["label"] for spec in runs]
+    if len(set(labels)) != len(labels):
+        raise ValueError("run labels must be unique")
+    workers = min(workers or os.cpu_count() or 1, len(runs)) or 1
+    print(f"[INFO] {len(runs)} runs on {workers} workers")
+    t0 = time.time()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_one, spec): spec["label"] for spec in runs}
+        for future in as_completed(futures):
+            r = future.result()
+            results[r["label"]] = r
+            status = f"failed: {r['error']}" if "error" in r else f"{r['steps']} steps"
+            print(f"[INFO] {r['label']} done in {r['wall']:.1f} s ({status})")
+    ordered = [results[label] for label in labels]
+    print_summary(ordered, time.time() - t0)
+    return ordered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many charging-controller simulations in parallel")
+    parser.add_argument("runs", nargs="?", help="JSON file with a list of runs")
+    parser.add_argument("--cfg", nargs="+", default=[DEFAULT_CFG], help="SUMO configs for a seed/threshold grid")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[None], help="SUMO seeds for the grid")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[None], help="SoC thresholds for the grid")
+    parser.add_argument("--workers", type=int, default=None, help="parallel simulations (default: one per core)")
+    parser.add_argument("--backend", choices=("libsumo", "traci", "auto"), default=None,
+                        help="SUMO backend of every run without its own (default: $MASVET_SUMO_BACKEND, else traci)")
+    args = parser.parse_args()
+    runs = load_runs(args.runs) if args.runs else grid_runs(args.cfg, args.seeds, args.thresholds)
+    if args.backend:
+        for spec in runs:
+            spec.setdefault("backend", args.backend)
+    run_all(runs, args.workers)
+
+
+if __name__ == "__main__":
+    main()
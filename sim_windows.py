@@ -0,0 +1,260 @@
+'''
+Time-window sharded simulation of long (multi-day) scenarios.
+
+The routed demand of a SUMO configuration is cut into windows of --window
+seconds (one day by default). Window k simulates [start_k - warmup, end_k):
+it holds every vehicle departing in that span, starts SUMO at
+start_k - warmup and stops it at end_k. All windows run in parallel through
+sim_runner, each with its own charging controller, and their battery,
+emission and FCD outputs are stitched back into single files covering the
+whole run, taking the timesteps of [start_k, end_k) from window k only, so
+the warm-up, during which the network fills with the traffic of the previous
+window, is dropped. The last window runs until its vehicles have arrived.
+
+    python sim_windows.py --cfg sumocon.sumocfg --window 86400 --warmup 7200 --workers 0 --backend libsumo
+
+Every trip is simulated from its departure in the window it departs in (or,
+for warm-up departures, also in the next one), so no battery state is handed
+across window boundaries: each vehicle starts with the charge given by its
+departure attributes (its own or its vType's device.battery.actualBatteryCapacity
+parameter), exactly as in a continuous run. Trips still driving at the end
+of a window continue in the next window only if they departed within its
+warm-up, so the warm-up should exceed the longest trip. Persons go to the
+window they depart in like vehicles; a flow goes to the window holding its
+whole [begin, end), and a flow crossing a window boundary is rejected. SUMO
+itself skips flow departures before a window's begin. Each window stops at
+its end time.
+'''
+import argparse
+import os
+import time
+import xml.etree.ElementTree as ET
+import route_generator
+import sim_runner
+
+DAY = 86400
+# Timestep outputs that are stitched back together.
+STITCHED_OUTPUTS = ("battery-output", "emission-output", "fcd-output")
+# Configuration options holding input file names relative to the config file.
+INPUT_OPTIONS = ("net-file", "route-files", "additional-files", "weight-files", "gui-settings-file")
+# Top-level route file elements every window needs.
+DEFINITIONS = ("vType", "vTypeDistribution", "route", "routeDistribution")
+
+
+def config_option(root, name):
+    elem = root.find(f'.//{name}')
+    return elem.get('value') if elem is not None else None
+
+
+def _window_of(depart, begin, window):
+    return max(0, int((depart - begin) // window))
+
+
+def _departures(elem):
+    """
+    First and last departure time of a vehicle, trip, person or container
+    (depart) or of a flow or interval (begin, end). Raises ValueError for
+    elements without explicit times, which cannot be placed in a window.
+    """
+    name = f"<{elem.tag} id={elem.get('id')!r}>"
+    try:
+        if elem.get('depart') is not None:
+            depart = float(elem.get('depart'))
+            return depart, depart
+        if elem.get('begin') is not None and elem.get('end') is not None:
+            return float(elem.get('begin')), float(elem.get('end'))
+    except ValueError:
+        raise ValueError(f"{name} has no numeric departure time") from None
+    raise ValueError(f"{name} has neither depart nor begin and end")
+
+
+def split_routes(route_files, out_dir, begin, window, warmup):
+    """
+    Write the demand of route_files into one routes file per window,
+    out_dir/window_<k>.rou.xml, each with every definition (vTypes,
+    routes) in the original order. Vehicles and persons go to the window
+    they depart in, flows to the window holding their [begin, end); a flow
+    crossing a window boundary raises ValueError. Returns
+    {window: (file, elements)}.
+    """
+    files = {}
+    counts = {}
+    definitions = []
+
+    def out(k):
+        if k not in files:
+            name = os.path.join(out_dir, f"window_{k:03d}.rou.xml")
+            f = open(name, 'w', encoding='utf-8')
+            f.write('<routes>\n')
+            f.writelines(definitions)
+            files[k] = (name, f)
+            counts[k] = 0
+        return files[k][1]
+
+    try:
+        for path in route_files:
+            for elem in route_generator.iter_top_level(path):
+                text = ET.tostring(elem, encoding='unicode') + '\n'
+                if elem.tag in DEFINITIONS:
+                    definitions.append(text)
+                    for _, f in files.values():
+                        f.write(text)
+                    continue
+                first, last = _departures(elem)
+                k = _window_of(first, begin, window)
+                boundary = begin + (k + 1) * window
+                if last > boundary:
+                    raise ValueError(f"<{elem.tag} id={elem.get('id')!r}> departs from {first:g} to {last:g}, "
+                                     f"across the window boundary at {boundary:g}; "
+                                     f"split it or expand it into vehicles first")
+                out(k).write(text)
+                counts[k] += 1
+                # Warm-up of the next window.
+                if last >= boundary - warmup:
+                    out(k + 1).write(text)
+                    counts[k + 1] += 1
+    finally:
+        for _, f in files.values():
+            f.write('</routes>\n')
+            f.close()
+    return {k: (files[k][0], counts[k]) for k in sorted(files)}
+
+
+def write_window_config(cfg_file, window_dir, routes_file, begin, end):
+    """
+    Copy of cfg_file in window_dir that simulates routes_file from begin to
+    end (None: until all vehicles have arrived); input paths are made
+    absolute. Outputs are redirected by sumo_traci_run.sumo_command.
+    """
+    base = os.path.dirname(os.path.abspath(cfg_file))
+    tree = ET.parse(cfg_file)
+    root = tree.getroot()
+    for name in INPUT_OPTIONS:
+        elem = root.find(f'.//{name}')
+        if elem is not None:
+            elem.set('value', ','.join(os.path.join(base, p.strip()) for p in elem.get('value').split(',')))
+    root.find('.//route-files').set('value', os.path.abspath(routes_file))
+    time_elem = root.find('time')
+    if time_elem is None:
+        time_elem = ET.SubElement(root, 'time')
+    for name, value in (('begin', begin), ('end', end)):
+        elem = time_elem.find(name)
+        if value is None:
+            if elem is not None:
+                time_elem.remove(elem)
+            continue
+        if elem is None:
+            elem = ET.SubElement(time_elem, name)
+        elem.set('value', f"{value:g}")
+    path = os.path.join(window_dir, 'window.sumocfg')
+    tree.write(path, encoding='utf-8', xml_declaration=True)
+    return path
+
+
+def stitch(parts, out_file):
+    """
+    Concatenate timestep outputs: parts is a list of (file, start, end), and
+    only the timesteps with start <= time < end (end None: no limit) of each
+    file are kept; a truncated file contributes its complete timesteps.
+    Returns the number of timesteps written.
+    """
+    written = 0
+    out = None
+    try:
+        for path, start, end in parts:
+            if not os.path.exists(path):
+                print(f"[WARN] Missing output {path}")
+                continue
+            context = ET.iterparse(path, events=('start', 'end'))
+            last = None
+            try:
+                _, root = next(context)
+                if out is None:
+                    out = open(out_file, 'w', encoding='utf-8')
+                    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                    out.write(f'<{root.tag}>\n')
+                    root_tag = root.tag
+                for event, elem in context:
+                    if event != 'end' or elem.tag != 'timestep':
+                        continue
+                    t = last = float(elem.get('time'))
+                    if t >= start and (end is None or t < end):
+                        elem.tail = None
+                        out.write(ET.tostring(elem, encoding='unicode') + '\n')
+                        written += 1
+                    root.clear()
+            except ET.ParseError as e:
+                # SUMO stopped while writing it; everything before the damage is kept.
+                print(f"[WARN] {path} is truncated after time {last}: {e}")
+    finally:
+        if out is not None:
+            out.write(f'</{root_tag}>\n')
+            out.close()
+    return written
+
+
+def run_windows(cfg_file='sumocon.sumocfg', window=DAY, warmup=2 * 3600, out_dir='windows',
+                workers=None, **controller_options):
+    """Split, simulate in parallel and stitch. Returns the sim_runner results per window."""
+    t0 = time.time()
+    if warmup >= window:
+        raise ValueError("warm-up must be shorter than the window")
+    root = ET.parse(cfg_file).getroot()
+    base = os.path.dirname(os.path.abspath(cfg_file))
+    begin = float(config_option(root, 'begin') or 0)
+    route_files = [os.path.join(base, p.strip()) for p in config_option(root, 'route-files').split(',')]
+    os.makedirs(out_dir, exist_ok=True)
+    windows = split_routes(route_files, out_dir, begin, window, warmup)
+    if not windows:
+        print("[WARN] No vehicles to simulate")
+        return []
+    last = max(windows)
+    print(f"[INFO] Split the demand into {len(windows)} windows of {window:g} s "
+          f"(+{warmup:g} s warm-up) in {time.time() - t0:.1f} s")
+
+    runs = []
+    bounds = {}
+    for k, (routes_file, elements) in windows.items():
+        start = begin + k * window
+        end = None if k == last else start + window
+        sim_begin = begin if k == 0 else start - warmup
+        window_dir = os.path.join(out_dir, f"window_{k:03d}")
+        os.makedirs(window_dir, exist_ok=True)
+        cfg = write_window_config(cfg_file, window_dir, routes_file, sim_begin, end)
+        bounds[k] = (window_dir, start if k else float('-inf'), end)
+        runs.append(dict(controller_options, label=f"window_{k:03d}", cfg=cfg, output_dir=window_dir))
+        print(f"[INFO] window {k}: {elements} vehicles and flows, simulated from {sim_begin:g} to {end if end is not None else 'end'}")
+    results = sim_runner.run_all(runs, workers)
+
+    for name in STITCHED_OUTPUTS:
+        value = config_option(root, name)
+        if not value:
+            continue
+        out_file = os.path.join(base, value)
+        parts = [(os.path.join(d, os.path.basename(value)), start, end) for d, start, end in
+                 (bounds[k] for k in sorted(bounds))]
+        n = stitch(parts, out_file)
+        print(f"[INFO] Stitched {n} timesteps of {len(parts)} windows into {out_file}")
+    print(f"[INFO] Windowed simulation finished in {time.time() - t0:.1f} s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a long scenario as parallel time windows")
+    parser.add_argument("--cfg", default="sumocon.sumocfg")
+    parser.add_argument("--window", type=float, default=DAY, help="window length in seconds (default: one day)")
+    parser.add_argument("--warmup", type=float, default=2 * 3600, help="warm-up overlap in seconds")
+    parser.add_argument("--out", default="windows", help="directory for window configs, routes and outputs")
+    parser.add_argument("--workers", type=int, default=None, help="parallel windows (default: one per core)")
+    parser.add_argument("--threshold", type=float, default=None, help="charging controller SoC threshold")
+    parser.add_argument("--backend", choices=("libsumo", "traci", "auto"), default=None,
+                        help="SUMO backend (default: $MASVET_SUMO_BACKEND, else traci)")
+    args = parser.parse_args()
+    options = {"threshold": args.threshold} if args.threshold is not None else {}
+    if args.backend:
+        options["backend"] = args.backend
+    run_windows(args.cfg, args.window, args.warmup, args.out, args.workers, **options)
+
+
+if __name__ == "__main__":
+    main()
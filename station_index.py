@@ -0,0 +1,145 @@
+'''
+Edge-to-charging-station lookup table for the charging controller.
+
+One multi-source Dijkstra over the reversed edge graph of fast_router, started
+from every station edge at once, settles each network edge up to k times, once
+per distinct station, so every edge ends up with its k best reachable stations
+ordered by travel time (or by route length). A detour decision then is a table
+lookup plus a single route confirmation instead of one route search per
+station. Tables are stored in the network snapshot directory, keyed by the
+station set and the search settings:
+
+    index = station_index.StationIndex(net, [("cs0", "E12"), ("cs1", "E40")], k=3)
+    index.lookup("E7")   # [(station, station edge, cost), ...] best first
+
+Vehicles that need a station in the same step are assigned together with
+assign(): one (vehicles x k) cost matrix gathered from the table for the
+distinct edges they are on, solved greedily, optionally with a limit on free
+places per station.
+'''
+import hashlib
+import heapq
+import os
+import numpy as np
+import fast_router
+
+DEFAULT_K = 3
+
+
+class StationIndex:
+    def __init__(self, net, stations, k=DEFAULT_K, vclass='passenger', metric='time'):
+        """`stations` is a list of (station id, edge id); stations on unknown edges are ignored."""
+        self.net = net
+        self.k = k
+        known = set(net.edge_id_list())
+        self.stations = [(cs, edge) for cs, edge in stations if edge in known]
+        self.graph = fast_router.RoutingGraph(net, vclass, metric=metric)
+        key = hashlib.sha256(repr((self.stations, k, self.graph.key)).encode()).hexdigest()[:16]
+        path = os.path.join(net.path, f'stations_{key}.npz')
+        if not os.path.exists(path):
+            station, cost = self.build()
+            tmp = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp, station=station, cost=cost)
+            os.replace(tmp, path)
+        data = np.load(path)
+        self.station = data['station']
+        self.cost = data['cost']
+
+    def build(self):
+        """
+        (n, k) arrays of station rows and costs, best first; -1 / inf where an
+        edge reaches fewer than k stations. The cost of an edge is the cost of
+        driving from its end to the end of the station edge.
+        """
+        g = self.graph
+        n, k = g.n, self.k
+        cost, ro, ra = g._cost, g.rev_off, g.rev
+        station = np.full((n, k), -1, dtype=np.int32)
+        best = np.full((n, k), np.inf)
+        settled = [0] * n
+        seen = {}
+        heap = []
+        for row, (_, edge) in enumerate(self.stations):
+            e = self.net.edge_code(edge)
+            if g.allowed[e]:
+                heap.append((0.0, e, row))
+        heapq.heapify(heap)
+        while heap:
+            d, v, row = heapq.heappop(heap)
+            if settled[v] >= k or (v, row) in seen:
+                continue
+            seen[(v, row)] = d
+            station[v, settled[v]] = row
+            best[v, settled[v]] = d
+            settled[v] += 1
+            nd = d + cost[v]
+            for i in range(ro[v], ro[v + 1]):
+                u = ra[i]
+                if settled[u] < k and (u, row) not in seen:
+                    heapq.heappush(heap, (nd, u, row))
+        return station, best
+
+    def lookup(self, edge_id):
+        """Up to k (station id, station edge, cost) reachable from edge_id, best first."""
+        try:
+            e = self.net.edge_code(edge_id)
+        except KeyError:
+            return []
+        out = []
+        for row, c in zip(self.station[e].tolist(), self.cost[e].tolist()):
+            if row < 0:
+                break
+            cs, edge = self.stations[row]
+            out.append((cs, edge, c))
+        return out
+
+    def candidates(self, edge_ids):
+        """
+        (m, k) station rows and costs for a list of edge IDs, gathered once per
+        distinct edge; -1 / inf for unknown edges and missing candidates.
+        """
+        distinct, inverse = np.unique(np.asarray(edge_ids, dtype=object), return_inverse=True)
+        station = np.full((len(distinct), self.k), -1, dtype=np.int32)
+        cost = np.full((len(distinct), self.k), np.inf)
+        for i, edge_id in enumerate(distinct.tolist()):
+            try:
+                e = self.net.edge_code(edge_id)
+            except KeyError:
+                continue
+            station[i] = self.station[e]
+            cost[i] = self.cost[e]
+        return station[inverse], cost[inverse]
+
+    def assign(self, edge_ids, free=None):
+        """
+        Station preference of every vehicle on edge_ids, solved as one batch:
+        a list of station rows per vehicle, assigned station first, the
+        remaining candidates after it by cost. Without `free` every vehicle
+        gets its closest station. With `free` (places left per station row),
+        (vehicle, station) pairs are taken cheapest first while the station
+        has room; vehicles left over get their closest station.
+        """
+        station, cost = self.candidates(edge_ids)
+        m = len(station)
+        order = np.argsort(cost, axis=1, kind='stable')
+        station = np.take_along_axis(station, order, axis=1)
+        cost = np.take_along_axis(cost, order, axis=1)
+        choice = np.zeros(m, dtype=np.int64)
+        if free is not None and m:
+            left = np.asarray(free, dtype=np.int64).copy()
+            choice[:] = -1
+            pairs = np.argsort(cost, axis=None, kind='stable')
+            for flat in pairs[np.isfinite(cost.ravel()[pairs])].tolist():
+                v, j = divmod(flat, self.k)
+                if choice[v] < 0 and left[station[v, j]] > 0:
+                    choice[v] = j
+                    left[station[v, j]] -= 1
+            choice[choice < 0] = 0
+        out = []
+        for v in range(m):
+            rows = station[v][np.isfinite(cost[v])].tolist()
+            j = int(choice[v])
+            if j < len(rows):
+                rows.insert(0, rows.pop(j))
+            out.append(rows)
+        return out
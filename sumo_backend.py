@@ -0,0 +1,102 @@
+'''
+Simulation backend for the charging controller.
+
+The controller only talks to SUMO through the module returned by load():
+`libsumo` runs SUMO inside the Python process (no socket, no serialization;
+headless only), `traci` connects to a SUMO or sumo-gui process over TCP for
+GUI runs and debugging. Both expose the same functions, return the same values
+and raise TraCIException, so the controller code is identical for both:
+
+    sim = sumo_backend.load("auto")     # libsumo when installed, traci otherwise
+    sim.start(["sumo", "-c", "sumocon.sumocfg"])
+
+The backend can also be chosen with the MASVET_SUMO_BACKEND environment
+variable (libsumo, traci or auto). Variable IDs always come from
+traci.constants, which libsumo shares. Running this module lists the
+available backends and checks that each covers the controller's calls:
+
+    python sumo_backend.py
+'''
+import importlib
+import os
+
+BACKENDS = ("libsumo", "traci")
+ENV_VAR = "MASVET_SUMO_BACKEND"
+
+# Every call the charging controller makes, by domain ("" is the top level).
+CONTROLLER_API = {
+    "": ("start", "close", "simulationStep", "TraCIException"),
+    "simulation": ("getMinExpectedNumber", "getDepartedIDList", "getArrivedIDList", "getTime",
+                   "getEndTime", "getDeltaT", "findRoute", "convert2D", "saveState"),
+    "vehicle": ("getTypeID", "getRoute", "getParameter", "getMaxSpeed", "getSpeedFactor", "subscribe",
+                "unsubscribe", "getAllSubscriptionResults", "setRoute", "setChargingStationStop"),
+    "vehicletype": ("getMass", "getAccel", "getParameter"),
+    "chargingstation": ("getIDList", "getLaneID", "getChargingPower", "getVehicleCount"),
+    "lane": ("getEdgeID",),
+}
+
+
+def missing_calls(module):
+    """Controller calls the backend module does not provide, as 'domain.function'."""
+    missing = []
+    for domain, names in CONTROLLER_API.items():
+        target = getattr(module, domain, None) if domain else module
+        for name in names:
+            if target is None or not hasattr(target, name):
+                missing.append(f"{domain}.{name}" if domain else name)
+    return missing
+
+
+def _import(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def load(name=None):
+    """
+    The backend module `name` (libsumo, traci or auto; default from
+    MASVET_SUMO_BACKEND, else traci). Raises RuntimeError when it is not
+    installed or lacks a call the controller needs.
+    """
+    name = name or os.environ.get(ENV_VAR, "traci")
+    if name == "auto":
+        candidates = BACKENDS
+    elif name in BACKENDS:
+        candidates = (name,)
+    else:
+        raise RuntimeError(f"Unknown SUMO backend {name!r}; expected one of {BACKENDS + ('auto',)}")
+    for candidate in candidates:
+        module = _import(candidate)
+        if module is None:
+            continue
+        missing = missing_calls(module)
+        if missing:
+            raise RuntimeError(f"SUMO backend {candidate} lacks {', '.join(missing)}")
+        return module
+    raise RuntimeError(f"SUMO backend {name} is not installed")
+
+
+def is_in_process(module):
+    """True for libsumo (also when it is imported under the traci name via LIBSUMO_AS_TRACI)."""
+    return module.__name__ == "libsumo" or bool(getattr(module, "isLibsumo", lambda: False)())
+
+
+def main():
+    for name in BACKENDS:
+        module = _import(name)
+        if module is None:
+            print(f"[INFO] {name}: not installed")
+            continue
+        missing = missing_calls(module)
+        status = "covers all controller calls" if not missing else f"lacks {', '.join(missing)}"
+        print(f"[INFO] {name} ({module.__file__}): {status}")
+    try:
+        print(f"[INFO] auto selects {load('auto').__name__}")
+    except RuntimeError as e:
+        print(f"[WARN] {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,157 +1,53 @@
-import traci
+import traci.constants as tc
+import argparse
+import heapq
 import math
+import os
+import pickle
+import shutil
+import sys
+import time
+from collections import OrderedDict
 import xml.etree.ElementTree as ET
-import math
-import random
+import lane_snap
+import net_snapshot
+import sim_windows
+import station_index
+import sumo_backend
+
+# libsumo (in-process) or traci (socket, GUI); see sumo_backend.py.
+traci = sumo_backend.load()
 '''
 Charging station data for SUMO cs.add.xml is created.
 '''
-def parse_lane_shape(shape_input):
-    """
-    Parse a lane shape input which can be either:
-      - A string of the format "x1,y1 x2,y2 ..." or
-      - A tuple/list of coordinates.
-    Returns a list of (x, y) float tuples.
-    """
-    if isinstance(shape_input, str):
-        points = []
-        segments = shape_input.strip().split()
-        for seg in segments:
-            x, y = seg.split(',')
-            points.append((float(x), float(y)))
-        return points
-    elif isinstance(shape_input, (tuple, list)):
-        if len(shape_input) > 0 and isinstance(shape_input[0], (tuple, list)):
-            return list(shape_input)
-        else:
-            # If it's a flat list of coordinates, pair them up.
-            it = iter(shape_input)
-            return list(zip(it, it))
-    else:
-        raise ValueError("Unexpected lane shape input type: " + str(type(shape_input)))
-
-def distance_point_to_segment(px, py, x1, y1, x2, y2):
-    """
-    Compute the Euclidean distance from point (px,py) to the segment (x1,y1)-(x2,y2).
-    Returns:
-      - The distance,
-      - The projection point on the segment,
-      - The parameter t (0<=t<=1) indicating the relative position.
-    """
-    dx = x2 - x1
-    dy = y2 - y1
-    if dx == 0 and dy == 0:
-        return math.hypot(px - x1, py - y1), (x1, y1), 0
-    t = ((px - x1) * dx + (py - y1) * dy) / (dx * dx + dy * dy)
-    t = max(0, min(1, t))
-    proj_x = x1 + t * dx
-    proj_y = y1 + t * dy
-    dist = math.hypot(px - proj_x, py - proj_y)
-    return dist, (proj_x, proj_y), t
-
-def distance_point_to_polyline(px, py, polyline):
-    """
-    Compute the minimal distance from point (px,py) to a polyline (list of (x,y) points)
-    and return that distance along with the cumulative position (in meters) along the polyline.
+def generate_charging_stations(net_file="city.net.xml", cs_xml="charging_stations_xy.xml", cs_file="cs.add.xml"):
     """
-    min_distance = float('inf')
-    best_proj_length = 0
-    total_length = 0
-    for i in range(len(polyline) - 1):
-        x1, y1 = polyline[i]
-        x2, y2 = polyline[i+1]
-        seg_length = math.hypot(x2 - x1, y2 - y1)
-        dist, proj, t = distance_point_to_segment(px, py, x1, y1, x2, y2)
-        if dist < min_distance:
-            min_distance = dist
-            best_proj_length = total_length + t * seg_length
-        total_length += seg_length
-    return min_distance, best_proj_length
-
-def lane_length(polyline):
+    Snap every node of cs_xml to its nearest lane, read offline from the
+    network file, and write the charging stations to cs_file.
     """
-    Compute the total length of a lane represented as a polyline (list of (x,y) points).
-    """
-    total = 0
-    for i in range(len(polyline) - 1):
-        total += math.hypot(polyline[i+1][0] - polyline[i][0],
-                            polyline[i+1][1] - polyline[i][1])
-    return total
-
-def main():
-    # Parse the charging station nodes from the XML file.
-    cs_tree = ET.parse('charging_stations_xy.xml')
-    cs_root = cs_tree.getroot()
-
-    # Get lane shapes from SUMO TraCI.
-    # Exclude internal lanes (IDs starting with ":")
-    lane_shapes = {
-        lane: parse_lane_shape(traci.lane.getShape(lane))
-        for lane in traci.lane.getIDList() if not lane.startswith(":")
-    }
-
-    # Dictionary to store the generated charging stations.
-    charging_stations = {}
-
-    cs_file = "cs.add.xml"
-    with open(cs_file, "w", encoding="utf-8") as f_cs:
-        f_cs.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f_cs.write('<additional>\n')
-        # Process each charging station node.
-        for i, node in enumerate(cs_root.findall('node')):
-            cs_x = float(node.get('x'))
-            cs_y = float(node.get('y'))
-
-            best_lane = None
-            min_distance = float('inf')
-
-            # Determine the nearest lane for this charging station.
-            for lane_id, shape in lane_shapes.items():
-                dist, _ = distance_point_to_polyline(cs_x, cs_y, shape)
-                if dist < min_distance:
-                    min_distance = dist
-                    best_lane = lane_id
-
-            # Compute the lane length.
-            polyline = lane_shapes[best_lane]
-            length = lane_length(polyline)
-            # Determine startPos and endPos.
-            start_pos = max(0.3 * length, 0)
-            end_pos = min(0.7 * length, length)
-            if end_pos - start_pos < 1:  # Ensure valid charging station length.
-                start_pos = 0
-                end_pos = 0.5 * length
-
-            # Randomly choose a power level.
-            power = random.choice([50000, 100000, 150000])
-            efficiency = 1.0
-            # Create a new charging station ID in the desired format.
-            cs_new_id = f"cs{i}"
-            f_cs.write(f'    <chargingStation id="{cs_new_id}" lane="{best_lane}" startPos="{start_pos:.2f}" endPos="{end_pos:.2f}" power="{power}" efficiency="{efficiency}" chargeInTransit="false"/>\n')
-            charging_stations[cs_new_id] = best_lane
-        f_cs.write('</additional>\n')
-
+    charging_stations = lane_snap.write_charging_stations(net_file, cs_xml, cs_file)
     print(f"Charging stations generated successfully: {cs_file}")
     print(f"Charging stations dictionary: {charging_stations}")
+    return charging_stations
 
 '''
 The Charging policy implemetation and dynamic SUMO Simulation using Traci.
 '''
 
 
-if __name__ == "__main__":
-    # Start SUMO with the given network file.
-    net_file = "city.net.xml"
-    traci.start(["sumo", "--net-file", net_file])
-    try:
-        main()
-    finally:
-        traci.close()
-
-
+EV_TYPES = {"ev_car", "ev_truck", "ev_bus"}
+EV_VCLASS = {"ev_car": "passenger", "ev_truck": "truck", "ev_bus": "bus"}
+BATTERY_ACTUAL = "device.battery.actualBatteryCapacity"
+BATTERY_MAX = "device.battery.maximumBatteryCapacity"
+# Variables every EV is subscribed to when it departs; they come back in one batch per step.
+EV_SUBSCRIPTION = (tc.VAR_ROAD_ID, tc.VAR_LANE_ID, tc.VAR_PARAMETER_WITH_KEY)
+# The parameter read through VAR_PARAMETER_WITH_KEY; both traci and libsumo take the plain key.
+EV_PARAMETERS = {tc.VAR_PARAMETER_WITH_KEY: BATTERY_ACTUAL}
+SOC_THRESHOLD = 0.47
+# Controller state of a tracked EV.
+TRACKING, DETOUR, CHARGED, GAVE_UP = range(4)
+STATE_NAMES = ("tracking", "detour", "charged", "gave_up")
 
-def get_distance(pos1, pos2):
-    return math.hypot(pos1[0] - pos2[0], pos1[1] - pos2[1])
 
 def safe_float_param(vehID, param):
     try:
@@ -161,119 +57,685 @@ def safe_float_param(vehID, param):
         print(f"[ERROR] Getting parameter {param}: {e}")
         return 0.0
 
-def find_nearest_reachable_charging_station(vehID):
-    min_distance = float('inf')
-    best_station = None
-    best_station_edge = None
-    current_pos = traci.vehicle.getPosition(vehID)
-    current_edge = traci.vehicle.getRoadID(vehID)
-
-    for station_id in traci.chargingstation.getIDList():
+class DetourRouteCache:
+    """
+    Bounded LRU cache of findRoute results keyed by (from edge, to edge, vType,
+    time bucket). The whole cache is dropped when the simulation time enters a
+    new bucket, so traffic-dependent travel times do not go stale.
+    """
+    def __init__(self, size=4096, bucket_seconds=900):
+        self.size = size
+        self.bucket_seconds = bucket_seconds
+        self.bucket = None
+        self.routes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def set_time(self, now):
+        bucket = int(now // self.bucket_seconds)
+        if bucket != self.bucket:
+            self.bucket = bucket
+            self.routes.clear()
+
+    def find_route(self, from_edge, to_edge, vType=""):
+        """Route edges (a tuple, empty when unroutable), from the cache when possible."""
+        key = (from_edge, to_edge, vType, self.bucket)
+        edges = self.routes.get(key)
+        if edges is not None:
+            self.hits += 1
+            self.routes.move_to_end(key)
+            return edges
+        self.misses += 1
+        edges = tuple(traci.simulation.findRoute(from_edge, to_edge, vType=vType).edges)
+        self.routes[key] = edges
+        if len(self.routes) > self.size:
+            self.routes.popitem(last=False)
+        return edges
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"route cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), {len(self.routes)} cached"
+
+# SUMO's defaults for the energy model parameters a vType does not set.
+ENERGY_DEFAULTS = {"rotatingMass": 40.0, "frontSurfaceArea": 2.6, "airDragCoefficient": 0.35,
+                   "rollDragCoefficient": 0.01, "radialDragCoefficient": 0.1,
+                   "constantPowerIntake": 100.0, "propulsionEfficiency": 0.98}
+# Steepest road grade assumed when bounding the climbing power.
+MAX_GRADE = 0.15
+AIR_DENSITY = 1.2041
+GRAVITY = 9.81
+
+def energy_params(vtype):
+    """Mass, maximum acceleration and energy model parameters of a vType, as read from SUMO."""
+    params = {"mass": traci.vehicletype.getMass(vtype), "accel": traci.vehicletype.getAccel(vtype)}
+    for key, default in ENERGY_DEFAULTS.items():
+        value = traci.vehicletype.getParameter(vtype, key)
+        params[key] = float(value) if value else default
+    return params
+
+def max_drain_power(params, v, step_length=1.0):
+    """
+    Upper bound in W on the battery power SUMO's energy model (HelpersEnergy)
+    draws at a speed of at most v: full acceleration of the vehicle and its
+    rotating mass, climbing MAX_GRADE, rolling and air drag, radial drag for
+    a half turn within one step, and the constant intake, over the propulsion
+    efficiency.
+    """
+    m = params["mass"]
+    power = ((m + params["rotatingMass"]) * params["accel"] * v
+             + m * GRAVITY * (MAX_GRADE + params["rollDragCoefficient"]) * v
+             + 0.5 * AIR_DENSITY * params["frontSurfaceArea"] * params["airDragCoefficient"] * v ** 3
+             + params["radialDragCoefficient"] * m * v * v * math.pi / step_length)
+    return power / params["propulsionEfficiency"] + params["constantPowerIntake"]
+
+class SocScheduler:
+    """
+    Decides when each EV's state of charge is next worth looking at. Every
+    record carries an upper bound on its SoC drop per second (max_drain_power
+    at the fastest speed the vehicle can reach, over its battery size), and
+    the next check is due once that many steps have passed that even at the
+    bound the SoC cannot have fallen below the threshold, so the crossing is
+    caught on the same step as with polling. A drop faster than the bound is
+    reported and the bound raised. With poll, every vehicle is checked every
+    step.
+    """
+    def __init__(self, threshold=SOC_THRESHOLD, step_length=1.0, top_lane_speed=float("inf"), poll=False):
+        self.threshold = threshold
+        self.step_length = step_length
+        self.top_lane_speed = top_lane_speed
+        self.poll = poll
+        self.heap = []
+        self.params = {}
+
+    def drain_bound(self, vehID, vtype, capacity):
+        """Upper bound on the SoC drop per second of a vehicle that just departed."""
+        if capacity <= 0:
+            return 0.0
+        if vtype not in self.params:
+            self.params[vtype] = energy_params(vtype)
+        v = min(traci.vehicle.getMaxSpeed(vehID), traci.vehicle.getSpeedFactor(vehID) * self.top_lane_speed)
+        return max_drain_power(self.params[vtype], v, self.step_length) / 3600.0 / capacity
+
+    def add(self, vehID, when):
+        heapq.heappush(self.heap, (when, vehID))
+
+    def pop_due(self, now):
+        """IDs of the vehicles due for a check at time `now`."""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[1])
+        return due
+
+    def observe(self, vehID, record, soc, now):
+        """Record a SoC reading above the threshold and schedule the next check."""
+        last = record.soc_time
+        if last is not None and now > last and record.soc - soc > record.drain * (now - last) + 1e-9:
+            print(f"[WARN] {vehID} drained faster than its bound "
+                  f"({(record.soc - soc) / (now - last):.3g} > {record.drain:.3g} SoC/s); raising it")
+            record.drain = 2 * (record.soc - soc) / (now - last)
+        record.soc, record.soc_time = soc, now
+        steps = 1
+        if not self.poll and record.drain > 0:
+            steps = max(1, int((soc - self.threshold) / (record.drain * self.step_length)))
+        self.add(vehID, now + steps * self.step_length)
+
+class VehicleRecord:
+    """What the controller knows about one EV while it is in the network."""
+    __slots__ = ("vtype", "vclass", "state", "destination", "max_capacity",
+                 "station", "soc", "soc_time", "drain")
+
+    def __init__(self, vtype, vclass, destination, max_capacity, drain=0.0):
+        self.vtype = vtype
+        self.vclass = vclass
+        self.state = TRACKING
+        self.destination = destination
+        self.max_capacity = max_capacity
+        self.station = -1
+        self.soc = None
+        self.soc_time = None
+        # Upper bound on the SoC drop per second.
+        self.drain = drain
+
+class VehicleStore:
+    """
+    Tracked EVs by vehicle ID. Strings shared between vehicles are interned and
+    stations are stored as small integer codes. Records are dropped when their
+    vehicle arrives, so memory follows the number of EVs in the network rather
+    than the number that ever departed; with spill_file set, every dropped
+    record is appended to it as one CSV line
+    (vehicle,vtype,state,station,arrival time).
+    """
+    def __init__(self, spill_file=None):
+        self.records = {}
+        self.station_ids = []
+        self.station_lanes = []
+        self.station_codes = {}
+        # EVs on their way to each station.
+        self.heading = []
+        self.evicted = 0
+        self.spill = open(spill_file, "w", encoding="utf-8") if spill_file else None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["spill"] = None
+        state["spill_offset"] = self.spill_offset()
+        return state
+
+    def spill_offset(self):
+        """Length in bytes of the spill log with everything written so far (None without one)."""
+        if self.spill is None:
+            return None
+        self.spill.flush()
+        return os.fstat(self.spill.fileno()).st_size
+
+    def reopen(self, spill_file=None):
+        """
+        Reattach the spill log after the store was restored from a checkpoint,
+        cut back to its length at the checkpoint: the records written after it
+        are written again by the resumed run.
+        """
+        if not spill_file or self.spill is not None:
+            return
+        offset = self.__dict__.pop("spill_offset", None)
+        if offset is not None and os.path.exists(spill_file):
+            size = os.path.getsize(spill_file)
+            if size < offset:
+                print(f"[WARN] {spill_file} is shorter than at the checkpoint ({size} < {offset} bytes)")
+            else:
+                os.truncate(spill_file, offset)
+        self.spill = open(spill_file, "a", encoding="utf-8")
+
+    def add(self, vehID, vtype, vclass, destination, max_capacity, drain=0.0):
+        record = VehicleRecord(sys.intern(vtype), vclass, sys.intern(destination), max_capacity, drain)
+        self.records[vehID] = record
+        return record
+
+    def get(self, vehID):
+        return self.records.get(vehID)
+
+    def __len__(self):
+        return len(self.records)
+
+    def station_code(self, station_id):
+        """Integer code of a station; its lane is looked up once, on first use."""
+        code = self.station_codes.get(station_id)
+        if code is None:
+            code = len(self.station_ids)
+            self.station_codes[station_id] = code
+            self.station_ids.append(sys.intern(station_id))
+            self.station_lanes.append(traci.chargingstation.getLaneID(station_id))
+            self.heading.append(0)
+        return code
+
+    def set_detour(self, record, station_id):
+        record.state = DETOUR
+        record.station = self.station_code(station_id)
+        self.heading[record.station] += 1
+
+    def set_state(self, record, state):
+        if record.state == DETOUR:
+            self.heading[record.station] -= 1
+        record.state = state
+
+    def heading_to(self, station_id):
+        code = self.station_codes.get(station_id)
+        return self.heading[code] if code is not None else 0
+
+    def station_of(self, record):
+        return self.station_ids[record.station]
+
+    def lane_of(self, record):
+        return self.station_lanes[record.station] if record.station >= 0 else None
+
+    def evict(self, vehIDs, now):
+        """Drop the records of arrived vehicles. Returns the IDs that were tracked."""
+        gone = []
+        for vehID in vehIDs:
+            record = self.records.pop(vehID, None)
+            if record is None:
+                continue
+            gone.append(vehID)
+            if record.state == DETOUR:
+                self.heading[record.station] -= 1
+            if self.spill:
+                station = self.station_ids[record.station] if record.station >= 0 else ""
+                self.spill.write(f"{vehID},{record.vtype},{STATE_NAMES[record.state]},{station},{now:g}\n")
+        self.evicted += len(gone)
+        return gone
+
+    def close(self):
+        if self.spill:
+            self.spill.close()
+            self.spill = None
+
+def config_net_file(cfg_file):
+    """Network file named in a SUMO configuration file."""
+    net = ET.parse(cfg_file).getroot().find('.//net-file')
+    return os.path.join(os.path.dirname(os.path.abspath(cfg_file)), net.get('value'))
+
+def build_station_indexes(net, k=station_index.DEFAULT_K):
+    """One station index per EV vClass over the charging stations loaded in SUMO."""
+    stations = [(cs, traci.lane.getEdgeID(traci.chargingstation.getLaneID(cs)))
+                for cs in traci.chargingstation.getIDList()]
+    return {vclass: station_index.StationIndex(net, stations, k, vclass)
+            for vclass in sorted(set(EV_VCLASS.values()))}
+
+def find_nearest_reachable_charging_station(current_edge, candidates, routes, vType=""):
+    """
+    First station of candidates, (station, station edge) pairs in order of
+    preference, that SUMO can route to from current_edge. Returns (station,
+    station edge, route edges).
+    """
+    for station_id, station_edge in candidates:
         try:
-            lane_id = traci.chargingstation.getLaneID(station_id)
-            edge_id = traci.lane.getEdgeID(lane_id)
-            xy = traci.simulation.convert2D(edge_id, traci.chargingstation.getStartPos(station_id))
-            dist = get_distance(current_pos, xy)
-            route = traci.simulation.findRoute(current_edge, edge_id)
-            if route.edges and dist < min_distance:
-                min_distance = dist
-                best_station = station_id
-                best_station_edge = edge_id
-        except:
+            edges = routes.find_route(current_edge, station_edge, vType)
+        except traci.TraCIException:
             continue
+        if edges:
+            return station_id, station_edge, edges
+    return None, None, None
+
+def free_places(index, store, capacity):
+    """Places left per station of index: capacity minus vehicles charging there or heading there."""
+    return [capacity - traci.chargingstation.getVehicleCount(cs) - store.heading_to(cs)
+            for cs, _ in index.stations]
+
+def set_detour(vehID, record, current_edge, soc, candidates, routes, store):
+    """Route a low-SoC EV via the first reachable station of candidates and on to its destination."""
+    station_id, station_edge, rt_to_cs = find_nearest_reachable_charging_station(
+        current_edge, candidates, routes, record.vtype)
+    if not station_id:
+        print(f"[WARN] No reachable CS for {vehID}")
+        store.set_state(record, GAVE_UP)
+        traci.vehicle.unsubscribe(vehID)
+        return False
+
+    try:
+        rt_from_cs = routes.find_route(station_edge, current_edge, record.vtype)
+        rt_to_dest = routes.find_route(current_edge, record.destination, record.vtype)
+
+        if not rt_to_cs or not rt_from_cs or not rt_to_dest:
+            raise ValueError("One or more route segments are empty")
+
+        detour_route = list(rt_to_cs[:-1] + rt_from_cs[:-1] + rt_to_dest)
+        traci.vehicle.setRoute(vehID, detour_route)
+        print(f"[INFO] {vehID} detouring via CS {station_id} | SoC: {soc:.2f}")
+        store.set_detour(record, station_id)
+        return True
 
-    return best_station, best_station_edge
+    except (traci.TraCIException, ValueError) as e:
+        print(f"[FAIL] {vehID} detour via {station_id} failed: {e}")
+        store.set_state(record, GAVE_UP)
+        traci.vehicle.unsubscribe(vehID)
+        return False
 
-def compute_charging_duration(vehID, stationID):
-    current = safe_float_param(vehID, "device.battery.actualBatteryCapacity")
-    maximum = safe_float_param(vehID, "device.battery.maximumBatteryCapacity")
+def assign_detours(triggered, station_indexes, routes, store, capacity=None):
+    """
+    Detour every EV that dropped below the threshold in this step. The EVs of
+    one vClass are assigned to stations in one batch over the distinct edges
+    they are on; with a capacity, stations that are full (charging plus
+    already heading there) are avoided where another candidate is left.
+    `triggered` holds (vehID, record, current edge, soc). Returns the IDs that
+    got a detour.
+    """
+    by_class = {}
+    for item in triggered:
+        by_class.setdefault(item[1].vclass, []).append(item)
+    detoured = []
+    for vclass, items in by_class.items():
+        index = station_indexes[vclass]
+        free = free_places(index, store, capacity) if capacity is not None else None
+        preferences = index.assign([edge for _, _, edge, _ in items], free)
+        for (vehID, record, edge, soc), rows in zip(items, preferences):
+            if set_detour(vehID, record, edge, soc, [index.stations[r] for r in rows], routes, store):
+                detoured.append(vehID)
+    return detoured
+
+def check_station_arrival(vehID, record, values, store):
+    """Set the charging stop once a detouring EV is on its station's lane. Returns True when done."""
+    cs_lane = store.lane_of(record)
+    if values[tc.VAR_LANE_ID] != cs_lane:
+        return False
+    station_id = store.station_of(record)
+    current = battery_level(values)
+    print(f"[ARRIVED] {vehID} reached CS lane {cs_lane} | SoC: {current / record.max_capacity:.2f}")
+    duration = compute_charging_duration(vehID, station_id, current, record.max_capacity)
+    try:
+        traci.vehicle.setChargingStationStop(vehID, station_id, duration)
+        print(f"[CHARGE] {vehID} charging at {station_id} for {duration} sec")
+        print(f"[DONE] {vehID} scheduled for full charge.")
+    except traci.TraCIException as e:
+        print(f"[SKIP] Failed to set charging stop for {vehID} | Reason: {e}")
+    # Nothing more to decide for this vehicle; stop its updates.
+    store.set_state(record, CHARGED)
+    traci.vehicle.unsubscribe(vehID)
+    return True
+
+def compute_charging_duration(vehID, stationID, current=None, maximum=None):
+    if current is None:
+        current = safe_float_param(vehID, BATTERY_ACTUAL)
+    if maximum is None:
+        maximum = safe_float_param(vehID, BATTERY_MAX)
     power = traci.chargingstation.getChargingPower(stationID)
     energy_needed = maximum - current
     duration = int((energy_needed / power) * 3600)
     return duration
 
-def main():
-    sumoCmd = ["sumo", "-c", "sumocon.sumocfg"]
-    traci.start(sumoCmd)
+def battery_level(values):
+    """Actual battery capacity from a vehicle's subscription results, a (key, value) pair in both backends."""
+    try:
+        return float(values[tc.VAR_PARAMETER_WITH_KEY][1])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return 0.0
 
-    EV_TYPES = {"ev_car", "ev_truck", "ev_bus"}
-    tracked_vehicles = {}
-    step = 0
 
-    while traci.simulation.getMinExpectedNumber() > 0:
+def subscribe_departed(store, scheduler):
+    """
+    Subscribe every EV that departed in this step to its road, lane and battery
+    level, and record what does not change during the trip: its battery size,
+    destination and drain bound. Returns the IDs of the new EVs.
+    """
+    departed = []
+    for vehID in traci.simulation.getDepartedIDList():
+        vehType = traci.vehicle.getTypeID(vehID)
+        if vehType not in EV_TYPES:
+            continue
+        traci.vehicle.subscribe(vehID, EV_SUBSCRIPTION, parameters=EV_PARAMETERS)
+        capacity = safe_float_param(vehID, BATTERY_MAX)
+        store.add(vehID, vehType, EV_VCLASS[vehType], traci.vehicle.getRoute(vehID)[-1],
+                  capacity, scheduler.drain_bound(vehID, vehType, capacity))
+        departed.append(vehID)
+    return departed
+
+
+CHECKPOINT_VERSION = 2
+
+def checkpoint_files(directory):
+    """(time, SUMO state file, controller state file) of every complete checkpoint, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    checkpoints = []
+    for name in os.listdir(directory):
+        if name.startswith("checkpoint_") and name.endswith(".pkl"):
+            stem = os.path.join(directory, name[:-len(".pkl")])
+            if os.path.exists(stem + ".state.xml.gz"):
+                checkpoints.append((float(name[len("checkpoint_"):-len(".pkl")]),
+                                    stem + ".state.xml.gz", stem + ".pkl"))
+    return sorted(checkpoints)
+
+def save_checkpoint(directory, now, controller, keep=3):
+    """
+    Save the SUMO state and the controller state of time `now` to directory
+    and delete all but the `keep` newest checkpoints. The controller file is
+    written last, so a checkpoint without one is incomplete and ignored.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"checkpoint_{now:012.2f}")
+    traci.simulation.saveState(stem + ".state.xml.gz")
+    tmp = f"{stem}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(dict(controller, version=CHECKPOINT_VERSION, time=now), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, stem + ".pkl")
+    for _, state_file, controller_file in checkpoint_files(directory)[:-keep] if keep else []:
+        os.remove(controller_file)
+        os.remove(state_file)
+
+def load_checkpoint(directory):
+    """Newest checkpoint of directory as (time, SUMO state file, controller state)."""
+    checkpoints = checkpoint_files(directory)
+    if not checkpoints:
+        raise FileNotFoundError(f"No checkpoint in {directory}")
+    now, state_file, controller_file = checkpoints[-1]
+    with open(controller_file, "rb") as f:
+        controller = pickle.load(f)
+    if controller.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{controller_file} was written by an incompatible controller version")
+    return now, state_file, controller
+
+def resubscribe(store):
+    """Subscriptions are not part of the SUMO state; renew them for every EV still undecided."""
+    for vehID, record in store.records.items():
+        if record.state in (TRACKING, DETOUR):
+            traci.vehicle.subscribe(vehID, EV_SUBSCRIPTION, parameters=EV_PARAMETERS)
+
+def config_outputs(cfg_file):
+    """(option, file) of every *-output option set in a SUMO configuration file."""
+    return [(elem.tag, elem.get('value')) for elem in ET.parse(cfg_file).getroot().iter()
+            if elem.tag.endswith('-output') and elem.get('value')]
+
+def output_files(cfg_file, output_dir=None):
+    """(option, path) of every output of cfg_file as sumo_command(cfg_file, output_dir) writes it."""
+    if output_dir:
+        output_dir = os.path.abspath(output_dir)
+        return [(name, os.path.join(output_dir, os.path.basename(value))) for name, value in config_outputs(cfg_file)]
+    base = os.path.dirname(os.path.abspath(cfg_file))
+    return [(name, os.path.join(base, value)) for name, value in config_outputs(cfg_file)]
+
+def sumo_command(cfg_file="sumocon.sumocfg", output_dir=None, seed=None, sumo_args=()):
+    """
+    SUMO command line; with output_dir, every output file of cfg_file is
+    written there under its own base name, together with the SUMO log.
+    """
+    cmd = ["sumo", "-c", cfg_file]
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        # Absolute paths: SUMO resolves relative ones against the config file's directory.
+        for name, path in output_files(cfg_file, output_dir):
+            cmd += ["--" + name, path]
+        cmd += ["--log", os.path.join(os.path.abspath(output_dir), "sumo.log")]
+    if seed is not None:
+        cmd += ["--seed", str(seed)]
+    return cmd + list(sumo_args)
+
+def resumed_segments(directory):
+    """(resume time, directory) of every resumed segment of a run in directory, oldest first."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith("resumed_") and os.path.isdir(path):
+            segments.append((float(name[len("resumed_"):]), path))
+    return sorted(segments)
+
+def join_resumed_outputs(cfg_file, output_dir, segment_root):
+    """
+    Stitch the timestep outputs of the resumed segments in segment_root back
+    into the run's own output files, every segment from its resume time on,
+    and remove them from the segments. Other outputs stay in the segments.
+    """
+    segments = resumed_segments(segment_root)
+    if not segments:
+        return
+    starts = [t for t, _ in segments]
+    for name, path in output_files(cfg_file, output_dir):
+        segment_files = [os.path.join(d, os.path.basename(path)) for _, d in segments]
+        if name not in sim_windows.STITCHED_OUTPUTS:
+            print(f"[WARN] {name} after {starts[0]:g} s is left in {', '.join(d for _, d in segments)}")
+            continue
+        parts = [(path, -math.inf, starts[0])] + list(zip(segment_files, starts, starts[1:] + [None]))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        sim_windows.stitch(parts, tmp)
+        if os.path.exists(tmp):
+            os.replace(tmp, path)
+        for segment_file in segment_files:
+            if os.path.exists(segment_file):
+                os.remove(segment_file)
+
+def run(cfg_file="sumocon.sumocfg", output_dir=None, seed=None, label=None, sumo_args=(),
+        route_cache_size=4096, route_bucket=900, threshold=SOC_THRESHOLD, spill_file=None,
+        station_capacity=None, backend=None, checkpoint_dir=None, checkpoint_interval=3600,
+        keep_checkpoints=3, resume=False, poll_soc=False):
+    """
+    Simulate cfg_file with the charging controller. Returns a summary dict
+    (steps, simulated seconds, detours, charges, checkpoint seconds).
+
+    With checkpoint_dir, the SUMO state and the controller state are saved
+    every checkpoint_interval simulated seconds, keeping the newest
+    keep_checkpoints (0: all); with resume, the run continues from the newest one,
+    which SUMO loads on startup with its RNG states. A resumed run then
+    makes the same decisions and vehicle movements as an uninterrupted one;
+    SUMO's battery device differs in two ways: an EV standing at a station at
+    the checkpoint is billed its constantPowerIntake for every step it keeps
+    standing there, and an EV inside a junction at the checkpoint gets the
+    radial drag of its first step wrong. The resumed run writes its SUMO
+    outputs to a resumed_<time> directory in output_dir (else checkpoint_dir)
+    and, once it ends, its timestep outputs (battery, emission, fcd) are
+    joined to the run's own files; the spill file is cut back to the
+    checkpoint, so no EV record is written twice.
+    With poll_soc, every EV's SoC is checked every step instead of on the
+    SocScheduler's schedule (same detours, for comparison).
+    """
+    t_start = time.time()
+    global traci
+    if backend is not None:
+        traci = sumo_backend.load(backend)
+    print(f"[INFO] SUMO backend: {'libsumo (in-process)' if sumo_backend.is_in_process(traci) else 'traci'}")
+    # Resumed runs write their outputs to a segment of their own, joined to the run's at the end.
+    segment_root = output_dir or checkpoint_dir
+    if resume:
+        resumed_at, state_file, controller = load_checkpoint(checkpoint_dir)
+    for t, segment in resumed_segments(segment_root):
+        # Segments of a fresh run's predecessor, or after the checkpoint resumed from.
+        if not resume or t > resumed_at:
+            shutil.rmtree(segment)
+    if resume:
+        sumoCmd = sumo_command(cfg_file, os.path.join(segment_root, f"resumed_{resumed_at:012.2f}"), seed, sumo_args)
+        # Loaded on startup: simulation.loadState in a running SUMO re-reads the routes with
+        # the restored RNG, so vehicles loaded after the checkpoint get other speed factors.
+        sumoCmd += ["--load-state", state_file]
+    else:
+        sumoCmd = sumo_command(cfg_file, output_dir, seed, sumo_args)
+    if checkpoint_dir:
+        # Without the RNG states and full precision a resumed run drifts away from the original.
+        sumoCmd += ["--save-state.rng", "--save-state.precision", "17"]
+    if label is not None and not sumo_backend.is_in_process(traci):
+        traci.start(sumoCmd, label=label)
+    else:
+        traci.start(sumoCmd)
+    net = net_snapshot.load(config_net_file(cfg_file))
+    station_indexes = build_station_indexes(net)
+    routes = DetourRouteCache(route_cache_size, route_bucket)
+    scheduler = SocScheduler(threshold, traci.simulation.getDeltaT(), float(net.lane_speed.max()), poll_soc)
+
+    # Vehicles on their way to a station; their lane is checked every step.
+    detouring = set()
+    step = 0
+    detours = charges = 0
+    if not resume:
+        store = VehicleStore(spill_file)
+    else:
+        store, scheduler, routes = controller["store"], controller["scheduler"], controller["routes"]
+        detouring, step = controller["detouring"], controller["step"]
+        detours, charges = controller["detours"], controller["charges"]
+        store.reopen(spill_file)
+        resubscribe(store)
+        print(f"[INFO] Resumed from checkpoint at {resumed_at:g} s ({len(store)} EVs tracked)")
+    next_checkpoint = traci.simulation.getTime() + checkpoint_interval
+    checkpoints = 0
+    checkpoint_seconds = 0.0
+
+    # SUMO leaves stopping at its end time (-1: none) to the TraCI client.
+    end_time = traci.simulation.getEndTime()
+    while traci.simulation.getMinExpectedNumber() > 0 and (end_time < 0 or traci.simulation.getTime() < end_time):
         traci.simulationStep()
         step += 1
-
-        for vehID in traci.vehicle.getIDList():
-            vehType = traci.vehicle.getTypeID(vehID)
-            if vehType not in EV_TYPES:
+        now = traci.simulation.getTime()
+        routes.set_time(now)
+        detouring.difference_update(store.evict(traci.simulation.getArrivedIDList(), now))
+        for vehID in subscribe_departed(store, scheduler):
+            scheduler.add(vehID, now)
+
+        # Only subscribed EVs appear here, with all their values from this step.
+        results = traci.vehicle.getAllSubscriptionResults()
+        triggered = []
+        for vehID in scheduler.pop_due(now) + list(detouring):
+            record = store.get(vehID)
+            values = results.get(vehID)
+            if record is not None and values is None and record.soc_time is None:
+                # Subscribed in this step; its first values come with the next one.
+                scheduler.add(vehID, now + scheduler.step_length)
                 continue
-
-            if vehID not in tracked_vehicles:
-                dest = traci.vehicle.getRoute(vehID)[-1]
-                tracked_vehicles[vehID] = {
-                    "detour_set": False,
-                    "charged": False,
-                    "original_destination": dest,
-                    "cs_info": None
-                }
-
-            state = tracked_vehicles[vehID]
-            if state["charged"]:
+            if record is None or values is None or record.state in (CHARGED, GAVE_UP):
+                detouring.discard(vehID)
                 continue
 
-            soc = safe_float_param(vehID, "device.battery.actualBatteryCapacity") / \
-                  safe_float_param(vehID, "device.battery.maximumBatteryCapacity")
-            current_edge = traci.vehicle.getRoadID(vehID)
-
-            # STEP 1: Set detour if SoC is low
-            if soc < 0.47 and not state["detour_set"]:
-                station_id, station_edge = find_nearest_reachable_charging_station(vehID)
-                if not station_id:
-                    print(f"[WARN] No reachable CS for {vehID}")
-                    state["detour_set"] = True
-                    continue
-
-                try:
-                    rt_to_cs = traci.simulation.findRoute(current_edge, station_edge).edges
-                    rt_from_cs = traci.simulation.findRoute(station_edge, current_edge).edges
-                    rt_to_dest = traci.simulation.findRoute(current_edge, state["original_destination"]).edges
-
-                    if not rt_to_cs or not rt_from_cs or not rt_to_dest:
-                        raise ValueError("One or more route segments are empty")
-
-                    detour_route = rt_to_cs[:-1] + rt_from_cs[:-1] + rt_to_dest
-                    traci.vehicle.setRoute(vehID, detour_route)
-                    print(f"[INFO] {vehID} detouring via CS {station_id} | SoC: {soc:.2f}")
-                    state["detour_set"] = True
-                    state["cs_info"] = (station_id, station_edge)
-
-                except (traci.TraCIException, ValueError) as e:
-                    print(f"[FAIL] {vehID} detour via {station_id} failed: {e}")
-                    state["detour_set"] = True
-                    state["charged"] = False
+            maximum = record.max_capacity
+            if maximum <= 0:
+                continue
+            soc = battery_level(values) / maximum
+            current_edge = values[tc.VAR_ROAD_ID]
+
+            # STEP 1: Collect EVs with low SoC (decided on a normal edge, not inside a junction)
+            if record.state == TRACKING:
+                if soc >= threshold or current_edge.startswith(":"):
+                    scheduler.observe(vehID, record, soc, now)
+                else:
+                    triggered.append((vehID, record, current_edge, soc))
+                continue
 
             # STEP 2: Charge when vehicle reaches CS lane
-            if state["detour_set"] and not state["charged"] and state["cs_info"]:
-                cs_lane = traci.chargingstation.getLaneID(state["cs_info"][0])
-                if traci.vehicle.getLaneID(vehID) == cs_lane:
-                    soc_reach = safe_float_param(vehID, "device.battery.actualBatteryCapacity") / \
-                                safe_float_param(vehID, "device.battery.maximumBatteryCapacity")
-                    print(f"[ARRIVED] {vehID} reached CS lane {cs_lane} | SoC: {soc_reach:.2f}")
-                    duration = compute_charging_duration(vehID, state["cs_info"][0])
-                    try:
-                        traci.vehicle.setChargingStationStop(vehID, state["cs_info"][0], duration)
-                        print(f"[CHARGE] {vehID} charging at {state['cs_info'][0]} for {duration} sec")
-
-                        state["charged"] = True
-                        print(f"[DONE] {vehID} scheduled for full charge.")
-                    except traci.TraCIException as e:
-                        print(f"[SKIP] Failed to set charging stop for {vehID} | Reason: {e}")
-                        state["charged"] = True  # skip further attempts
-
+            if check_station_arrival(vehID, record, values, store):
+                detouring.discard(vehID)
+                charges += 1
+
+        # STEP 1 for all EVs collected in this step at once
+        if triggered:
+            for vehID in assign_detours(triggered, station_indexes, routes, store, station_capacity):
+                detours += 1
+                if check_station_arrival(vehID, store.get(vehID), results[vehID], store):
+                    charges += 1
+                else:
+                    detouring.add(vehID)
+
+        if checkpoint_dir and now >= next_checkpoint:
+            t0 = time.time()
+            save_checkpoint(checkpoint_dir, now, {
+                "store": store, "scheduler": scheduler, "routes": routes, "detouring": detouring,
+                "step": step, "detours": detours, "charges": charges}, keep_checkpoints)
+            checkpoint_seconds += time.time() - t0
+            checkpoints += 1
+            next_checkpoint = now + checkpoint_interval
+
+    sim_seconds = traci.simulation.getTime()
+    print(f"[INFO] {routes.summary()}")
+    print(f"[INFO] {store.evicted} EV records evicted on arrival, {len(store)} still held")
+    if checkpoint_dir:
+        wall = time.time() - t_start
+        print(f"[INFO] {checkpoints} checkpoints took {checkpoint_seconds:.2f} s "
+              f"({checkpoint_seconds / max(wall, 1e-9):.1%} of {wall:.1f} s wall time)")
+    store.close()
     print("[SIMULATION COMPLETE]")
     traci.close()
+    if resume:
+        join_resumed_outputs(cfg_file, output_dir, segment_root)
+    return {"steps": step, "sim_seconds": sim_seconds, "detours": detours, "charges": charges,
+            "checkpoint_seconds": checkpoint_seconds}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run SUMO with the EV charging controller")
+    parser.add_argument("--cfg", default="sumocon.sumocfg")
+    parser.add_argument("--threshold", type=float, default=SOC_THRESHOLD, help="SoC below which an EV detours")
+    parser.add_argument("--backend", choices=("libsumo", "traci", "auto"), default=None,
+                        help="SUMO backend (default: $MASVET_SUMO_BACKEND, else traci)")
+    parser.add_argument("--checkpoint-dir", default=None, help="save checkpoints to this directory")
+    parser.add_argument("--checkpoint-interval", type=float, default=3600, help="simulated seconds between checkpoints")
+    parser.add_argument("--keep-checkpoints", type=int, default=3, help="number of newest checkpoints kept (0 keeps all)")
+    parser.add_argument("--resume", action="store_true", help="continue from the newest checkpoint")
+    parser.add_argument("--generate-stations", nargs="?", const="city.net.xml", default=None, metavar="NET",
+                        help="first write cs.add.xml from charging_stations_xy.xml and NET (default: city.net.xml)")
+    args = parser.parse_args()
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume needs --checkpoint-dir")
+    if args.keep_checkpoints < 0:
+        parser.error("--keep-checkpoints must be 0 or more")
+    if args.generate_stations:
+        # Lane geometry comes from the network file; no SUMO instance is needed here.
+        generate_charging_stations(args.generate_stations)
+    run(args.cfg, threshold=args.threshold, backend=args.backend, checkpoint_dir=args.checkpoint_dir,
+        checkpoint_interval=args.checkpoint_interval, keep_checkpoints=args.keep_checkpoints,
+        resume=args.resume)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,61 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EV_TYPE = '''    <vType id="ev_car" vClass="passenger" emissionClass="Energy/default" mass="1500" accel="3.0"
+           decel="4.5" sigma="0.5" maxSpeed="30">
+        <param key="has.battery.device" value="true"/>
+        <param key="device.battery.capacity" value="2000"/>
+        <param key="frontSurfaceArea" value="5"/>
+        <param key="airDragCoefficient" value="0.6"/>
+        <param key="rotatingMass" value="100"/>
+        <param key="radialDragCoefficient" value="0.5"/>
+        <param key="rollDragCoefficient" value="0.01"/>
+        <param key="constantPowerIntake" value="100"/>
+        <param key="propulsionEfficiency" value="0.9"/>
+        <param key="recuperationEfficiency" value="0.0"/>
+    </vType>
+    <vType id="foss_car" vClass="passenger" sigma="0.5"/>
+'''
+STATIONS = ("A0B0_0", "E4D4_0", "B3C3_0", "D1D2_0")
+
+
+def _trip(i, edges):
+    a, b = edges[i % len(edges)], edges[(i * 7 + 3) % len(edges)]
+    vtype = "foss_car" if i % 4 == 3 else "ev_car"
+    charge = f'<param key="device.battery.chargeLevel" value="{1005 + 30 * (i % 20)}"/>' \
+        if vtype == "ev_car" else ""
+    return f'    <trip id="t{i}" type="{vtype}" depart="{i * 2}" from="{a}" to="{b}">{charge}</trip>\n'
+
+
+@pytest.fixture(scope="session")
+def scenario(tmp_path_factory):
+    """A 5x5 grid with four charging stations and 80 trips (60 EVs starting between half and three quarters charged)."""
+    if shutil.which("sumo") is None or shutil.which("netgenerate") is None:
+        pytest.skip("SUMO is not installed")
+    d = tmp_path_factory.mktemp("scenario")
+    subprocess.run(["netgenerate", "--grid", "--grid.number", "5", "--grid.length", "200",
+                    "--default.speed", "13.89", "-o", str(d / "city.net.xml")],
+                   check=True, capture_output=True)
+    edges = [f"{a}{b}" for a, b in (("A0", "B0"), ("B0", "C0"), ("C1", "C2"), ("E4", "D4"), ("D3", "D2"),
+                                    ("A2", "A3"), ("B4", "C4"), ("E0", "E1"), ("C3", "B3"), ("D1", "C1"))]
+    with open(d / "routes.rou.xml", "w") as f:
+        f.write("<routes>\n" + EV_TYPE + "".join(_trip(i, edges) for i in range(80)) + "</routes>\n")
+    with open(d / "cs.add.xml", "w") as f:
+        f.write("<additional>\n")
+        for k, lane in enumerate(STATIONS):
+            f.write(f'    <chargingStation id="cs{k}" lane="{lane}" startPos="40" endPos="160" power="50000"/>\n')
+        f.write("</additional>\n")
+    with open(d / "sumocon.sumocfg", "w") as f:
+        f.write('<configuration>\n'
+                '  <input><net-file value="city.net.xml"/><route-files value="routes.rou.xml"/>'
+                '<additional-files value="cs.add.xml"/></input>\n'
+                '  <output><battery-output value="battery.xml"/><fcd-output value="fcd.xml"/></output>\n'
+                '  <report><no-step-log value="true"/></report>\n'
+                '</configuration>\n')
+    return d
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+import sumo_backend
+import sumo_traci_run
+
+
+def _run(scenario, tmp_path, backend):
+    spill = tmp_path / f"{backend}.csv"
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        result = sumo_traci_run.run(str(scenario / "sumocon.sumocfg"), threshold=0.49,
+                                    spill_file=str(spill), backend=backend)
+    finally:
+        os.chdir(cwd)
+    with open(spill) as f:
+        return result, sorted(f)
+
+
+def test_libsumo_matches_traci(scenario, tmp_path):
+    if sumo_backend._import("libsumo") is None:
+        pytest.skip("libsumo is not installed")
+    traci_result, traci_records = _run(scenario, tmp_path, "traci")
+    libsumo_result, libsumo_records = _run(scenario, tmp_path, "libsumo")
+    assert traci_result["detours"] > 0
+    assert libsumo_result["detours"] == traci_result["detours"]
+    assert libsumo_result["steps"] == traci_result["steps"]
+    assert libsumo_records == traci_records
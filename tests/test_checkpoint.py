@@ -0,0 +1,65 @@
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+import sumo_traci_run
+
+
+def _run(scenario, tmp_path, name, **options):
+    run_dir = tmp_path / name
+    result = sumo_traci_run.run(str(scenario / "sumocon.sumocfg"), output_dir=str(run_dir), threshold=0.49,
+                                spill_file=str(run_dir / "ev_records.csv"),
+                                checkpoint_dir=str(tmp_path / "checkpoints"), **options)
+    with open(run_dir / "ev_records.csv") as f:
+        records = [line.split(",") for line in f]
+    return result, records
+
+
+def _fcd(path, start):
+    steps = {}
+    for _, elem in ET.iterparse(path):
+        if elem.tag == "timestep":
+            if float(elem.get("time")) >= start:
+                steps[elem.get("time")] = sorted(tuple(v.attrib.items()) for v in elem)
+            elem.clear()
+    return steps
+
+
+def _times(path):
+    times = []
+    for _, elem in ET.iterparse(path):
+        if elem.tag == "timestep":
+            times.append(float(elem.get("time")))
+            elem.clear()
+    return times
+
+
+def _keep_checkpoints_until(checkpoint_dir, until):
+    for t, state_file, controller_file in sumo_traci_run.checkpoint_files(str(checkpoint_dir)):
+        if t > until:
+            os.remove(state_file)
+            os.remove(controller_file)
+
+
+def test_resume_reproduces_the_uninterrupted_run(scenario, tmp_path):
+    full, full_records = _run(scenario, tmp_path, "full", checkpoint_interval=100, keep_checkpoints=0)
+    # Resume from the checkpoint at 200 s.
+    _keep_checkpoints_until(tmp_path / "checkpoints", 200)
+    resumed, resumed_records = _run(scenario, tmp_path, "resumed", resume=True)
+    assert full["detours"] > 0
+    for key in ("steps", "sim_seconds", "detours", "charges"):
+        assert resumed[key] == full[key], key
+    assert sorted(resumed_records) == sorted(r for r in full_records if float(r[4]) >= 200)
+    assert _fcd(tmp_path / "resumed" / "fcd.xml", 200) == _fcd(tmp_path / "full" / "fcd.xml", 200)
+
+
+def test_resume_into_the_same_directory_keeps_one_copy_of_everything(scenario, tmp_path):
+    full, full_records = _run(scenario, tmp_path, "run", checkpoint_interval=100, keep_checkpoints=0)
+    shutil.copytree(tmp_path / "run", tmp_path / "full")
+    _keep_checkpoints_until(tmp_path / "checkpoints", 200)
+    resumed, resumed_records = _run(scenario, tmp_path, "run", resume=True)
+    assert sorted(resumed_records) == sorted(full_records)
+    for name in ("fcd.xml", "battery.xml"):
+        assert _times(tmp_path / "run" / name) == _times(tmp_path / "full" / name), name
+    assert _fcd(tmp_path / "run" / "fcd.xml", 0) == _fcd(tmp_path / "full" / "fcd.xml", 0)
+    assert not os.path.exists(tmp_path / "run" / "resumed_000000200.00" / "fcd.xml")
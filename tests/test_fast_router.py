@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+import fast_router
+import net_snapshot
+
+
+@pytest.mark.parametrize("max_speed", [None, 8.0])
+def test_alt_routes_are_as_fast_as_dijkstra(scenario, max_speed):
+    net = net_snapshot.load(str(scenario / "city.net.xml"))
+    router = fast_router.Router(net, landmarks=4)
+    g, _ = router.graph("passenger", max_speed)
+    rows = np.nonzero(g.allowed)[0].tolist()
+    assert rows
+    for s in rows:
+        best = g.distances(s)
+        for t in rows:
+            found = router.route_rows(s, t, "passenger", max_speed)
+            if best[t] >= fast_router.UNREACHABLE:
+                assert found is None, (s, t)
+                continue
+            path, travel_time = found
+            assert path[0] == s and path[-1] == t
+            assert all(v in g.fwd[g.fwd_off[u]:g.fwd_off[u + 1]] for u, v in zip(path, path[1:]))
+            # Both count the travel time of the first edge as well.
+            assert travel_time == pytest.approx(g._cost[s] + best[t], rel=1e-9), (s, t)
+            assert g.path_cost(path) == pytest.approx(travel_time, rel=1e-9), (s, t)
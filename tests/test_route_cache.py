@@ -0,0 +1,34 @@
+import re
+
+import route_cache
+import route_generator
+
+
+def _routes(path):
+    return {elem.get("id"): route_cache.route_edges(elem)
+            for elem in route_generator.iter_top_level(str(path)) if elem.tag == "vehicle"}
+
+
+def _hits(capsys):
+    return int(re.search(r"(\d+) cached", capsys.readouterr().out).group(1))
+
+
+def test_cached_routes_equal_duarouter_and_follow_vtype_edits(scenario, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    net, trips, cache = scenario / "city.net.xml", scenario / "routes.rou.xml", tmp_path / "routes.sqlite"
+    route_generator.route(str(trips), str(tmp_path / "dua.rou.xml"), str(tmp_path / "dua.duarcfg"), str(net))
+    uncached = _routes(tmp_path / "dua.rou.xml")
+
+    route_cache.route_cached(str(trips), str(tmp_path / "first.rou.xml"), str(net), cache_file=str(cache))
+    assert _hits(capsys) == 0
+    route_cache.route_cached(str(trips), str(tmp_path / "second.rou.xml"), str(net), cache_file=str(cache))
+    assert _hits(capsys) > 0
+    assert _routes(tmp_path / "first.rou.xml") == uncached
+    assert _routes(tmp_path / "second.rou.xml") == uncached
+
+    # Same vType IDs, other ev_car definition: only the foss_car pairs may come from the cache.
+    edited = tmp_path / "edited.trips.xml"
+    edited.write_text(trips.read_text().replace('maxSpeed="30"', 'maxSpeed="20"'))
+    _, keys, _ = route_cache.scan_trips(str(edited))
+    route_cache.route_cached(str(edited), str(tmp_path / "edited.rou.xml"), str(net), cache_file=str(cache))
+    assert _hits(capsys) == sum(1 for key in keys if key[0] == "foss_car")
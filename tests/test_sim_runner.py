@@ -0,0 +1,18 @@
+import os
+
+import sim_runner
+
+
+def test_runs_write_their_outputs_to_their_own_directory(scenario, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cfg = str(scenario / "sumocon.sumocfg")
+    runs = [{"label": f"s{seed}", "cfg": cfg, "seed": seed, "threshold": 0.49} for seed in (1, 2)]
+    results = sim_runner.run_all(runs, workers=2)
+    assert [r.get("error") for r in results] == [None, None]
+    for r in results:
+        run_dir = tmp_path / "runs" / r["label"]
+        assert r["output_dir"] == os.path.join("runs", r["label"])
+        for name in ("battery.xml", "fcd.xml", "sumo.log", "controller.log", "ev_records.csv"):
+            assert (run_dir / name).stat().st_size > 0, name
+        with open(run_dir / "battery.xml") as f:
+            assert "<timestep" in f.read()
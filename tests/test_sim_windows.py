@@ -0,0 +1,56 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import sim_windows
+
+ROUTES = '''<routes>
+    <vType id="car"/>
+    <route id="r0" edges="A0B0 B0C0"/>
+    <vehicle id="v0" type="car" route="r0" depart="10"/>
+    <flow id="f0" type="car" route="r0" begin="20" end="50" period="5"/>
+    <person id="p0" depart="95"><walk edges="A0B0 B0C0"/></person>
+    <flow id="f1" type="car" route="r0" begin="120" end="180" number="4"/>
+    <vehicle id="v1" type="car" route="r0" depart="150"/>
+</routes>
+'''
+
+
+def _ids(path):
+    return [elem.get("id") for elem in ET.parse(path).getroot()]
+
+
+def test_split_routes_places_flows_and_persons_by_time(tmp_path):
+    routes = tmp_path / "demand.rou.xml"
+    routes.write_text(ROUTES)
+    windows = sim_windows.split_routes([str(routes)], str(tmp_path), 0, 100, 10)
+    assert sorted(windows) == [0, 1]
+    assert _ids(windows[0][0]) == ["car", "r0", "v0", "f0", "p0"]
+    # p0 departs within the warm-up of window 1.
+    assert _ids(windows[1][0]) == ["car", "r0", "p0", "f1", "v1"]
+    assert windows[1][1] == 3
+
+
+def test_split_routes_rejects_flows_across_windows(tmp_path):
+    routes = tmp_path / "demand.rou.xml"
+    routes.write_text(ROUTES.replace('begin="20" end="50"', 'begin="20" end="150"'))
+    with pytest.raises(ValueError, match="f0"):
+        sim_windows.split_routes([str(routes)], str(tmp_path), 0, 100, 10)
+
+
+def test_windows_stitch_into_one_run(scenario, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cfg = tmp_path / "sumocon.sumocfg"
+    cfg.write_text((scenario / "sumocon.sumocfg").read_text()
+                   .replace('value="city.net.xml"', f'value="{scenario / "city.net.xml"}"')
+                   .replace('value="routes.rou.xml"', f'value="{scenario / "routes.rou.xml"}"')
+                   .replace('value="cs.add.xml"', f'value="{scenario / "cs.add.xml"}"'))
+    results = sim_windows.run_windows(str(cfg), window=60, warmup=20, out_dir="windows", workers=3,
+                                      threshold=0.49)
+    assert len(results) == 3 and all("error" not in r for r in results)
+    # Each window stops at its end instead of running its vehicles to arrival.
+    assert [r["sim_seconds"] for r in results[:2]] == [60, 120]
+    for name in ("battery.xml", "fcd.xml"):
+        assert (tmp_path / "windows" / "window_001" / name).exists()
+        times = [float(e.get("time")) for _, e in ET.iterparse(tmp_path / name) if e.tag == "timestep"]
+        assert times == [float(t) for t in range(len(times))]
@@ -0,0 +1,36 @@
+import os
+
+import sumo_traci_run
+
+
+def _run(scenario, tmp_path, name, **options):
+    spill = tmp_path / f"{name}.csv"
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        result = sumo_traci_run.run(str(scenario / "sumocon.sumocfg"), threshold=0.49,
+                                    spill_file=str(spill), **options)
+    finally:
+        os.chdir(cwd)
+    with open(spill) as f:
+        return result, sorted(f)
+
+
+def test_scheduled_checks_detour_like_polling(scenario, tmp_path, capsys):
+    scheduled, scheduled_records = _run(scenario, tmp_path, "scheduled")
+    polled, polled_records = _run(scenario, tmp_path, "polled", poll_soc=True)
+    assert polled["detours"] > 0
+    assert "drained faster than its bound" not in capsys.readouterr().out
+    assert scheduled["detours"] == polled["detours"]
+    assert scheduled["charges"] == polled["charges"]
+    # vehicle, vtype, final state, station, arrival time of every EV
+    assert scheduled_records == polled_records
+
+
+def test_drain_bound_covers_full_power():
+    params = dict(sumo_traci_run.ENERGY_DEFAULTS, mass=1500.0, accel=3.0)
+    slow = sumo_traci_run.max_drain_power(params, 10.0)
+    fast = sumo_traci_run.max_drain_power(params, 20.0)
+    assert fast > slow > params["constantPowerIntake"] / params["propulsionEfficiency"]
+    # At least the acceleration power alone.
+    assert slow >= (1500.0 + params["rotatingMass"]) * 3.0 * 10.0
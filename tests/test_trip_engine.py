@@ -0,0 +1,70 @@
+import re
+
+import pytest
+
+import net_snapshot
+import trip_engine
+
+# Four 6-hour slots: (mean, deviation) of the share of R->C and C->R trips in percent.
+PRC = {0: (60, 5), 1: (40, 5), 2: (70, 5), 3: (30, 5)}
+PCR = {0: (30, 5), 1: (50, 5), 2: (40, 5), 3: (60, 5)}
+
+
+@pytest.fixture(scope="module")
+def edge_lists(scenario):
+    edges = [e for e in net_snapshot.load(str(scenario / "city.net.xml")).edge_id_list() if not e.startswith(":")]
+    res = {1: [e for e in edges if e[0] in "AB"], 2: [e for e in edges if e[0] == "C"]}
+    com = {1: [e for e in edges if e[0] in "DE"]}
+    return res, com
+
+
+def _plan(edge_lists, entropy, prc=PRC):
+    res, com = edge_lists
+    return trip_engine.build_plan(res, com, {1: 2.0, 2: 1.0}, {1: 1.5}, prc, PCR, [1, 1], 6, 3,
+                                  40, 60, 0.5, entropy)
+
+
+def test_same_seed_gives_the_same_file_for_any_worker_count(edge_lists, tmp_path):
+    entropy = trip_engine.master_entropy(7)
+    plan = _plan(edge_lists, entropy)
+    assert plan.total() > 0
+    files = []
+    for workers in (1, 2, 3):
+        path = tmp_path / f"trips_{workers}.xml"
+        assert trip_engine.stream_trip_file(str(path), plan, entropy, workers) == plan.total()
+        files.append(path.read_bytes())
+    assert files[1] == files[0] and files[2] == files[0]
+
+
+def test_streamed_file_equals_synthesize_and_write(edge_lists, tmp_path):
+    entropy = trip_engine.master_entropy(11)
+    plan = _plan(edge_lists, entropy)
+    trip_engine.stream_trip_file(str(tmp_path / "streamed.xml"), plan, entropy)
+    table = trip_engine.synthesize(plan, entropy)
+    trip_engine.write_trip_file(str(tmp_path / "written.xml"), table)
+    assert len(table) == plan.total()
+    assert (tmp_path / "streamed.xml").read_bytes() == (tmp_path / "written.xml").read_bytes()
+
+
+def _trips_by_slot(path):
+    """Trips of a file per (day, slot), without the running trip number of their ID."""
+    slots = {}
+    for line in path.read_text().splitlines():
+        m = re.match(r'<trip id="(\w+?D(\d+)S(\d+))_\d+"(.*)', line)
+        if m:
+            slots.setdefault((int(m[2]), int(m[3])), []).append(m[1] + m[4])
+    return slots
+
+
+def test_editing_one_slot_leaves_the_other_slots_unchanged(edge_lists, tmp_path):
+    entropy = trip_engine.master_entropy(3)
+    trip_engine.stream_trip_file(str(tmp_path / "before.xml"), _plan(edge_lists, entropy), entropy)
+    edited = _plan(edge_lists, entropy, {**PRC, 2: (10, 5)})
+    trip_engine.stream_trip_file(str(tmp_path / "after.xml"), edited, entropy)
+    before, after = _trips_by_slot(tmp_path / "before.xml"), _trips_by_slot(tmp_path / "after.xml")
+    assert set(before) == set(after)
+    for day, slot in before:
+        if slot == 2:
+            assert before[day, slot] != after[day, slot]
+        else:
+            assert before[day, slot] == after[day, slot], (day, slot)
@@ -0,0 +1,36 @@
+import re
+
+import pytest
+
+import net_snapshot
+import trip_scenario
+
+CITY = {"ev_ratio": [1, 1], "timeslot_hours": 12, "days": 1,
+        "residential_density": 100, "commercial_density": 100, "ownership": 0.5}
+RATES = {0: (50, 5), 1: (50, 5)}
+
+
+@pytest.fixture
+def no_trucks_on_column_a(scenario, tmp_path):
+    """The scenario grid with trucks banned from every edge leaving a node of column A."""
+    text = (scenario / "city.net.xml").read_text()
+    banned = re.sub(r'(<edge id="A\d\w+"[^>]*>\s*<lane [^>]*?)( speed=)', r'\1 disallow="truck"\2', text)
+    path = tmp_path / "city.net.xml"
+    path.write_text(banned)
+    return net_snapshot.load(str(path))
+
+
+def test_class_without_edges_fails_before_writing(no_trucks_on_column_a, tmp_path, monkeypatch):
+    net = no_trucks_on_column_a
+    edges = net.edge_id_list()
+    res = {1: [e for e in edges if e.startswith("A")]}
+    com = {1: [e for e in edges if e.startswith("C")]}
+    monkeypatch.setattr(trip_scenario, "edge_lists", lambda *args: (res, com))
+    areas = {1: {"latlon": (0.0, 0.0, 0.01, 0.01)}}
+    out = tmp_path / "trips.xml"
+    with pytest.raises(ValueError, match="truck in R1"):
+        trip_scenario.generate(net, areas, areas, CITY, RATES, RATES, out=str(out), seed=1, table=False)
+    assert not out.exists()
+    trip_scenario.generate(net, areas, areas, CITY, RATES, RATES, out=str(out), seed=1, table=False,
+                           routable_only=False)
+    assert out.read_text().endswith("</routes>\n")
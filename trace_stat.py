@@ -1,12 +1,12 @@
 import sumolib
+import net_snapshot
 import xml.etree.ElementTree as ET
 from collections import defaultdict
 import csv
 
 def get_edges_from_net(net_file):
     """Returns a list of non-internal edge IDs from a SUMO network file."""
-    net = sumolib.net.readNet(net_file)
-    return [edge.getID() for edge in net.getEdges() if not edge.getID().startswith(":")]
+    return net_snapshot.load(net_file).edge_id_list()
 
 def parse_fcd_and_write_congestion(fcd_file, net_file, output_csv):
     """Parses an FCD file and writes per-edge congestion data to a CSV file."""
@@ -0,0 +1,573 @@
+'''
+Vectorized trip synthesis for MaSVeT.
+
+Trips are held in a columnar TripTable (one NumPy array per column) instead of
+one Python list per trip. Vehicle types, region pairs and edges are stored as
+integer codes; trip IDs and XML are only materialized when the table is written.
+'''
+import contextlib
+import gzip
+import io
+import logging
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import trip_table
+
+logger = logging.getLogger()
+
+EV_TYPES = ('ev_car', 'ev_truck', 'ev_bus')
+FOSS_TYPES = ('foss_car', 'foss_truck', 'foss_bus')
+VEHICLE_TYPES = EV_TYPES + FOSS_TYPES
+# SUMO vClass of every vehicle type, as declared in VTYPES_XML.
+VCLASSES = ('passenger', 'truck', 'bus')
+VTYPE_VCLASS = np.array([0, 1, 2, 0, 1, 2], dtype=np.int64)
+
+VTYPES_XML = (
+    '<vType id="ev_car"   vClass="passenger" mass="1500" loading="0" length="4.5"  maxSpeed="80.0" accel="3.0" decel="4.5" sigma="0.5" tau="1.0" emissionClass="Energy/unknown">\n'
+    '  <param key="has.battery.device" value="true" />\n'
+    '  <param key="device.battery.capacity" value="20000" />\n'
+    '  <param key="maximumPower" value="1000" />\n'
+    '  <param key="device.battery.maximumChargeRate" value="150000" />\n'
+    '  <param key="frontSurfaceArea" value="5" />\n'
+    '  <param key="airDragCoefficient" value="0.6" />\n'
+    '  <param key="rotatingMass" value="100" />\n'
+    '  <param key="radialDragCoefficient" value="0.5" />\n'
+    '  <param key="rollDragCoefficient" value="0.01" />\n'
+    '  <param key="constantPowerIntake" value="100" />\n'
+    '  <param key="propulsionEfficiency" value="0.9" />\n'
+    '  <param key="recuperationEfficiency" value="0.0" />\n'
+    '  <param key="stoppingThreshold" value="0.1" />\n'
+    '  <param key="device.battery.chargeLevelTable" value="0 0.5 1" />\n'
+    '  <param key="device.battery.chargeCurveTable" value="150000 75000 30000" />\n'
+    '</vType>\n'
+    '<vType id="ev_truck" vClass="truck"     mass="12000" loading="0" length="12.0" maxSpeed="60.0" accel="1.2" decel="3.0" sigma="0.5" tau="1.0" emissionClass="Energy/unknown">\n'
+    '  <param key="has.battery.device" value="true" />\n'
+    '  <param key="device.battery.capacity" value="30000" />\n'
+    '  <param key="maximumPower" value="1500" />\n'
+    '  <param key="device.battery.maximumChargeRate" value="200000" />\n'
+    '  <param key="frontSurfaceArea" value="8" />\n'
+    '  <param key="airDragCoefficient" value="0.7" />\n'
+    '  <param key="rotatingMass" value="300" />\n'
+    '  <param key="radialDragCoefficient" value="0.6" />\n'
+    '  <param key="rollDragCoefficient" value="0.02" />\n'
+    '  <param key="constantPowerIntake" value="200" />\n'
+    '  <param key="propulsionEfficiency" value="0.85" />\n'
+    '  <param key="recuperationEfficiency" value="0.1" />\n'
+    '  <param key="stoppingThreshold" value="0.1" />\n'
+    '  <param key="device.battery.chargeLevelTable" value="0 0.5 1" />\n'
+    '  <param key="device.battery.chargeCurveTable" value="150000 80000 35000" />\n'
+    '</vType>\n'
+    '<vType id="ev_bus"   vClass="bus"       mass="8000"  loading="0" length="13.0" maxSpeed="50.0" accel="1.5" decel="3.5" sigma="0.5" tau="1.0" emissionClass="Energy/unknown">\n'
+    '  <param key="has.battery.device" value="true" />\n'
+    '  <param key="device.battery.capacity" value="25000" />\n'
+    '  <param key="maximumPower" value="1200" />\n'
+    '  <param key="device.battery.maximumChargeRate" value="180000" />\n'
+    '  <param key="frontSurfaceArea" value="10" />\n'
+    '  <param key="airDragCoefficient" value="0.8" />\n'
+    '  <param key="rotatingMass" value="400" />\n'
+    '  <param key="radialDragCoefficient" value="0.7" />\n'
+    '  <param key="rollDragCoefficient" value="0.015" />\n'
+    '  <param key="constantPowerIntake" value="250" />\n'
+    '  <param key="propulsionEfficiency" value="0.8" />\n'
+    '  <param key="recuperationEfficiency" value="0.2" />\n'
+    '  <param key="stoppingThreshold" value="0.1" />\n'
+    '  <param key="device.battery.chargeLevelTable" value="0 0.5 1" />\n'
+    '  <param key="device.battery.chargeCurveTable" value="150000 90000 40000" />\n'
+    '</vType>\n'
+    '<vType id="foss_car"   vClass="passenger" length="4.5"  maxSpeed="70.0" accel="3.0" decel="4.5" sigma="0.0" />\n'
+    '<vType id="foss_truck" vClass="truck"     length="12.0" maxSpeed="60.0" accel="1.5" decel="3.5" sigma="0.0" />\n'
+    '<vType id="foss_bus"   vClass="bus"       length="13.0" maxSpeed="50.0" accel="2.0" decel="4.0" sigma="0.0" />\n'
+)
+
+# Number of trip lines joined into a single write() call.
+WRITE_BLOCK = 65536
+# Buffer size of the trip file writer in bytes.
+WRITE_BUFFER = 1 << 20
+
+
+def type_probabilities(ev_ratio):
+    """
+    Probability of each entry of VEHICLE_TYPES: the EV/FOSS group is drawn with
+    the ev_ratio weights, then a type uniformly inside the group.
+    """
+    w = np.asarray(ev_ratio, dtype=float)
+    w = w / w.sum()
+    return np.repeat(w, len(EV_TYPES)) / len(EV_TYPES)
+
+
+def alias_table(weights):
+    """
+    Vose alias table of a weight vector: draw column i uniformly, keep it with
+    probability prob[i], otherwise take alias[i].
+    """
+    n = len(weights)
+    total = float(np.sum(weights))
+    prob = np.ones(n)
+    alias = np.arange(n, dtype=np.int64)
+    if n == 0 or total <= 0:
+        return prob, alias
+    p = (np.asarray(weights, dtype=float) * (n / total)).tolist()
+    small = [i for i, v in enumerate(p) if v < 1.0]
+    large = [i for i, v in enumerate(p) if v >= 1.0]
+    while small and large:
+        s = small.pop(); l = large.pop()
+        prob[s] = p[s]; alias[s] = l
+        p[l] = p[l] + p[s] - 1.0
+        (small if p[l] < 1.0 else large).append(l)
+    return prob, alias
+
+
+class RegionEdges:
+    """
+    Edge lists of all regions in one CSR layout.
+    Region code i owns edge indices flat[offsets[i]:offsets[i+1]], which point
+    into the shared edges list. prob/alias hold each region's alias table over
+    the same slice, so a weighted draw costs O(1) per trip.
+
+    edge_weight maps a list of edge IDs to their sampling weights; None draws
+    edges uniformly.
+    """
+    def __init__(self, res_edge, com_edge, edge_weight=None):
+        self.labels = [f"R{k}" for k in res_edge] + [f"C{k}" for k in com_edge]
+        self.edges = []
+        edge_code = {}
+        lists = []
+        for dct in (res_edge, com_edge):
+            for ids in dct.values():
+                codes = []
+                for e in ids:
+                    if e not in edge_code:
+                        edge_code[e] = len(self.edges)
+                        self.edges.append(e)
+                    codes.append(edge_code[e])
+                lists.append(codes)
+        self.code = {label: i for i, label in enumerate(self.labels)}
+        self.sizes = np.array([len(l) for l in lists], dtype=np.int64)
+        self.offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=self.offsets[1:])
+        self.flat = np.fromiter((c for l in lists for c in l), dtype=np.int32,
+                                count=int(self.offsets[-1]))
+        self.prob = np.ones(len(self.flat))
+        self.alias = np.zeros(len(self.flat), dtype=np.int64)
+        self.drawable = self.sizes > 0
+        weights = None if edge_weight is None else np.asarray(edge_weight(self.edges), dtype=float)
+        # Entries of flat that can be drawn at all (positive weight).
+        self.positive = np.ones(len(self.flat), dtype=bool) if weights is None else weights[self.flat] > 0
+        for i in range(len(self.labels)):
+            a, b = self.offsets[i], self.offsets[i + 1]
+            if weights is None:
+                self.alias[a:b] = np.arange(b - a)
+                continue
+            w = weights[self.flat[a:b]]
+            self.drawable[i] = w.sum() > 0
+            self.prob[a:b], self.alias[a:b] = alias_table(w)
+
+    def undrawable(self):
+        """Labels of the regions none of whose edges can be drawn."""
+        return [label for label, ok in zip(self.labels, self.drawable) if not ok]
+
+    def sample(self, regions, rng):
+        """Draw one edge index from each region code in `regions`."""
+        sizes = self.sizes[regions]
+        ok = self.drawable[regions]
+        if not ok.all():
+            empty = self.labels[int(regions[np.argmin(ok)])]
+            raise ValueError(f"Region {empty} contains no edges to draw from")
+        # One uniform per draw: its integer part picks the column, its
+        # fractional part flips the alias coin. Uniform tables always keep the
+        # column, which reproduces plain uniform sampling exactly.
+        u = rng.random(len(regions)) * sizes
+        local = u.astype(np.int64)
+        np.minimum(local, sizes - 1, out=local)
+        pos = self.offsets[regions] + local
+        local = np.where(u - local < self.prob[pos], local, self.alias[pos])
+        return self.flat[self.offsets[regions] + local]
+
+
+class TripTable:
+    """
+    Columnar trip table. Every column is a NumPy array of equal length:
+      seq    - running trip number, used as the suffix of the trip ID
+      pair   - region pair code (index into pair_labels)
+      day    - simulation day
+      slot   - timeslot inside the day
+      vtype  - vehicle type code (index into VEHICLE_TYPES)
+      src    - source edge code (index into edges)
+      dst    - destination edge code (index into edges)
+      depart - departure time in seconds
+    """
+    COLUMNS = ('seq', 'pair', 'day', 'slot', 'vtype', 'src', 'dst', 'depart')
+
+    def __init__(self, edges, pair_labels, seq, pair, day, slot, vtype, src, dst, depart):
+        self.edges = edges
+        self.pair_labels = pair_labels
+        self.seq = seq
+        self.pair = pair
+        self.day = day
+        self.slot = slot
+        self.vtype = vtype
+        self.src = src
+        self.dst = dst
+        self.depart = depart
+
+    def __len__(self):
+        return len(self.seq)
+
+    def take(self, idx):
+        return TripTable(self.edges, self.pair_labels,
+                         *(getattr(self, c)[idx] for c in self.COLUMNS))
+
+    def sorted_by_depart(self):
+        return self.take(np.argsort(self.depart, kind='stable'))
+
+    def pair_counts(self):
+        """Number of trips per (from region, to region) label pair, omitting empty pairs."""
+        counts = np.bincount(self.pair, minlength=len(self.pair_labels))
+        return {self.pair_labels[i]: int(n) for i, n in enumerate(counts) if n}
+
+    def trip_ids(self):
+        labels = [a + b for a, b in self.pair_labels]
+        return [f"{labels[p]}D{d}S{s}_{q}" for p, d, s, q in
+                zip(self.pair.tolist(), self.day.tolist(), self.slot.tolist(), self.seq.tolist())]
+
+    def xml_lines(self):
+        types = [VEHICLE_TYPES[i] for i in self.vtype.tolist()]
+        src = [self.edges[i] for i in self.src.tolist()]
+        dst = [self.edges[i] for i in self.dst.tolist()]
+        return [
+            f'<trip id="{tid}" type="{tt}" depart="{dep:.2f}" from="{s}" to="{t}" />\n'
+            for tid, tt, dep, s, t in zip(self.trip_ids(), types, self.depart.tolist(), src, dst)
+        ]
+
+
+class TripPlan:
+    """
+    Everything needed to sample trips: region edge lists, the ordered region
+    pairs with their source/destination region codes, and the integer trip
+    counts per (pair, day, slot).
+
+    class_regions optionally holds one RegionEdges per entry of VCLASSES,
+    built over the same edge lists but restricted to the edges that class can
+    use; each trip's edges are then drawn from its vehicle type's tables.
+    """
+    def __init__(self, regions, pair_labels, counts, type_p, pal, T, class_regions=None):
+        self.regions = regions
+        self.class_regions = class_regions
+        self.pair_labels = pair_labels
+        self.src_region = np.array([regions.code[a] for a, _ in pair_labels], dtype=np.int64)
+        self.dst_region = np.array([regions.code[b] for _, b in pair_labels], dtype=np.int64)
+        self.counts = counts
+        self.type_p = type_p
+        self.pal = pal
+        self.T = T
+
+    @property
+    def days(self):
+        return self.counts.shape[1]
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def pair_counts(self):
+        """Same summary as TripTable.pair_counts, read directly from the counts."""
+        per_pair = self.counts.sum(axis=(1, 2))
+        return {self.pair_labels[i]: int(n) for i, n in enumerate(per_pair) if n}
+
+
+def draw_rates(PRC, PCR, total_res, total_com, respd, compd, own, T, days, entropy):
+    """
+    Draw the per-slot, per-day Poisson trip totals RCN, RRN, CRN and CCN,
+    each returned as an array of shape (T, days). Every slot has its own
+    stream, so changing one slot's PRC/PCR leaves the other slots' totals alone.
+    """
+    RCN = np.zeros((T, days), dtype=np.int64)
+    RRN = np.zeros((T, days), dtype=np.int64)
+    CRN = np.zeros((T, days), dtype=np.int64)
+    CCN = np.zeros((T, days), dtype=np.int64)
+    for t in range(T):
+        rng = counts_rng(entropy, t)
+        mu, sig = PRC[t]
+        q = np.clip(rng.normal(mu, sig), 0.0, 100.0) / 100
+        if q <= 0 or math.isnan(q):
+            q = mu / 100
+        rt = q * total_res * respd * own
+        RCN[t] = rng.poisson(lam=rt, size=days)
+        logger.info("Timeslot %d: rho=%s, RCN=%s", t, rt, RCN[t])
+
+        lam_rr = (1 - q) * total_res * respd * own
+        RRN[t] = rng.poisson(lam=lam_rr, size=days)
+        logger.info("Timeslot %d: rho_RR=%s, RRN=%s", t, lam_rr, RRN[t])
+
+        mu2, sig2 = PCR[t]
+        q2 = np.clip(rng.normal(mu2, sig2), 0.0, 100.0) / 100
+        if q2 <= 0 or math.isnan(q2):
+            q2 = mu2 / 100
+        lam_cr = q2 * total_com * compd * own
+        CRN[t] = rng.poisson(lam=lam_cr, size=days)
+        logger.info("Timeslot %d: rho_CR=%s, CRN=%s", t, lam_cr, CRN[t])
+
+        lam_cc = (1 - q2) * total_com * compd * own
+        CCN[t] = rng.poisson(lam=lam_cc, size=days)
+        logger.info("Timeslot %d: rho_CC=%s, CCN=%s", t, lam_cc, CCN[t])
+    return RCN, RRN, CRN, CCN
+
+
+def build_plan(res_edge, com_edge, res_km, com_km, PRC, PCR, ev_ratio, tsz, days,
+               respd, compd, own, entropy, regions=None, class_regions=None):
+    """
+    Draw the trip rates and turn them into per (pair, day, slot) trip counts.
+    `entropy` is the master seed entropy (see master_entropy).
+    Pairs keep the order generate_trips has always used: R→C, R→R, C→R, C→C.
+    `regions` is a prebuilt RegionEdges of the same edge lists, e.g. one with
+    weighted alias tables; by default edges are drawn uniformly.
+    `class_regions` restricts the draw per vehicle class (see TripPlan).
+    """
+    pal = int(tsz * 3600)
+    T = int(24 / tsz)
+    total_res = sum(res_km.values())
+    total_com = sum(com_km.values())
+    RCN, RRN, CRN, CCN = draw_rates(PRC, PCR, total_res, total_com, respd, compd, own, T, days, entropy)
+
+    blocks = (
+        (res_km, total_res, com_km, total_com, 'R', 'C', RCN),
+        (res_km, total_res, res_km, total_res, 'R', 'R', RRN),
+        (com_km, total_com, res_km, total_res, 'C', 'R', CRN),
+        (com_km, total_com, com_km, total_com, 'C', 'C', CCN),
+    )
+    pair_labels = []
+    counts = []
+    for src_km, src_total, dst_km, dst_total, a, b, N in blocks:
+        Nd = N.T  # (days, T)
+        for r, ra in src_km.items():
+            pr = ra / src_total
+            for c, ca in dst_km.items():
+                pc = ca / dst_total
+                pair_labels.append((f"{a}{r}", f"{b}{c}"))
+                counts.append((pr * Nd * pc).astype(np.int64))
+    counts = np.array(counts, dtype=np.int64).reshape(len(pair_labels), days, T)
+    if regions is None:
+        regions = RegionEdges(res_edge, com_edge)
+    return TripPlan(regions, pair_labels, counts, type_probabilities(ev_ratio), pal, T,
+                    class_regions)
+
+
+def sample_trips(plan, pair, day, slot, seq, rng):
+    """Sample types, edges and departure offsets for the given trip rows in bulk."""
+    n = len(pair)
+    vtype = rng.choice(len(VEHICLE_TYPES), size=n, p=plan.type_p).astype(np.int8)
+    if plan.class_regions is None:
+        src = plan.regions.sample(plan.src_region[pair], rng)
+        dst = plan.regions.sample(plan.dst_region[pair], rng)
+    else:
+        src = np.empty(n, dtype=np.int32)
+        dst = np.empty(n, dtype=np.int32)
+        vclass = VTYPE_VCLASS[vtype]
+        for c, regions in enumerate(plan.class_regions):
+            idx = np.nonzero(vclass == c)[0]
+            if len(idx):
+                src[idx] = regions.sample(plan.src_region[pair[idx]], rng)
+                dst[idx] = regions.sample(plan.dst_region[pair[idx]], rng)
+    depart = (day * plan.T + slot) * float(plan.pal) + rng.random(n) * plan.pal
+    return TripTable(plan.regions.edges, plan.pair_labels, seq,
+                     pair.astype(np.int32), day.astype(np.int32), slot.astype(np.int32),
+                     vtype, src, dst, depart)
+
+
+def master_entropy(seed=None):
+    """
+    Entropy of the master seed. Every RNG stream of a run is derived from it,
+    so logging it is enough to reproduce an unseeded run.
+    """
+    return np.random.SeedSequence(seed).entropy
+
+
+def counts_rng(entropy, s):
+    """Stream used by build_plan to draw the trip totals of timeslot s."""
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(0, s)))
+
+
+def slot_rng(entropy, d, s):
+    """
+    Independent sampling stream of timeslot s of day d; it depends only on the
+    master seed, d and s, so editing one slot leaves every other slot's trips
+    unchanged.
+    """
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(1, d, s)))
+
+
+def day_seq_start(plan, d):
+    """Trip number of the first trip of day d."""
+    return int(plan.counts[:, :d, :].sum())
+
+
+def iter_day(plan, d, entropy, seq_start):
+    """
+    Sample day d one timeslot window at a time and yield each window as a
+    TripTable sorted by departure. Trip numbers are assigned after sorting, so
+    they increase with departure time.
+    """
+    pair_codes = np.arange(len(plan.pair_labels), dtype=np.int64)
+    seq = seq_start
+    for s in range(plan.T):
+        per_pair = plan.counts[:, d, s]
+        n = int(per_pair.sum())
+        if n == 0:
+            continue
+        pair = np.repeat(pair_codes, per_pair)
+        day = np.full(n, d, dtype=np.int64)
+        slot = np.full(n, s, dtype=np.int64)
+        window = sample_trips(plan, pair, day, slot, np.zeros(n, dtype=np.int64),
+                              slot_rng(entropy, d, s)).sorted_by_depart()
+        window.seq = np.arange(seq, seq + n, dtype=np.int64)
+        seq += n
+        yield window
+
+
+def iter_windows(plan, entropy):
+    """
+    Yield every (day, slot) window of the plan in departure order. Windows
+    cover disjoint, increasing departure ranges, so the rows are globally
+    ordered by departure while only a single window is held in memory.
+    """
+    seq = 0
+    for d in range(plan.days):
+        for window in iter_day(plan, d, entropy, seq):
+            yield window
+        seq += int(plan.counts[:, d, :].sum())
+
+
+def synthesize(plan, entropy):
+    """All trips of the plan as one TripTable, identical to the streamed output."""
+    windows = list(iter_windows(plan, entropy))
+    if not windows:
+        empty = np.zeros(0, dtype=np.int64)
+        return TripTable(plan.regions.edges, plan.pair_labels, empty, empty.astype(np.int32),
+                         empty.astype(np.int32), empty.astype(np.int32), empty.astype(np.int8),
+                         empty.astype(np.int32), empty.astype(np.int32), empty.astype(float))
+    return TripTable(plan.regions.edges, plan.pair_labels,
+                     *(np.concatenate([getattr(w, c) for w in windows]) for c in TripTable.COLUMNS))
+
+
+def print_pair_summary(pair_counts):
+    print("\nTrip Count Between Region Pairs:")
+    for k, v in sorted(pair_counts.items()):
+        print(f"{k[0]} → {k[1]} : {v} trips")
+
+
+def open_trip_output(path, compress=None):
+    """Buffered text stream for a trip file, gzip-compressed when the path ends in .gz."""
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        raw = io.BufferedWriter(gzip.open(path, 'wb', compresslevel=6), WRITE_BUFFER)
+        return io.TextIOWrapper(raw, encoding='utf-8')
+    return open(path, 'w', buffering=WRITE_BUFFER, encoding='utf-8')
+
+
+@contextlib.contextmanager
+def trip_output(path):
+    """
+    open_trip_output on a temporary file next to path, renamed to path once
+    it is complete; on an error it is removed, so no partial file is left.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open_trip_output(tmp, compress=path.endswith('.gz')) as f:
+            yield f
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+def write_trips(f, table):
+    for i in range(0, len(table), WRITE_BLOCK):
+        f.write(''.join(table.take(slice(i, i + WRITE_BLOCK)).xml_lines()))
+
+
+def write_trip_file(path, table):
+    """Write the vehicle types and all trips of `table` in departure order."""
+    table = table.sorted_by_depart()
+    with trip_output(path) as f:
+        f.write('<routes>\n')
+        f.write(VTYPES_XML)
+        write_trips(f, table)
+        f.write('</routes>\n')
+
+
+def _day_text(plan, entropy, d, table=None):
+    """
+    XML of all trips of day d; the unit of work of a generation worker. When a
+    TableWriter is given, the day's rows are also stored in the trip table.
+    """
+    parts = []
+    for w in iter_day(plan, d, entropy, day_seq_start(plan, d)):
+        parts.append(''.join(w.xml_lines()))
+        if table is not None:
+            table.write(w)
+    return ''.join(parts)
+
+
+_worker_plan = None
+_worker_entropy = None
+_worker_table = None
+
+
+def _init_worker(plan, entropy, table_path):
+    global _worker_plan, _worker_entropy, _worker_table
+    _worker_plan, _worker_entropy = plan, entropy
+    _worker_table = trip_table.TableWriter(table_path) if table_path else None
+
+
+def _worker_day_text(d):
+    text = _day_text(_worker_plan, _worker_entropy, d, _worker_table)
+    if _worker_table is not None:
+        _worker_table.close()
+    return text
+
+
+def stream_trip_file(path, plan, entropy, workers=1, table_path=None):
+    """
+    Streaming counterpart of synthesize + write_trip_file: each (day, slot)
+    window is sampled, sorted and written before the next one is drawn, so
+    memory is bounded by the largest window rather than the whole scenario.
+
+    With workers > 1, days are sharded over a process pool. Each day draws
+    from per-slot streams derived from the master entropy and numbers its trips
+    from a start known in advance, so the file is byte-identical for any
+    worker count. Day results are written in order with at most 2 * workers
+    days in flight.
+
+    With table_path, the same trips are also stored as a columnar trip table
+    (see trip_table.py); every window is written at its own row offset, so
+    workers fill the table directly. Returns the number of trips written.
+    """
+    if table_path:
+        trip_table.create(table_path, plan)
+    with trip_output(path) as f:
+        f.write('<routes>\n')
+        f.write(VTYPES_XML)
+        if workers <= 1:
+            table = trip_table.TableWriter(table_path) if table_path else None
+            for window in iter_windows(plan, entropy):
+                write_trips(f, window)
+                if table is not None:
+                    table.write(window)
+            if table is not None:
+                table.close()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(plan, entropy, table_path)) as pool:
+                pending = deque()
+                for d in range(plan.days):
+                    pending.append(pool.submit(_worker_day_text, d))
+                    if len(pending) >= 2 * workers:
+                        f.write(pending.popleft().result())
+                while pending:
+                    f.write(pending.popleft().result())
+        f.write('</routes>\n')
+    return plan.total()
@@ -0,0 +1,288 @@
+'''
+Headless trip generation from scenario files.
+
+A scenario file is JSON holding everything the DrawBoundingBox dialogs ask for:
+
+    {
+      "network": "new.net.xml",
+      "output": "sim_dip.odtrips.xml",
+      "seed": 42,
+      "workers": 4,
+      "edge_weight": "length_lanes",
+      "residential": [[minlon, minlat, maxlon, maxlat], ...],
+      "commercial":  [[minlon, minlat, maxlon, maxlat], ...],
+      "city": {
+        "ev_ratio": [4, 6],
+        "timeslot_hours": 1,
+        "days": 7,
+        "residential_density": 5000,
+        "commercial_density": 3000,
+        "ownership": 0.4
+      },
+      "prc": [[mu, sigma], ...],   # one pair per timeslot
+      "pcr": [[mu, sigma], ...]
+    }
+
+"network", "output", "seed", "workers" and "table" are optional; with
+"workers" > 1 days are generated in a process pool, and a fixed seed yields
+the same file whatever the worker count. "table" is the directory of the
+columnar trip table written alongside the XML (derived from "output" by
+default, false to skip it). "edge_weight" chooses how source and destination
+edges are weighted inside a region: "uniform", "length", "length_lanes" or
+the path of an "edge_id,weight" CSV file. "routable_only" (default true)
+limits every vehicle class to edges it may use inside the largest strongly
+connected component of its network; a region where some class has no such
+edge is an error, raised before the trip file is opened. Trip files are
+written to a temporary name and renamed when complete. Networks are loaded
+lazily and cached per process, so any number of scenarios can share one
+parsed network:
+
+    python trip_scenario.py sweep/*.json
+'''
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import numpy as np
+import edge_index
+import net_snapshot
+import trip_engine
+import trip_table
+
+logger = logging.getLogger()
+
+DEFAULT_NET_FILE = 'new.net.xml'
+DEFAULT_OUTPUT = 'sim_dip.odtrips.xml'
+
+_networks = {}
+_region_tables = {}
+
+
+def get_network(net_file=DEFAULT_NET_FILE):
+    """
+    NetSnapshot of a SUMO network, mapped on first use; later calls return the
+    cached object.
+    """
+    key = os.path.abspath(net_file)
+    if key not in _networks:
+        logger.info("Loading network %s", net_file)
+        _networks[key] = net_snapshot.load(net_file)
+    return _networks[key]
+
+
+def edge_lists(net, res_areas, com_areas):
+    """
+    IDs of the edges whose both end nodes lie inside each region's lon/lat box,
+    answered from the network's cached EdgeIndex and memoized per region set.
+    """
+    return edge_index.get_index(net).edge_lists(res_areas, com_areas)
+
+
+def edge_weight(net, spec):
+    """
+    Sampling weight function for RegionEdges from a scenario "edge_weight" value:
+      "uniform"      - every edge equally likely (default)
+      "length"       - edge length
+      "length_lanes" - edge length times number of lanes
+      <path>.csv     - user-supplied "edge_id,weight" rows; unlisted edges get 0
+    """
+    if spec in (None, "uniform"):
+        return None
+    if spec == "length":
+        values = np.asarray(net.edge_length, dtype=float)
+    elif spec == "length_lanes":
+        values = np.asarray(net.edge_length, dtype=float) * np.asarray(net.edge_lanes)
+    elif str(spec).endswith(".csv"):
+        with open(spec, newline='') as f:
+            user = {row[0]: float(row[1]) for row in csv.reader(f) if row and not row[0].startswith('#')}
+        return lambda ids: [user.get(e, 0.0) for e in ids]
+    else:
+        raise ValueError(f"Unknown edge_weight {spec!r}")
+    return lambda ids: values[[net.edge_code(e) for e in ids]]
+
+
+def region_edges(net, res_areas, com_areas, spec=None):
+    """
+    RegionEdges with alias tables for the given region set and weight spec,
+    built once and reused by every later scenario with the same regions.
+    """
+    key = (net.hash, spec,
+           tuple(tuple(v["latlon"]) for v in res_areas.values()),
+           tuple(tuple(v["latlon"]) for v in com_areas.values()))
+    if key not in _region_tables:
+        res_edge, com_edge = edge_lists(net, res_areas, com_areas)
+        _region_tables[key] = trip_engine.RegionEdges(res_edge, com_edge, edge_weight(net, spec))
+    return _region_tables[key]
+
+
+def class_region_edges(net, res_areas, com_areas, spec=None):
+    """
+    One RegionEdges per trip_engine.VCLASSES over the same region edge lists,
+    giving weight only to the edges that class may use and that lie in the
+    class's largest strongly connected component. Trips drawn from them can
+    always be routed, so duarouter never has to discard them. Built once per
+    region set; the exclusions are printed and logged when first built.
+    Raises ValueError naming every class and region pair without a single
+    usable edge, before any trip is drawn.
+    """
+    key = ("routable", net.hash, spec,
+           tuple(tuple(v["latlon"]) for v in res_areas.values()),
+           tuple(tuple(v["latlon"]) for v in com_areas.values()))
+    if key not in _region_tables:
+        res_edge, com_edge = edge_lists(net, res_areas, com_areas)
+        base = edge_weight(net, spec)
+        tables = []
+        for vclass in trip_engine.VCLASSES:
+            ok = net.routable(vclass)
+
+            def weight(ids, ok=ok):
+                w = np.ones(len(ids)) if base is None else np.asarray(base(ids), dtype=float)
+                return w * ok[[net.edge_code(e) for e in ids]]
+            tables.append(trip_engine.RegionEdges(res_edge, com_edge, weight))
+        prefilter_report(tables)
+        missing = [f"{vclass} in {label}" for vclass, t in zip(trip_engine.VCLASSES, tables)
+                   for label in t.undrawable() if t.sizes[t.code[label]]]
+        if missing:
+            raise ValueError("No routable edge for " + ", ".join(missing) +
+                             "; widen these regions or set routable_only to false")
+        _region_tables[key] = tables
+    return _region_tables[key]
+
+
+def prefilter_report(tables):
+    print("\nEdges excluded per region (not allowed or not strongly connected):")
+    first = tables[0]
+    for i, label in enumerate(first.labels):
+        a, b = first.offsets[i], first.offsets[i + 1]
+        parts = []
+        for vclass, t in zip(trip_engine.VCLASSES, tables):
+            excluded = int(np.count_nonzero(~t.positive[a:b]))
+            parts.append(f"{vclass} -{excluded}" + (" (none left)" if b > a and excluded == b - a else ""))
+        line = f"{label}: {b - a} edges | " + " | ".join(parts)
+        print(line)
+        logger.info("Prefilter %s", line)
+
+
+def area_km(areas, kind):
+    """Area in km² of every lon/lat box in `areas`; `kind` only labels the log lines."""
+    R = 6371.0
+    out = {}
+    for k, v in areas.items():
+        minx, miny, maxx, maxy = v["latlon"]
+        dlat = math.radians(maxy - miny); dlon = math.radians(maxx - minx)
+        la1, la2 = math.radians(miny), math.radians(maxy)
+        a = math.sin(dlat / 2) ** 2 + math.cos(la1) * math.cos(la2) * math.sin(dlon / 2) ** 2
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        h = R * c; w = R * dlon * math.cos((la1 + la2) / 2)
+        out[k] = h * w
+        logger.info("%s region %d area: %.3f km²", kind, k, out[k])
+    return out
+
+
+def generate(net, res_areas, com_areas, city, PRC, PCR, out=DEFAULT_OUTPUT, stream=True,
+             seed=None, workers=1, table=True, weight=None, routable_only=True):
+    """
+    Run the trip engine for one scenario and write its trip file.
+    `city` uses the keys documented at the top of this module; PRC and PCR map
+    timeslot index to (mu, sigma). The same seed gives a byte-identical file
+    for any number of workers. Unless `table` is False, a columnar trip table
+    is written too, at `table` if it is a path or next to `out` otherwise.
+    `weight` selects how edges are weighted inside a region (see edge_weight).
+    With routable_only, each vehicle class only draws edges it can be routed
+    between (see class_region_edges).
+    Returns the TripPlan that was written.
+    """
+    T = int(24 / float(city["timeslot_hours"]))
+    for name, rates in (("PRC", PRC), ("PCR", PCR)):
+        if len(rates) != T:
+            raise ValueError(f"{name} has {len(rates)} entries, expected one per timeslot ({T})")
+
+    regions = region_edges(net, res_areas, com_areas, weight)
+    if regions.undrawable():
+        raise ValueError(f"Regions without edges: {', '.join(regions.undrawable())}")
+    class_regions = class_region_edges(net, res_areas, com_areas, weight) if routable_only else None
+    res_edge, com_edge = edge_lists(net, res_areas, com_areas)
+    res_km = area_km(res_areas, "Residential")
+    com_km = area_km(com_areas, "Commercial")
+
+    entropy = trip_engine.master_entropy(seed)
+    logger.info("Master seed entropy: %s", entropy)
+    plan = trip_engine.build_plan(
+        res_edge, com_edge, res_km, com_km, PRC, PCR,
+        list(map(int, city["ev_ratio"])), float(city["timeslot_hours"]), int(city["days"]),
+        float(city["residential_density"]), float(city["commercial_density"]),
+        float(city["ownership"]), entropy, regions=regions,
+        class_regions=class_regions)
+
+    trip_engine.print_pair_summary(plan.pair_counts())
+    table_path = None
+    if table:
+        table_path = table if isinstance(table, str) else trip_table.table_path_for(out)
+    if stream:
+        trip_engine.stream_trip_file(out, plan, entropy, workers=workers, table_path=table_path)
+    else:
+        trips = trip_engine.synthesize(plan, entropy)
+        trip_engine.write_trip_file(out, trips)
+        if table_path:
+            trip_table.save(table_path, plan, trips)
+    print(f"Trip File Generation Successful: {out}")
+    if table_path:
+        print(f"Trip table written: {table_path}")
+    return plan
+
+
+def load_scenario(path):
+    with open(path) as f:
+        scenario = json.load(f)
+    scenario.setdefault("network", DEFAULT_NET_FILE)
+    scenario.setdefault("output", DEFAULT_OUTPUT)
+    scenario.setdefault("seed", None)
+    scenario.setdefault("workers", 1)
+    scenario.setdefault("table", True)
+    scenario.setdefault("edge_weight", "uniform")
+    scenario.setdefault("routable_only", True)
+    return scenario
+
+
+def run_scenario(scenario, net=None):
+    """Generate the trip file of an already loaded scenario dict."""
+    if net is None:
+        net = get_network(scenario["network"])
+    res_areas = {i + 1: {"latlon": tuple(b)} for i, b in enumerate(scenario["residential"])}
+    com_areas = {i + 1: {"latlon": tuple(b)} for i, b in enumerate(scenario["commercial"])}
+    PRC = {i: tuple(v) for i, v in enumerate(scenario["prc"])}
+    PCR = {i: tuple(v) for i, v in enumerate(scenario["pcr"])}
+    logger.info("PRC: %s", PRC)
+    logger.info("PCR: %s", PCR)
+    return generate(net, res_areas, com_areas, scenario["city"], PRC, PCR,
+                    out=scenario["output"], seed=scenario["seed"], workers=scenario["workers"],
+                    table=scenario["table"], weight=scenario["edge_weight"],
+                    routable_only=scenario["routable_only"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate MaSVeT trip files from scenario files")
+    parser.add_argument("scenarios", nargs="+", help="scenario JSON files")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="generation processes per scenario (overrides the scenario file)")
+    parser.add_argument("--log", default="trip_scenario.log", help="log file")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        filename=args.log,
+        filemode='w',
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    for path in args.scenarios:
+        print(f"[INFO] Scenario {path}")
+        scenario = load_scenario(path)
+        if args.workers is not None:
+            scenario["workers"] = args.workers
+        run_scenario(scenario)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+'''
+On-disk columnar trip table written next to the SUMO trip XML.
+
+A table is a directory holding one .npy file per TripTable column plus the
+code books (edges.npy for edge codes, meta.json for region pairs, vehicle
+types and timeslot layout). Rows are stored in departure order and columns
+are memory-mapped on load, so counting trips by type, pair, day or slot never
+touches XML, and the XML itself can be re-emitted from the table:
+
+    python trip_table.py sim_dip.odtrips.table sim_dip.odtrips.xml
+'''
+import argparse
+import json
+import os
+import numpy as np
+import trip_engine
+
+FORMAT_VERSION = 1
+
+DTYPES = {
+    'seq': np.int64,
+    'pair': np.int32,
+    'day': np.int32,
+    'slot': np.int32,
+    'vtype': np.int8,
+    'src': np.int32,
+    'dst': np.int32,
+    'depart': np.float64,
+}
+
+
+def table_path_for(trip_file):
+    """Default table directory of a trip file: sim_dip.odtrips.xml(.gz) -> sim_dip.odtrips.table"""
+    base = trip_file[:-3] if trip_file.endswith('.gz') else trip_file
+    base = base[:-4] if base.endswith('.xml') else base
+    return base + '.table'
+
+
+def _column_path(path, column):
+    return os.path.join(path, column + '.npy')
+
+
+def create(path, plan):
+    """
+    Lay out an empty table for every trip of `plan`. The row count is known
+    from the plan's counts, so columns are preallocated and later filled in
+    place by TableWriter, possibly from several processes at once.
+    """
+    os.makedirs(path, exist_ok=True)
+    n = plan.total()
+    for column, dtype in DTYPES.items():
+        np.lib.format.open_memmap(_column_path(path, column), mode='w+', dtype=dtype, shape=(n,)).flush()
+    np.save(os.path.join(path, 'edges.npy'), np.array(plan.regions.edges, dtype=str))
+    meta = {
+        'version': FORMAT_VERSION,
+        'rows': n,
+        'pair_labels': [list(p) for p in plan.pair_labels],
+        'vehicle_types': list(trip_engine.VEHICLE_TYPES),
+        'timeslots': plan.T,
+        'timeslot_seconds': plan.pal,
+        'days': plan.days,
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+class TableWriter:
+    """Writes TripTable chunks into a created table; a chunk's rows land at its trip numbers."""
+    def __init__(self, path):
+        self.columns = {c: np.load(_column_path(path, c), mmap_mode='r+') for c in DTYPES}
+
+    def write(self, table):
+        if not len(table):
+            return
+        start = int(table.seq[0])
+        for c, col in self.columns.items():
+            col[start:start + len(table)] = getattr(table, c)
+
+    def close(self):
+        for col in self.columns.values():
+            col.flush()
+
+
+def save(path, plan, table):
+    """Write a complete in-memory TripTable (rows already numbered in departure order)."""
+    create(path, plan)
+    writer = TableWriter(path)
+    writer.write(table)
+    writer.close()
+
+
+def load(path):
+    """TripTable whose columns are memory-mapped from `path`."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    edges = np.load(os.path.join(path, 'edges.npy')).tolist()
+    pair_labels = [tuple(p) for p in meta['pair_labels']]
+    columns = [np.load(_column_path(path, c), mmap_mode='r') for c in trip_engine.TripTable.COLUMNS]
+    return trip_engine.TripTable(edges, pair_labels, *columns)
+
+
+def to_xml(path, out):
+    """Stream the table at `path` into a SUMO trip file (gzip-compressed when `out` ends in .gz)."""
+    table = load(path)
+    with trip_engine.open_trip_output(out) as f:
+        f.write('<routes>\n')
+        f.write(trip_engine.VTYPES_XML)
+        trip_engine.write_trips(f, table)
+        f.write('</routes>\n')
+    return len(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a MaSVeT trip table into SUMO trip XML")
+    parser.add_argument("table", help="trip table directory")
+    parser.add_argument("output", help="trip file to write (.xml or .xml.gz)")
+    args = parser.parse_args()
+    n = to_xml(args.table, args.output)
+    print(f"Wrote {n} trips to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,11 @@
 import tkinter as tk
 from tkinter import Canvas
-from PIL import Image, ImageTk, ImageDraw
-import sumolib
-import xml.etree.ElementTree as ET
-import math
+from PIL import ImageTk
 import logging
+import math
 import os
-import random
-import numpy as np
-
-# Load SUMO network
-net = sumolib.net.readNet('new.net.xml')
-
-# Parse for netOffset (not used but kept)
-tree = ET.parse('new.net.xml')
-root = tree.getroot()
-location = root.find('location')
-netOffset = tuple(map(float, location.attrib['netOffset'].split(',')))
+import net_tiles
+import trip_scenario
 
 # Logging setup
 log_filepath = os.path.join(os.getcwd(), 'dictionary_log2.log')
@@ -28,21 +17,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
-def draw_network_image(net, width=800, height=600):
-    xmin, ymin, xmax, ymax = net.getBoundary()
-    img = Image.new("RGB", (width, height), "white")
-    draw = ImageDraw.Draw(img)
-    for edge in net.getEdges():
-        shape = edge.getShape()
-        pts = [
-            (
-                int((x - xmin)/(xmax-xmin)*width),
-                int((y - ymin)/(ymax-ymin)*height)
-            ) for x,y in shape
-        ]
-        draw.line(pts, fill="black", width=1)
-    return img
-
 class DrawBoundingBox:
     def __init__(self, root, net, netOffset):
         self.root = root
@@ -64,19 +38,30 @@ class DrawBoundingBox:
             "Population Density in Commercial area",
             "Vehicle Ownership"
         ]
-        # Canvas & image
-        self.canvas = Canvas(root, width=800, height=600, bg="white")
+        # Canvas & tiled network view: wheel zooms, right button drag pans
+        self.width, self.height = 800, 600
+        self.canvas = Canvas(root, width=self.width, height=self.height, bg="white")
         self.canvas.pack()
-        self.img = draw_network_image(net)
-        self.photo = ImageTk.PhotoImage(self.img)
-        self.canvas.create_image(0,0,anchor="nw",image=self.photo)
+        self.pyramid = net_tiles.TilePyramid(net)
+        self.photos = {}
+        self.zoom = max(0, math.ceil(math.log2(max(self.width, self.height) / net_tiles.TILE)))
+        side = net_tiles.TILE * 2**self.zoom
+        self.view_x, self.view_y = (side - self.width) / 2, (side - self.height) / 2
+        self.render_view()
         # drawing vars
         self.start_x = self.start_y = None
         self.rect = self.bbox = None
+        self.drawn = []
+        self.pan_from = None
         # bind
         self.canvas.bind("<Button-1>", self.on_press)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.canvas.bind("<Button-3>", self.on_pan_start)
+        self.canvas.bind("<B3-Motion>", self.on_pan)
+        self.canvas.bind("<MouseWheel>", lambda e: self.zoom_at(e.x, e.y, 1 if e.delta > 0 else -1))
+        self.canvas.bind("<Button-4>", lambda e: self.zoom_at(e.x, e.y, 1))
+        self.canvas.bind("<Button-5>", lambda e: self.zoom_at(e.x, e.y, -1))
         # initial prompt
         self.prompt = tk.Label(root, text="Enter residential,commercial counts (e.g. 2,1):")
         self.prompt.pack()
@@ -100,6 +85,55 @@ class DrawBoundingBox:
             txt = f"Draw Commercial Area {self.stage-self.res_count+1}"
         self.prompt.config(text=txt); self.prompt.pack()
 
+    def to_sumo(self, x, y):
+        """Canvas pixel to network coordinates under the current zoom and pan."""
+        return self.pyramid.pixel_to_world(self.zoom, self.view_x + x, self.view_y + y)
+
+    def to_canvas(self, x, y):
+        px, py = self.pyramid.world_to_pixel(self.zoom, x, y)
+        return px - self.view_x, py - self.view_y
+
+    def render_view(self):
+        """Place the tiles visible at the current zoom and pan; only those are fetched."""
+        self.canvas.delete("tile")
+        T = net_tiles.TILE
+        n = self.pyramid.tiles_per_side(self.zoom)
+        tx0 = max(0, int(self.view_x // T)); tx1 = min(n - 1, int((self.view_x + self.width - 1) // T))
+        ty0 = max(0, int(self.view_y // T)); ty1 = min(n - 1, int((self.view_y + self.height - 1) // T))
+        visible = {}
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                key = (self.zoom, tx, ty)
+                photo = self.photos.get(key) or ImageTk.PhotoImage(self.pyramid.get_tile(*key))
+                visible[key] = photo
+                self.canvas.create_image(tx*T - self.view_x, ty*T - self.view_y,
+                                         anchor="nw", image=photo, tags="tile")
+        self.photos = visible
+        self.canvas.tag_lower("tile")
+
+    def redraw_regions(self):
+        for item, (s1, s2) in self.drawn:
+            self.canvas.coords(item, *self.to_canvas(*s1), *self.to_canvas(*s2))
+
+    def zoom_at(self, x, y, step):
+        z = min(self.pyramid.max_level, max(0, self.zoom + step))
+        if z == self.zoom:
+            return
+        f = 2.0 ** (z - self.zoom)
+        self.view_x = (self.view_x + x) * f - x
+        self.view_y = (self.view_y + y) * f - y
+        self.zoom = z
+        self.render_view(); self.redraw_regions()
+
+    def on_pan_start(self, e):
+        self.pan_from = (e.x, e.y)
+
+    def on_pan(self, e):
+        self.view_x -= e.x - self.pan_from[0]
+        self.view_y -= e.y - self.pan_from[1]
+        self.pan_from = (e.x, e.y)
+        self.render_view(); self.redraw_regions()
+
     def on_press(self, e):
         self.start_x, self.start_y = e.x,e.y
         self.rect = self.canvas.create_rectangle(e.x,e.y,e.x,e.y,outline='red')
@@ -108,17 +142,16 @@ class DrawBoundingBox:
         self.canvas.coords(self.rect,self.start_x,self.start_y,e.x,e.y)
 
     def on_release(self, e):
-        self.bbox = (self.start_x,self.start_y,e.x,e.y)
+        self.bbox = (self.to_sumo(self.start_x,self.start_y), self.to_sumo(e.x,e.y))
         self.btn_submit.pack()
 
     def submit(self):
         if not self.bbox: return
-        x1,y1,x2,y2 = self.bbox
-        xmin,ymin,xmax,ymax = self.net.getBoundary()
-        def to_sumo(x,y):
-            return xmin + (x/800)*(xmax-xmin), ymin + (y/600)*(ymax-ymin)
-        s1 = to_sumo(x1,y1); s2 = to_sumo(x2,y2)
-        latlon = (*net.convertXY2LonLat(*s1),*net.convertXY2LonLat(*s2))
+        s1, s2 = self.bbox
+        self.drawn.append((self.rect, self.bbox))
+        lon1, lat1 = self.net.convertXY2LonLat(*s1)
+        lon2, lat2 = self.net.convertXY2LonLat(*s2)
+        latlon = (min(lon1,lon2), min(lat1,lat2), max(lon1,lon2), max(lat1,lat2))
         if self.stage < self.res_count:
             self.res_areas[len(self.res_areas)+1]={"latlon":latlon}
         else:
@@ -169,245 +202,34 @@ class DrawBoundingBox:
         self.generate_trips(PRC,PCR)
 
     def build_edge_lists(self):
-        self.res_edge={k:[] for k in self.res_areas}
-        self.com_edge={k:[] for k in self.com_areas}
-        for e in net.getEdges():
-            s=net.convertXY2LonLat(*e.getFromNode().getCoord())
-            t=net.convertXY2LonLat(*e.getToNode().getCoord())
-            for k,v in self.res_areas.items():
-                minx,miny,maxx,maxy=v["latlon"]
-                if minx<=s[0]<=maxx and miny<=s[1]<=maxy and minx<=t[0]<=maxx and miny<=t[1]<=maxy:
-                    self.res_edge[k].append(e.getID())
-            for k,v in self.com_areas.items():
-                minx,miny,maxx,maxy=v["latlon"]
-                if minx<=s[0]<=maxx and miny<=s[1]<=maxy and minx<=t[0]<=maxx and miny<=t[1]<=maxy:
-                    self.com_edge[k].append(e.getID())
+        self.res_edge, self.com_edge = trip_scenario.edge_lists(self.net, self.res_areas, self.com_areas)
 
     def calc_area(self):
-        R=6371.0
-        self.res_km={}; self.com_km={}
-        for dct,out in ((self.res_areas,self.res_km),(self.com_areas,self.com_km)):
-            for k,v in dct.items():
-                minx,miny,maxx,maxy=v["latlon"]
-                dlat=math.radians(maxy-miny); dlon=math.radians(maxx-minx)
-                la1,la2=math.radians(miny),math.radians(maxy)
-                a=math.sin(dlat/2)**2+math.cos(la1)*math.cos(la2)*math.sin(dlon/2)**2
-                c=2*math.atan2(math.sqrt(a),math.sqrt(1-a))
-                h=R*c; w=R*dlon*math.cos((la1+la2)/2)
-                out[k]=h*w
-                                # ─── ADD THESE LINES ─────────────────────────────────────────────
-                if out is self.res_km:
-                    logger.info("Residential region %d area: %.3f km²", k, out[k])
-                else:
-                    logger.info("Commercial region %d area: %.3f km²", k, out[k])
-                # ────────────────────────────────────────────────────────────────
-
-    def generate_trips(self, PRC, PCR):
+        self.res_km = trip_scenario.area_km(self.res_areas, "Residential")
+        self.com_km = trip_scenario.area_km(self.com_areas, "Commercial")
+
+    def generate_trips(self, PRC, PCR, out='sim_dip.odtrips.xml', stream=True):
+        """
+        Write `out` (gzip-compressed when it ends in .gz) from the regions and
+        parameters entered in the dialogs. With stream=True trips are written
+        one (day, slot) window at a time; otherwise the whole trip table is
+        sampled in memory first.
+        """
         ent = self.city_param
-        ev_ratio = list(map(int, ent[self.params_list[0]].split(',')))
-        tsz = float(ent[self.params_list[1]])
-        days = int(ent[self.params_list[2]])
-        respd = float(ent[self.params_list[3]])
-        compd = float(ent[self.params_list[4]])
-        own = float(ent[self.params_list[5]])
-        pal = int(tsz * 3600)
-        T = int(24 / tsz)
-
-        ev_types = ['ev_car', 'ev_truck', 'ev_bus']
-        foss_types = ['foss_car', 'foss_truck', 'foss_bus']
-
-        self.build_edge_lists()
-        self.calc_area()
-        total_res = sum(self.res_km.values())
-        total_com = sum(self.com_km.values())
-
-        rho = []
-        RCN = {}
-        RRN = {}
-        CRN = {}
-        CCN = {}
-
-        for t in range(T):
-            mu, sig = PRC[t]
-            q = np.clip(np.random.normal(mu, sig), 0.0, 100.0) / 100
-            if q <= 0 or math.isnan(q):
-                q = mu / 100
-            rt = q * total_res * respd * own
-            rho.append(rt)
-            RCN[t] = np.random.poisson(lam=rt, size=days)
-            logger.info("Timeslot %d: rho=%s, RCN=%s", t, rt, RCN[t])
-
-            lam_rr = (1 - q) * total_res * respd * own
-            RRN[t] = np.random.poisson(lam=lam_rr, size=days)
-            logger.info("Timeslot %d: rho_RR=%s, RRN=%s", t, lam_rr, RRN[t])
-
-            mu2, sig2 = PCR[t]
-            q2 = np.clip(np.random.normal(mu2, sig2), 0.0, 100.0) / 100
-            if q2 <= 0 or math.isnan(q2):
-                q2 = mu2 / 100
-            lam_cr = q2 * total_com * compd * own
-            CRN[t] = np.random.poisson(lam=lam_cr, size=days)
-            logger.info("Timeslot %d: rho_CR=%s, CRN=%s", t, lam_cr, CRN[t])
-
-            lam_cc = (1 - q2) * total_com * compd * own
-            CCN[t] = np.random.poisson(lam=lam_cc, size=days)
-            logger.info("Timeslot %d: rho_CC=%s, CCN=%s", t, lam_cc, CCN[t])
-
-        HUG = []
-        trip_counts = {}  # NEW — Track region-to-region trip counts
-
-        # Residential → Commercial
-        for r, ra in self.res_km.items():
-            pr = ra / total_res
-            for c, ca in self.com_km.items():
-                pc = ca / total_com
-                for d in range(days):
-                    for s in range(T):
-                        n = int(pr * RCN[s][d] * pc)
-                        for _ in range(n):
-                            grp = random.choices(['EV', 'FOSS'], weights=ev_ratio, k=1)[0]
-                            tt = random.choice(ev_types if grp == 'EV' else foss_types)
-                            src = random.choice(self.res_edge[r])
-                            dst = random.choice(self.com_edge[c])
-                            dep = d * T * pal + s * pal + random.random() * pal
-                            HUG.append([f"R{r}C{c}D{d}S{s}_{len(HUG)}", tt, dep, src, dst])
-                            key = (f"R{r}", f"C{c}")  # NEW
-                            trip_counts[key] = trip_counts.get(key, 0) + 1  # NEW
-
-        # Residential → Residential
-        for r, ra in self.res_km.items():
-            pr = ra / total_res
-            for rr, rra in self.res_km.items():
-                prr = rra / total_res
-                for d in range(days):
-                    for s in range(T):
-                        n = int(pr * RRN[s][d] * prr)
-                        for _ in range(n):
-                            grp = random.choices(['EV', 'FOSS'], weights=ev_ratio, k=1)[0]
-                            tt = random.choice(ev_types if grp == 'EV' else foss_types)
-                            src = random.choice(self.res_edge[r])
-                            dst = random.choice(self.res_edge[rr])
-                            dep = d * T * pal + s * pal + random.random() * pal
-                            HUG.append([f"R{r}R{rr}D{d}S{s}_{len(HUG)}", tt, dep, src, dst])
-                            key = (f"R{r}", f"R{rr}")  # NEW
-                            trip_counts[key] = trip_counts.get(key, 0) + 1  # NEW
-
-        # Commercial → Residential
-        for c, ca in self.com_km.items():
-            pc = ca / total_com
-            for r, ra in self.res_km.items():
-                pr = ra / total_res
-                for d in range(days):
-                    for s in range(T):
-                        n = int(pc * CRN[s][d] * pr)
-                        for _ in range(n):
-                            grp = random.choices(['EV', 'FOSS'], weights=ev_ratio, k=1)[0]
-                            tt = random.choice(ev_types if grp == 'EV' else foss_types)
-                            src = random.choice(self.com_edge[c])
-                            dst = random.choice(self.res_edge[r])
-                            dep = d * T * pal + s * pal + random.random() * pal
-                            HUG.append([f"C{c}R{r}D{d}S{s}_{len(HUG)}", tt, dep, src, dst])
-                            key = (f"C{c}", f"R{r}")  # NEW
-                            trip_counts[key] = trip_counts.get(key, 0) + 1  # NEW
-
-        # Commercial → Commercial
-        for c, ca in self.com_km.items():
-            pc = ca / total_com
-            for cc, cca in self.com_km.items():
-                pcc = cca / total_com
-                for d in range(days):
-                    for s in range(T):
-                        n = int(pc * CCN[s][d] * pcc)
-                        for _ in range(n):
-                            grp = random.choices(['EV', 'FOSS'], weights=ev_ratio, k=1)[0]
-                            tt = random.choice(ev_types if grp == 'EV' else foss_types)
-                            src = random.choice(self.com_edge[c])
-                            dst = random.choice(self.com_edge[cc])
-                            dep = d * T * pal + s * pal + random.random() * pal
-                            HUG.append([f"C{c}C{cc}D{d}S{s}_{len(HUG)}", tt, dep, src, dst])
-                            key = (f"C{c}", f"C{cc}")  # NEW
-                            trip_counts[key] = trip_counts.get(key, 0) + 1  # NEW
-
-        # Print the trip count summary
-        print("\nTrip Count Between Region Pairs:")
-        for k, v in sorted(trip_counts.items()):
-            print(f"{k[0]} → {k[1]} : {v} trips")
-
-        # Continue with your existing XML writing logic (unchanged)
-        ...
-
-        with open('sim_dip.odtrips.xml','w') as f:
-            f.write('<routes>\n')
-            # EV types with full params:
-            f.write('<vType id="ev_car"   vClass="passenger" mass="1500" loading="0" length="4.5"  maxSpeed="80.0" accel="3.0" decel="4.5" sigma="0.5" tau="1.0" emissionClass="Energy/unknown">\n')
-            f.write('  <param key="has.battery.device" value="true" />\n')
-            f.write('  <param key="device.battery.capacity" value="20000" />\n')
-            f.write('  <param key="maximumPower" value="1000" />\n')
-            f.write('  <param key="device.battery.maximumChargeRate" value="150000" />\n')
-            f.write('  <param key="frontSurfaceArea" value="5" />\n')
-            f.write('  <param key="airDragCoefficient" value="0.6" />\n')
-            f.write('  <param key="rotatingMass" value="100" />\n')
-            f.write('  <param key="radialDragCoefficient" value="0.5" />\n')
-            f.write('  <param key="rollDragCoefficient" value="0.01" />\n')
-            f.write('  <param key="constantPowerIntake" value="100" />\n')
-            f.write('  <param key="propulsionEfficiency" value="0.9" />\n')
-            f.write('  <param key="recuperationEfficiency" value="0.0" />\n')
-            f.write('  <param key="stoppingThreshold" value="0.1" />\n')
-            f.write('  <param key="device.battery.chargeLevelTable" value="0 0.5 1" />\n')
-            f.write('  <param key="device.battery.chargeCurveTable" value="150000 75000 30000" />\n')
-            f.write('</vType>\n')
-            f.write('<vType id="ev_truck" vClass="truck"     mass="12000" loading="0" length="12.0" maxSpeed="60.0" accel="1.2" decel="3.0" sigma="0.5" tau="1.0" emissionClass="Energy/unknown">\n')
-            f.write('  <param key="has.battery.device" value="true" />\n')
-            f.write('  <param key="device.battery.capacity" value="30000" />\n')
-            f.write('  <param key="maximumPower" value="1500" />\n')
-            f.write('  <param key="device.battery.maximumChargeRate" value="200000" />\n')
-            f.write('  <param key="frontSurfaceArea" value="8" />\n')
-            f.write('  <param key="airDragCoefficient" value="0.7" />\n')
-            f.write('  <param key="rotatingMass" value="300" />\n')
-            f.write('  <param key="radialDragCoefficient" value="0.6" />\n')
-            f.write('  <param key="rollDragCoefficient" value="0.02" />\n')
-            f.write('  <param key="constantPowerIntake" value="200" />\n')
-            f.write('  <param key="propulsionEfficiency" value="0.85" />\n')
-            f.write('  <param key="recuperationEfficiency" value="0.1" />\n')
-            f.write('  <param key="stoppingThreshold" value="0.1" />\n')
-            f.write('  <param key="device.battery.chargeLevelTable" value="0 0.5 1" />\n')
-            f.write('  <param key="device.battery.chargeCurveTable" value="150000 80000 35000" />\n')
-            f.write('</vType>\n')
-            f.write('<vType id="ev_bus"   vClass="bus"       mass="8000"  loading="0" length="13.0" maxSpeed="50.0" accel="1.5" decel="3.5" sigma="0.5" tau="1.0" emissionClass="Energy/unknown">\n')
-            f.write('  <param key="has.battery.device" value="true" />\n')
-            f.write('  <param key="device.battery.capacity" value="25000" />\n')
-            f.write('  <param key="maximumPower" value="1200" />\n')
-            f.write('  <param key="device.battery.maximumChargeRate" value="180000" />\n')
-            f.write('  <param key="frontSurfaceArea" value="10" />\n')
-            f.write('  <param key="airDragCoefficient" value="0.8" />\n')
-            f.write('  <param key="rotatingMass" value="400" />\n')
-            f.write('  <param key="radialDragCoefficient" value="0.7" />\n')
-            f.write('  <param key="rollDragCoefficient" value="0.015" />\n')
-            f.write('  <param key="constantPowerIntake" value="250" />\n')
-            f.write('  <param key="propulsionEfficiency" value="0.8" />\n')
-            f.write('  <param key="recuperationEfficiency" value="0.2" />\n')
-            f.write('  <param key="stoppingThreshold" value="0.1" />\n')
-            f.write('  <param key="device.battery.chargeLevelTable" value="0 0.5 1" />\n')
-            f.write('  <param key="device.battery.chargeCurveTable" value="150000 90000 40000" />\n')
-            f.write('</vType>\n')
-            # fossil types
-            for vt in [
-                '<vType id="foss_car"   vClass="passenger" length="4.5"  maxSpeed="70.0" accel="3.0" decel="4.5" sigma="0.0" />',
-                '<vType id="foss_truck" vClass="truck"     length="12.0" maxSpeed="60.0" accel="1.5" decel="3.5" sigma="0.0" />',
-                '<vType id="foss_bus"   vClass="bus"       length="13.0" maxSpeed="50.0" accel="2.0" decel="4.0" sigma="0.0" />'
-            ]:
-                f.write(vt + "\n")
-            # trip entries
-            for trip in sorted(HUG, key=lambda x: x[2]):
-                f.write(
-                    f'<trip id="{trip[0]}" type="{trip[1]}" '
-                    f'depart="{trip[2]:.2f}" from="{trip[3]}" to="{trip[4]}" />\n'
-                )
-            f.write('</routes>\n')
-        print("Trip File Generation Successful: sim_dip.odtrips.xml")
+        city = {
+            "ev_ratio": ent[self.params_list[0]].split(','),
+            "timeslot_hours": ent[self.params_list[1]],
+            "days": ent[self.params_list[2]],
+            "residential_density": ent[self.params_list[3]],
+            "commercial_density": ent[self.params_list[4]],
+            "ownership": ent[self.params_list[5]],
+        }
+        trip_scenario.generate(self.net, self.res_areas, self.com_areas, city, PRC, PCR,
+                               out=out, stream=stream)
         self.root.destroy()
 
 if __name__=="__main__":
+    net = trip_scenario.get_network('new.net.xml')
     root=tk.Tk()
-    DrawBoundingBox(root, net, netOffset)
+    DrawBoundingBox(root, net, net.getLocationOffset())
     root.mainloop()